@@ -29,6 +29,8 @@ import psycopg2 as db
 import platform
 import random
 import json
+import select
+import threading
 
 
 PROC_TABLE="proc_jobs"
@@ -48,18 +50,101 @@ STATUS_ERROR=3
 #status INTEGER, rcode INTEGER, msg TEXT, client TEXT, priority INTEGER, version INTEGER)"""
 #CREATE_SCRIPT_TABLE="CREATE TABLE proc_scripts(id INTEGER PRIMARY KEY, name TEXT UNIQUE, code TEXT)"
 
-def proc_client(p_number,db_cstr,lock):
+#Number of jobs a client claims at a time - and limits (in seconds) of the backoff when there is nothing to do.
+CLAIM_BATCH=4
+IDLE_WAIT_MIN=0.5
+IDLE_WAIT_MAX=60
+#Channel used to tell listening clients that new jobs were pushed.
+NOTIFY_CHANNEL="proc_jobs"
+#Leases: a client refreshes the heartbeat of its claimed jobs every HEARTBEAT_INTERVAL seconds.
+#Jobs without a heartbeat for LEASE_TIME seconds are put back in the queue - or marked as errors after MAX_ATTEMPTS claims.
+HEARTBEAT_INTERVAL=30
+LEASE_TIME=300
+MAX_ATTEMPTS=3
+
+#Claim a batch of open jobs atomically - rows locked by other clients are skipped rather than waited for.
+CLAIM_JOBS_SQL="""update proc_jobs set status=%s, client=%s, version=version+1, heartbeat=clock_timestamp(), attempts=coalesce(attempts,0)+1
+where ogc_fid in (select ogc_fid from proc_jobs where status=0 order by priority desc, cost desc nulls last limit %s for update skip locked)
+returning ogc_fid,path,ref_cstr,job_id,priority,cost"""
+
+#Columns of proc_jobs added after the first version of the table - (name,type).
+#Tables created by an earlier version of this script are upgraded by upgrade_tables.
+ADDED_COLUMNS=[("cost","real"),("heartbeat","timestamp"),("attempts","smallint")]
+#Width of the client column - client names are truncated to fit.
+CLIENT_WIDTH=128
+
+def upgrade_tables(cur):
+    #Add missing columns to proc_jobs and widen the client column. Returns the names of the changed columns.
+    cur.execute("select column_name,character_maximum_length from information_schema.columns where table_name=%s and table_schema=any(current_schemas(false))",(PROC_TABLE,))
+    existing=dict(cur.fetchall())
+    changed=[]
+    for name,col_type in ADDED_COLUMNS:
+        if name not in existing:
+            cur.execute("alter table proc_jobs add column if not exists "+name+" "+col_type)
+            changed.append(name)
+    if (existing.get("client") or CLIENT_WIDTH)<CLIENT_WIDTH:
+        cur.execute("alter table proc_jobs alter column client type character varying(%d)"%CLIENT_WIDTH)
+        changed.append("client")
+    return changed
+
+def client_name(p_number):
+    #Name of a processing client as stored in the job table - the host name is truncated to fit CLIENT_WIDTH.
+    suffix=":%d"%p_number
+    return platform.node()[:CLIENT_WIDTH-len(suffix)]+suffix
+
+def claim_jobs(cur,client,n):
+    #Claim up to n open jobs. Returns a list of (ogc_fid,path,ref_cstr,job_id), most important first.
+    cur.execute(CLAIM_JOBS_SQL,(STATUS_PROCESSING,client,n))
+    rows=cur.fetchall()
+    #returning does not keep the order of the sub select
+    rows.sort(key=lambda row:(-row[4],row[5] is None,-(row[5] or 0)))
+    return [row[:4] for row in rows]
+
+def reap_jobs(cur,lease_time=LEASE_TIME,max_attempts=MAX_ATTEMPTS):
+    #Re-queue jobs whose lease has expired (the client died). Returns (number re-queued, number given up).
+    expired="status=%s and heartbeat<clock_timestamp()-%s*interval '1 second'"
+    cur.execute("update proc_jobs set status=%s,msg=%s,exe_end=clock_timestamp() where "+expired+" and attempts>=%s",
+        (STATUS_ERROR,"Lease expired.",STATUS_PROCESSING,lease_time,max_attempts))
+    n_failed=cur.rowcount
+    cur.execute("update proc_jobs set status=0,client=null,exe_start=null,version=version+1 where "+expired,
+        (STATUS_PROCESSING,lease_time))
+    return cur.rowcount,n_failed
+
+def heartbeat(db_cstr,client,stop,logger,interval=HEARTBEAT_INTERVAL):
+    #Keep the leases of the jobs claimed by client alive - runs in a thread with its own connection.
+    try:
+        con=db.connect(db_cstr)
+        con.autocommit=True
+        cur=con.cursor()
+        while not stop.wait(interval):
+            cur.execute("update proc_jobs set heartbeat=clock_timestamp() where client=%s and status=%s",(client,STATUS_PROCESSING))
+    except Exception as e:
+        #the leases will expire - and our jobs will be handed to other clients
+        logger.error("Heartbeat stopped:\n"+str(e))
+
+def wait_for_jobs(con,timeout):
+    #Wait until new jobs are pushed (or timeout seconds have passed).
+    if select.select([con],[],[],timeout)!=([],[],[]):
+        con.poll()
+        del con.notifies[:]
+
+def proc_client(p_number,db_cstr,lock,batch=CLAIM_BATCH,lease_time=LEASE_TIME):
     #The processing client which should be importable from all processes.
-    client=platform.node()+":%d"%p_number
+    client=client_name(p_number)
     logger = multiprocessing.log_to_stderr()
     logger.setLevel(logging.INFO)
     try:
         con=db.connect(db_cstr)
         cur=con.cursor()
+        cur.execute("LISTEN "+NOTIFY_CHANNEL)
+        con.commit()
     except Exception as e:
         logger.error("Unable to connect db:\n"+str(e))
         return #stop
-    time.sleep(2+random.random()*2)
+    stop=threading.Event()
+    beat=threading.Thread(target=heartbeat,args=(db_cstr,client,stop,logger,min(HEARTBEAT_INTERVAL,lease_time/3.0)))
+    beat.daemon=True
+    beat.start()
     logger.info("I'm ready - listening for stuff to do.")
     logname="proc_client_"+(time.asctime().split()[-2]).replace(":","_")+"_"+str(p_number)+".log"
     logname=os.path.join(LOGDIR,logname)
@@ -68,58 +153,72 @@ def proc_client(p_number,db_cstr,lock):
     stderr=osutils.redirect_stderr(logfile)
     sl="*-*"*23+"\n"
     stdout.write(sl+"Process %d is listening.\n"%p_number+sl)
+    #definitions are fixed once pushed - so only look them up once
+    definitions={}
+    idle_wait=IDLE_WAIT_MIN
+    t_last_reap=0
     alive=True
     while alive:
-        time.sleep(random.random()*2)
-        cur.execute("select ogc_fid,path,ref_cstr,job_id,version from proc_jobs where status=0 order by priority desc limit 1")
-        task=cur.fetchone()
-        if task is None:
-            continue
-        id,path,ref_path,job_id,version=task
-        #logger.info("version was: %d" %version)
-        cur.execute("update proc_jobs set status=%s, client=%s, version=%s, exe_start=clock_timestamp() where ogc_fid=%s and version=%s",(STATUS_PROCESSING,client,version+1,id,version))
-        if cur.rowcount!=1:
-            logger.warning("Failed to grab a row - probably a concurrency issue.")
-            continue
-        con.commit()
-        cur.execute("select testname,report_schema,run_id,targs from proc_defs where id=%s",(job_id,))
-        data=cur.fetchone()
-        if data is None:
-            logger.error("Could not select definition with id: %s" %job_id)
-            cur.execute("update proc_jobs set status=%s,msg=%s where ogc_fid=%s",(STATUS_ERROR,"Definition did not exist.",id))
+        if time.time()-t_last_reap>HEARTBEAT_INTERVAL:
+            n_requeued,n_failed=reap_jobs(cur,lease_time)
             con.commit()
+            if n_requeued+n_failed>0:
+                logger.info("Leases expired: re-queued %d job(s), gave up on %d job(s)."%(n_requeued,n_failed))
+            t_last_reap=time.time()
+        tasks=claim_jobs(cur,client,batch)
+        con.commit()
+        #we look for jobs anyway - forget notifications received in the meantime
+        del con.notifies[:]
+        if len(tasks)==0:
+            #back off (with a bit of jitter) - but wake up when new jobs are pushed
+            wait_for_jobs(con,idle_wait*(1+random.random()))
+            idle_wait=min(2*idle_wait,IDLE_WAIT_MAX)
             continue
-        testname,schema,runid,targs=data
-        logger.info("Was told to do job with id %s, test %s, on data (%s,%s)" %(job_id,testname,path,ref_path))
-        #now just run the script.... hmm - perhaps import with importlib and run it??
-        stdout.write(sl+"[proc_client] Doing definition %s from %s, test: %s\n"%(job_id,db_cstr,testname))
-        args={"__name__":"qc_wrap","path":path}
-        try:
-            targs=json.loads(targs) #convert to a python list
-            test_func=qc.get_test(testname)
-            use_ref_data=qc.tests[testname][0]
-            use_reporting=qc.tests[testname][1]
-            #both of these can be None - but that's ok.
-            if use_reporting:
-                report.set_run_id(runid)
-                report.set_schema(schema)
-            send_args=[testname,path]
-            if use_ref_data:
-                assert(len(ref_path)>0)
-                send_args.append(ref_path)
-            send_args+=targs
-            rc=test_func(send_args)
-
-        except Exception as e:
-            stderr.write("[proc_client]: Exception caught:\n"+str(e)+"\n")
-            stderr.write("[proc_client]: Traceback:\n"+traceback.format_exc()+"\n")
-            logger.error("Caught: \n"+str(e))
-            msg=str(e)[:128] #truncate msg for now - or use larger field width.
-            cur.execute("update proc_jobs set status=%s,msg=%s where ogc_fid=%s",(STATUS_ERROR,msg,id))
-            con.commit()
-        else:
-            cur.execute("update proc_jobs set status=%s,rcode=%s,msg=%s,exe_end=clock_timestamp() where ogc_fid=%s",(STATUS_OK,rc,"OK",id))
+        idle_wait=IDLE_WAIT_MIN
+        for id,path,ref_path,job_id in tasks:
+            cur.execute("update proc_jobs set exe_start=clock_timestamp() where ogc_fid=%s",(id,))
             con.commit()
+            if job_id not in definitions:
+                cur.execute("select testname,report_schema,run_id,targs from proc_defs where id=%s",(job_id,))
+                definitions[job_id]=cur.fetchone()
+            data=definitions[job_id]
+            if data is None:
+                logger.error("Could not select definition with id: %s" %job_id)
+                cur.execute("update proc_jobs set status=%s,msg=%s where ogc_fid=%s",(STATUS_ERROR,"Definition did not exist.",id))
+                con.commit()
+                continue
+            testname,schema,runid,targs=data
+            logger.info("Was told to do job with id %s, test %s, on data (%s,%s)" %(job_id,testname,path,ref_path))
+            #now just run the script.... hmm - perhaps import with importlib and run it??
+            stdout.write(sl+"[proc_client] Doing definition %s from %s, test: %s\n"%(job_id,db_cstr,testname))
+            args={"__name__":"qc_wrap","path":path}
+            try:
+                targs=json.loads(targs) #convert to a python list
+                test_func=qc.get_test(testname)
+                use_ref_data=qc.tests[testname][0]
+                use_reporting=qc.tests[testname][1]
+                #both of these can be None - but that's ok.
+                if use_reporting:
+                    report.set_run_id(runid)
+                    report.set_schema(schema)
+                send_args=[testname,path]
+                if use_ref_data:
+                    assert(len(ref_path)>0)
+                    send_args.append(ref_path)
+                send_args+=targs
+                rc=test_func(send_args)
+
+            except Exception as e:
+                stderr.write("[proc_client]: Exception caught:\n"+str(e)+"\n")
+                stderr.write("[proc_client]: Traceback:\n"+traceback.format_exc()+"\n")
+                logger.error("Caught: \n"+str(e))
+                msg=str(e)[:128] #truncate msg for now - or use larger field width.
+                #only if we still hold the lease - otherwise the job belongs to someone else now
+                cur.execute("update proc_jobs set status=%s,msg=%s,exe_end=clock_timestamp() where ogc_fid=%s and client=%s",(STATUS_ERROR,msg,id,client))
+                con.commit()
+            else:
+                cur.execute("update proc_jobs set status=%s,rcode=%s,msg=%s,exe_end=clock_timestamp() where ogc_fid=%s and client=%s",(STATUS_OK,rc,"OK",id,client))
+                con.commit()
 
 
 
@@ -141,6 +240,8 @@ if __name__=="__main__":
     parser_push.add_argument("-tilesql",dest="INPUT_LAYER_SQL",help="Specify SQL to select path from input tile layer.")
     parser_push.add_argument("-targs",dest="TARGS",help="Specify target argument list (as a quoted string) - will override parameter file definition.")
     parser_push.add_argument("-priority",dest="PRIORITY",type=int,help="Priority of job (0->??).")
+    parser_push.add_argument("-cost_order",dest="COST_ORDER",choices=[0,1],type=int,help="Estimate the cost of each tile, so that the most expensive tiles are processed first (value must be 0 or 1).")
+    parser_push.add_argument("-cost_db",dest="COST_DB",help="Process db of a previous qc_wrap run of the test - runtimes from there are used as tile costs.")
     push_group=parser.add_mutually_exclusive_group()
     push_group.add_argument("-refcon",dest="REF_DATA_CONNECTION",help="Specify connection string to (non-tiled) reference data.")
     push_group.add_argument("-reftiles",dest="REF_TILE_DB",help="Specify path to reference tile db")
@@ -148,13 +249,17 @@ if __name__=="__main__":
     parser_create = subparsers.add_parser("create", help="create help", description="Create processing tables in a db.")
     parser_create.add_argument("cstr",help="Connetion string to db.")
     parser_create.add_argument("-drop",help="Drop processing tables.",action="store_true")
+    parser_create.add_argument("-upgrade",help="Add columns missing in processing tables created by an earlier version.",action="store_true")
     #work
     parser_work= subparsers.add_parser("work", help="work help", description="Volunteer for some work.")
     parser_work.add_argument("cstr",help="Connection string to processing db.")
     parser_work.add_argument("-n",dest="MP",type=int,help="Specify maximal number of processes to spawn (defaults to number of kernels).")
+    parser_work.add_argument("-batch",type=int,default=CLAIM_BATCH,help="Number of jobs each process claims at a time (defaults to %d)."%CLAIM_BATCH)
+    parser_work.add_argument("-lease",type=float,default=LEASE_TIME,help="Seconds without a heartbeat before a claimed job is re-queued (defaults to %d)."%LEASE_TIME)
     #info
     parser_info = subparsers.add_parser("info", help="info help", description="Show some info for the processeing tables.")
     parser_info.add_argument("cstr",help="Connection string to db.")
+    parser_info.add_argument("-clients",action="store_true",help="Show throughput statistics per client and test.")
     #update
     parser_update=subparsers.add_parser("update", help="update help", description="Execute a sql command on the processing tables.")
     parser_update.add_argument("cstr",help="Connection string to db.")
@@ -169,8 +274,8 @@ if __name__=="__main__":
     CREATE TABLE proc_jobs(ogc_fid serial PRIMARY KEY, tile_name character varying(15), path character varying(128), ref_cstr character varying(128),
     job_id integer REFERENCES proc_defs(id) ON DELETE RESTRICT, exe_start timestamp, exe_end timestamp,
     status smallint, rcode smallint, msg character varying(128),
-    client character varying(32),
-    priority smallint, version smallint);
+    client character varying(128),
+    priority smallint, version smallint, cost real, heartbeat timestamp, attempts smallint);
     SELECT AddGeometryColumn('proc_jobs','wkb_geometry',25832,'POLYGON',2);
     CREATE INDEX proc_jobs_geom_idx
       ON proc_jobs
@@ -190,6 +295,16 @@ if __name__=="__main__":
         con.close()
         print("Successfully created processing tables in "+cstr)
 
+    def upgrade(cstr):
+        con=db.connect(cstr)
+        cur=con.cursor()
+        changed=upgrade_tables(cur)
+        con.commit()
+        cur.close()
+        con.close()
+        if changed:
+            print("Upgraded column(s) %s of processing tables in %s" %(",".join(changed),cstr))
+
     def drop_tables(cstr):
         areyousure=input("Are you really, really sure you wanna drop tables and kill all clients? [YES/no]:")
         if areyousure.strip()=="YES":
@@ -211,22 +326,27 @@ if __name__=="__main__":
         runid=job_def["RUN_ID"]
         schema=job_def["SCHEMA"]
         priority=job_def["PRIORITY"]
-        client=platform.node()
+        client=platform.node()[:32] #width of created_by
         n_tiles=len(matched_files)
+        costs=[None]*n_tiles
+        if job_def["COST_ORDER"]:
+            costs=estimate_costs(matched_files,testname,job_def["COST_DB"])
         cur.execute("insert into proc_defs(testname,report_schema,run_id,targs,n_tiles,created_time,created_by) values(%s,%s,%s,%s,%s,now(),%s) returning id",(testname,schema,runid,targs,n_tiles,client))
         job_id= cur.fetchone()[0]
         n_added=0
         #Now add a row in job_def table
-        for tile_path,ref_path in matched_files:
+        for (tile_path,ref_path),cost in zip(matched_files,costs):
             try: #or use ogr-geometry
                 tile=constants.get_tilename(tile_path)
                 wkt=constants.tilename_to_extent(tile,return_wkt=True)
             except Exception as e:
                 print("Bad tilename in "+tile_path)
                 continue
-            cur.execute("insert into proc_jobs(wkb_geometry,tile_name,path,ref_cstr,job_id,status,priority,version) values(st_geomfromtext(%s,25832),%s,%s,%s,%s,%s,%s,%s)",(wkt,tile,tile_path,ref_path,job_id,0,priority,0))
+            cur.execute("insert into proc_jobs(wkb_geometry,tile_name,path,ref_cstr,job_id,status,priority,version,cost,attempts) values(st_geomfromtext(%s,25832),%s,%s,%s,%s,%s,%s,%s,%s,0)",(wkt,tile,tile_path,ref_path,job_id,0,priority,0,cost))
             n_added+=1
         print("Inserted %d rows." %n_added)
+        #wake up listening clients
+        cur.execute("NOTIFY "+NOTIFY_CHANNEL)
         con.commit()
         cur.close()
         con.close()
@@ -250,6 +370,23 @@ if __name__=="__main__":
             n_defs=cur.fetchone()[0]
         return n_todo,n_proc,n_done,n_err,n_defs
 
+    def get_client_stats(cstr,lease_time=LEASE_TIME):
+        #Throughput per client and test - and the state of the leases held by each client.
+        con=db.connect(cstr)
+        cur=con.cursor()
+        cur.execute("""select j.client,d.testname,count(*),avg(extract(epoch from j.exe_end-j.exe_start))::float8,
+        extract(epoch from max(j.exe_end)-min(j.exe_start))::float8 from proc_jobs j join proc_defs d on j.job_id=d.id
+        where j.status in (%s,%s) and j.exe_start is not null and j.exe_end is not null
+        group by j.client,d.testname order by j.client,d.testname""",(STATUS_OK,STATUS_ERROR))
+        throughput=cur.fetchall()
+        cur.execute("""select client,count(*),extract(epoch from clock_timestamp()-max(heartbeat))::float8,
+        sum((heartbeat<clock_timestamp()-%s*interval '1 second')::int) from proc_jobs where status=%s
+        group by client order by client""",(lease_time,STATUS_PROCESSING))
+        leases=cur.fetchall()
+        cur.close()
+        con.close()
+        return throughput,leases
+
     def show_defs(cstr,limit=None):
         con=db.connect(cstr)
         cur=con.cursor()
@@ -286,6 +423,8 @@ def main(args):
     if pargs.mode=="create":
         if pargs.drop:
             drop_tables(pargs.cstr)
+        elif pargs.upgrade:
+            upgrade(pargs.cstr)
         else:
             create_tables(pargs.cstr)
         return
@@ -294,6 +433,7 @@ def main(args):
         if rc!=0:
             #something went wrong - msg. should have been displayed
             return
+        upgrade(pargs.cstr)
         push_job(pargs.cstr,matched_files,args)
         return
     if pargs.mode=="info":
@@ -304,6 +444,19 @@ def main(args):
         print("Finished jobs  : %d"%n_done)
         print("Exceptions     : %d"%n_err)
         print("Job definitions: %d" %n_defs)
+        if pargs.clients:
+            throughput,leases=get_client_stats(pargs.cstr)
+            fmt="{0:<32s} {1:<16s} {2:>8s} {3:>10s} {4:>12s}"
+            print("")
+            print(fmt.format("client","testname","n_tiles","tiles/h","mean time(s)"))
+            for client,testname,n,mean_time,span in throughput:
+                rate=n*3600.0/span if span else 0
+                print(fmt.format(str(client),testname,str(n),"%.1f"%rate,"%.1f"%mean_time))
+            fmt="{0:<32s} {1:>8s} {2:>16s} {3:>8s}"
+            print("")
+            print(fmt.format("client","claimed","last beat (s)","expired"))
+            for client,n,age,n_expired in leases:
+                print(fmt.format(str(client),str(n),"%.0f"%age if age is not None else "-",str(n_expired or 0)))
         return
     if pargs.mode=="update":
         update_tables(pargs.cstr,pargs.sql)
@@ -312,6 +465,8 @@ def main(args):
        show_defs(pargs.cstr)
        return
     assert(pargs.mode=="work")
+    #clients expect the current table layout
+    upgrade(pargs.cstr)
     #start a pool of worker processes
     if pargs.MP is None:
         pargs.MP=multiprocessing.cpu_count()
@@ -319,7 +474,7 @@ def main(args):
     workers=[]
     lock=multiprocessing.Lock()
     for i in range(pargs.MP):
-        p = multiprocessing.Process(target=proc_client, args=(i,pargs.cstr,lock))
+        p = multiprocessing.Process(target=proc_client, args=(i,pargs.cstr,lock,pargs.batch,pargs.lease))
         workers.append(p)
         p.start()
     #Now watch the processing#
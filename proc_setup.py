@@ -17,7 +17,8 @@ Base functionality for processing definitions.
 
 NAMES WHICH CAN BE DEFINED IN PARAM-FILE:
     - Inputs and processing script:
-        TESTNAME: some_test
+        TESTNAME: some_test. qc_wrap also accepts several tests, given as a list or
+                  comma separated, which are run one after the other on each tile
         INPUT_TILE_CONNECTION: Some ogr-readable layer containing tilenames
         INPUT_LAYER_SQL: OGR-sql to select path attributte of tiles e.g. select path
                          from coverage, or select some_field as path from some_layer
@@ -41,6 +42,9 @@ NAMES WHICH CAN BE DEFINED IN PARAM-FILE:
     - Process specific controls:
         MP: Maximal number of processes to spawn - will use qc_wrap default if not defined.
         RUN_ID: Can be set to a number and passed on to reporting database.
+        COST_ORDER: Hand out the most expensive tiles first (see estimate_costs). Boolean.
+        COST_DB: Process db of a previous qc_wrap run of the same test. Runtimes from
+                 there are used as tile costs when ordering by cost.
 
     - Additional arguments to pass on to test:
         TARGS: List of test-specific command line arguments, for example
@@ -54,12 +58,20 @@ import os
 import shlex
 import textwrap
 import sys
+import time
+import sqlite3
 
 from osgeo import ogr
 
 import qc
 from qc.db import report
 from qc import dhmqc_constants as constants
+from qc.thatsDEM import las_io
+
+# Status of a tile in a process db (qc_wrap) or job table (pcm)
+STATUS_PROCESSING = 1
+STATUS_OK = 2
+STATUS_ERROR = 3
 
 def execute_file(filename, globals=None, locals=None):
     """"Execute a .py file. Essentially, provide execfile() for Python 3."""
@@ -98,7 +110,14 @@ QC_WRAP_NAMES = {"TESTNAME": str,
                  "TARGS": list,
                  "post_execute": StatusUpdater,
                  "status_update": StatusUpdater,
-                 "STATUS_INTERVAL": float}
+                 "STATUS_INTERVAL": float,
+                 "INDEX_CACHE": str,
+                 "TILE_CACHE": int,
+                 "SPATIAL_ORDER": bool,
+                 "RETRIES": int,
+                 "SPECULATE": bool,
+                 "COST_ORDER": bool,
+                 "COST_DB": str}
 
 # Names which are relevant for job definitions for the 'listening client'
 PCM_NAMES = {"TESTNAME": str,
@@ -112,7 +131,9 @@ PCM_NAMES = {"TESTNAME": str,
              "REF_TILE_PATH_FIELD": str,
              "RUN_ID": int,
              "PRIORITY": int,
-             "TARGS": list}
+             "TARGS": list,
+             "COST_ORDER": bool,
+             "COST_DB": str}
 
 # Placeholders for testname,n_done and n_exceptions
 # names that really must be defined
@@ -126,6 +147,10 @@ QC_WRAP_DEFAULTS = {
     "REF_TILE_PATH_FIELD": "path",
     "TARGS": [],
     "STATUS_INTERVAL": 3600,
+    "SPATIAL_ORDER": False,
+    "RETRIES": 1,
+    "SPECULATE": False,
+    "COST_ORDER": False,
 }
 # DEFAULTS FOR THE LISTENING CLIENT
 PCM_DEFAULTS = {
@@ -134,6 +159,7 @@ PCM_DEFAULTS = {
     "REF_TILE_PATH_FIELD": "path",
     "TARGS": [],
     "PRIORITY": 0,
+    "COST_ORDER": False,
 }
 
 
@@ -161,6 +187,8 @@ def get_definitions(all_names, defaults, definitions, override=None):
                 val = override[key]
         if val is not None:
             # apply converters
+            if key == "TESTNAME" and isinstance(val, (list, tuple)):
+                val = ",".join(val)
             if key == "TARGS":
                 if isinstance(val, str) or isinstance(val, str):
                     val = shlex.split(val)
@@ -170,23 +198,31 @@ def get_definitions(all_names, defaults, definitions, override=None):
                 print("Value of " + key + " could not be converted: \n" + str(e))
                 raise e
             if key == "TESTNAME":
-                val = os.path.basename(val).replace(".py", "")
+                val = ",".join(os.path.basename(name.strip()).replace(".py", "") for name in val.split(","))
             args[key] = val
             print("Defining " + key + ": " + repr(val))
     return args
 
 
+def split_testnames(testname):
+    '''
+    Return the list of tests in a (comma separated) TESTNAME definition.
+    '''
+    return testname.split(",")
+
+
 def show_tests():
     print("Currently valid tests:")
     for t in qc.tests:
         print("               " + t)
 
 
-def validate_job_definition(args, must_be_defined, create_layers=True):
+def validate_job_definition(args, must_be_defined, create_layers=True, several_tests=False):
     '''
     A refactored job def checker which can be usefull outside of qc_wrap.
     For now simply print both user-info and error messages and return a boolean.
     This is supposed to be executed from the command line.
+    If several_tests is True, TESTNAME may name several (comma separated) tests.
     '''
 
     # consider using a logger (info / warning / error).
@@ -195,14 +231,19 @@ def validate_job_definition(args, must_be_defined, create_layers=True):
             print("ERROR: " + key + " must be defined.")
             return False
 
-    if not args["TESTNAME"] in qc.tests:
-        print("%s,defined in parameter file, not matched to any test (yet....)\n" %
-              args["TESTNAME"])
-        show_tests()
+    testnames = split_testnames(args["TESTNAME"])
+    if len(testnames) > 1 and not several_tests:
+        print("ERROR: Only one test can be defined here - got %s" % args["TESTNAME"])
         return False
+    for testname in testnames:
+        if not testname in qc.tests:
+            print("%s,defined in parameter file, not matched to any test (yet....)\n" %
+                  testname)
+            show_tests()
+            return False
     # see if test uses ref-data and reference data is defined..
-    use_ref_data = qc.tests[args["TESTNAME"]][0]
-    use_reporting = qc.tests[args["TESTNAME"]][1]
+    use_ref_data = any(qc.tests[testname][0] for testname in testnames)
+    use_reporting = any(qc.tests[testname][1] for testname in testnames)
     ref_data_defined = False
     for key in ["REF_DATA_CONNECTION", "REF_TILE_DB"]:
         ref_data_defined |= (args[key] is not None)
@@ -214,24 +255,25 @@ def validate_job_definition(args, must_be_defined, create_layers=True):
             print(textwrap.dedent(msg))
             return False
 
-    # import valid arguments from test
-    test_parser = qc.get_argument_parser(args["TESTNAME"])
-    if len(args["TARGS"]) > 0:  # validate targs
-        print("Validating arguments for " + args["TESTNAME"])
-        if test_parser is not None:
-            _targs = ["dummy"]
-            if use_ref_data:
-                _targs.append("dummy")
-            _targs.extend(args["TARGS"])
-            try:
-                test_parser.parse_args(_targs)
-            except Exception as e:
-                print("Error parsing arguments for test script " + args["TESTNAME"] + ":")
-                print(str(e))
-                return False
-        else:
-            print("No argument parser in " + args["TESTNAME"] +
-                  " - unable to check arguments to test.")
+    # import valid arguments from test - TARGS are passed on to all tests
+    for testname in testnames:
+        test_parser = qc.get_argument_parser(testname)
+        if len(args["TARGS"]) > 0:  # validate targs
+            print("Validating arguments for " + testname)
+            if test_parser is not None:
+                _targs = ["dummy"]
+                if qc.tests[testname][0]:
+                    _targs.append("dummy")
+                _targs.extend(args["TARGS"])
+                try:
+                    test_parser.parse_args(_targs)
+                except Exception as e:
+                    print("Error parsing arguments for test script " + testname + ":")
+                    print(str(e))
+                    return False
+            else:
+                print("No argument parser in " + testname +
+                      " - unable to check arguments to test.")
 
     if use_reporting:
         # this will not be supported for the listening client... so an optional keyword
@@ -360,9 +402,80 @@ def get_input_tiles(input_tile_connection, input_layer_sql=None):
     return input_files
 
 
-def setup_job(all_names, defaults, cmdline_args, param_file=None):
+def get_previous_runtimes(db_name, testname):
+    '''
+    Get the runtimes (in seconds) of the tiles successfully processed in a previous qc_wrap run.
+    Uses the runtime column if present, otherwise the (second resolution) start and end times.
+    Returns a dict of tile name: runtime.
+    '''
+    table = testname.replace(",", "_")
+    con = sqlite3.connect(db_name)
+    cur = con.cursor()
+    runtimes = {}
+    try:
+        cur.execute("select tile_name, runtime from " + table + " where status=? and runtime is not null",
+                    (STATUS_OK,))
+        runtimes = dict(cur.fetchall())
+    except sqlite3.OperationalError:
+        # process db from before runtimes were recorded
+        cur.execute("select tile_name, exe_start, exe_end from " + table + " where status=?", (STATUS_OK,))
+        for tile_name, exe_start, exe_end in cur.fetchall():
+            try:
+                runtimes[tile_name] = time.mktime(time.strptime(exe_end)) - time.mktime(time.strptime(exe_start))
+            except (TypeError, ValueError):
+                continue
+    finally:
+        cur.close()
+        con.close()
+    return runtimes
+
+
+def estimate_costs(matched_files, testname=None, cost_db=None):
+    '''
+    Estimate the relative cost (runtime) of processing each tile.
+    The cost is the runtime from a previous run of the test (cost_db) if available. Otherwise the number
+    of points in the las header, scaled by the median runtime per point of the tiles with both. If neither
+    is available, the median of the other costs is used.
+    Args:
+        matched_files: list of (las path, ref path) tuples.
+        testname: name of the test (only needed with cost_db).
+        cost_db: process db from a previous qc_wrap run or None.
+    Returns:
+        list of costs, in the order of matched_files.
+    '''
+    runtimes = {}
+    if cost_db is not None:
+        try:
+            runtimes = get_previous_runtimes(cost_db, testname)
+            print("Got runtimes of %d tiles from %s" % (len(runtimes), cost_db))
+        except sqlite3.Error as e:
+            print("Unable to read runtimes from " + cost_db + ":\n" + str(e))
+    n_points = []
+    for lasname, _ in matched_files:
+        try:
+            n_points.append(las_io.read_header(lasname)["point_count"])
+        except (IOError, OSError, ValueError):
+            n_points.append(None)
+    tilenames = [constants.get_tilename(lasname) for lasname, _ in matched_files]
+    rates = sorted(runtimes[name] / float(n) for name, n in zip(tilenames, n_points)
+                   if name in runtimes and n)
+    rate = rates[len(rates) // 2] if rates else 1.0
+    costs = []
+    for name, n in zip(tilenames, n_points):
+        if name in runtimes:
+            costs.append(float(runtimes[name]))
+        elif n is not None:
+            costs.append(n * rate)
+        else:
+            costs.append(None)
+    known = sorted(cost for cost in costs if cost is not None)
+    median = known[len(known) // 2] if known else 0.0
+    return [median if cost is None else cost for cost in costs]
+
+
+def setup_job(all_names, defaults, cmdline_args, param_file=None, several_tests=False):
     # Setup a job with keys from a parameter file or from cmdline. Last takes precedence.
-    # Refactored out of qc_wrap.
+    # Refactored out of qc_wrap. If several_tests is True, TESTNAME may name several tests.
     # a dict holding names from parameter-file - defining __name__ allows for
     # some nice tricks in paramfile.
     fargs = {"__name__": "qc_wrap"}
@@ -385,10 +498,10 @@ def setup_job(all_names, defaults, cmdline_args, param_file=None):
     ## Validate sanity of definition   ##
     ########################
 
-    ok = validate_job_definition(args, MUST_BE_DEFINED)
+    ok = validate_job_definition(args, MUST_BE_DEFINED, several_tests=several_tests)
     if not ok:
         return 2, None, None
-    use_ref_data = qc.tests[args["TESTNAME"]][0]
+    use_ref_data = any(qc.tests[testname][0] for testname in split_testnames(args["TESTNAME"]))
 
     #############
     ## Get input tiles#
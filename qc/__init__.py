@@ -56,6 +56,7 @@ tests={
 "poly_z_stats":(True,True),
 "colorize":(False,False),
 "time_stats":(False,True),
+"tile_summary":(False,True),
 "reproject":(False,False),
 }
 
@@ -168,7 +168,9 @@ def main(args):
         freqs = [0] * (len(constants.classes)+1)  #list of frequencies...
 
         if n_all > 0:
-            c_all = pc_in_poly.get_classes()
+            # group points by class once, rather than cutting once per class
+            classes_in_poly = pc_in_poly.partition_by("c")
+            c_all = classes_in_poly.keys
             if below_poly and DEBUG:
                 print("Mean z of polygon is:        %.2f m" % mean_z)
                 print("Mean z of points below is:   %.2f m" % pc_in_poly.z.mean())
@@ -178,9 +180,8 @@ def main(args):
             # definition in report.py!!
             n_found = 0
             for i, cls in enumerate(constants.classes):
-                if cls in c_all:
-                    pcc = pc_in_poly.cut_to_class(cls)
-                    n_c = pcc.get_size()
+                n_c = classes_in_poly.count(cls)
+                if n_c > 0:
                     f_c = n_c / float(n_all)
                     n_found += n_c
                     print("Class %d::" % cls)
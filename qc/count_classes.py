@@ -24,6 +24,8 @@ import sys
 import os
 import time
 
+import numpy as np
+
 from . import dhmqc_constants as constants
 from qc.thatsDEM import pointcloud
 from qc.db import report
@@ -54,6 +56,40 @@ def usage():
     parser.print_help()
 
 
+def report_counts(reporter, kmname, count, n_points_total, wkt):
+    '''
+    Report the number of points in each class.
+
+    Args:
+        reporter: report.ReportClassCount object.
+        kmname: tile name.
+        count: function returning the number of points of a class.
+        n_points_total: total number of points.
+        wkt: tile geometry as wkt.
+    '''
+    reporter.report(
+        kmname,
+        count(constants.created_unused),
+        count(constants.surface),
+        count(constants.terrain),
+        count(constants.low_veg),
+        count(constants.med_veg),
+        count(constants.high_veg),
+        count(constants.building),
+        count(constants.outliers),
+        count(constants.mod_key),
+        count(constants.water),
+        count(constants.ignored),
+        count(constants.power_line),
+        count(constants.bridge),
+        count(constants.high_noise),
+        count(constants.terrain_in_buildings),
+        count(constants.low_veg_in_buildings),
+        count(constants.man_excl),
+        n_points_total,
+        wkt_geom=wkt)
+
+
 def main(args):
     '''
     Main script functionality. Can be invoked from either the command line
@@ -71,87 +107,18 @@ def main(args):
     if pargs.schema is not None:
         report.set_schema(pargs.schema)
     reporter = report.ReportClassCount(pargs.use_local)
-    pc = pointcloud.fromAny(pargs.las_file)
+    pc = pointcloud.fromAny(pargs.las_file, mmap=True, lazy=True)
     n_points_total = pc.get_size()
     if n_points_total == 0:
         print("Something is terribly terribly wrong here! Simon - vi skal melde en fjel")
 
-    pc_temp = pc.cut_to_class(constants.created_unused)
-    n_created_unused = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.surface)
-    n_surface = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.terrain)
-    n_terrain = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.low_veg)
-    n_low_veg = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.high_veg)
-    n_high_veg = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.med_veg)
-    n_med_veg = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.building)
-    n_building = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.outliers)
-    n_outliers = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.mod_key)
-    n_mod_key = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.water)
-    n_water = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.ignored)
-    n_ignored = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.bridge)
-    n_bridge = pc_temp.get_size()
-
-    # new classes
-    pc_temp = pc.cut_to_class(constants.high_noise)
-    n_high_noise = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.power_line)
-    n_power_line = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.terrain_in_buildings)
-    n_terrain_in_buildings = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.low_veg_in_buildings)
-    n_low_veg_in_buildings = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.man_excl)
-    n_man_excl = pc_temp.get_size()
+    # count all classes in one pass
+    counts = np.bincount(pc.c, minlength=256)
 
     polywkt = tilename_to_extent(kmname, return_wkt=True)
     print(polywkt)
 
-    reporter.report(
-        kmname,
-        n_created_unused,
-        n_surface,
-        n_terrain,
-        n_low_veg,
-        n_med_veg,
-        n_high_veg,
-        n_building,
-        n_outliers,
-        n_mod_key,
-        n_water,
-        n_ignored,
-        n_power_line,
-        n_bridge,
-        n_high_noise,
-        n_terrain_in_buildings,
-        n_low_veg_in_buildings,
-        n_man_excl,
-        n_points_total,
-        wkt_geom=polywkt)
+    report_counts(reporter, kmname, lambda cls: int(counts[cls]), n_points_total, polywkt)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -27,6 +27,7 @@ import json
 from argparse import ArgumentParser
 from math import ceil
 from math import modf
+from math import sqrt
 
 import numpy as np
 import scipy.ndimage as image
@@ -189,6 +190,11 @@ parser.add_argument(
     "-no_expand_water",
     action="store_true",
     help="""Do not expand water mask.""")
+parser.add_argument(
+    "-threads",
+    type=int,
+    default=1,
+    help="""Triangulate and grid in blocks using this many threads. Defaults to 1 (one global triangulation).""")
 parser.add_argument(
     "las_file",
     help="Input las tile (the important bit is tile name).")
@@ -239,7 +245,7 @@ def expand_water(add_mask, water_mask, element=None, verbose=False):
         print("Cells after expansion: %d" % water_mask.sum())
     return water_mask
 
-def gridit(points, extent, cell_size, g_warp=None, doround=False):
+def gridit(points, extent, cell_size, g_warp=None, doround=False, threads=1):
     '''
     Grid pointcloud within extent.
 
@@ -249,14 +255,21 @@ def gridit(points, extent, cell_size, g_warp=None, doround=False):
         cell_size:          Cell size of grid.
         g_warp:             Height transformation grid. Typically a geoid grid.
         doround:            Rounds grid-values to 3 decimals.
+        threads:            If larger than 1 (and points not already triangulated), triangulate
+                            and grid in blocks using this many threads.
 
     Returns:
         grid:               thatsDEM.grid.Grid object with heights in each grid cell.
         triangles:          thatsDEM.grid.Grid object with triangle sizes in grid cells.
                             Can be used to identify individual triangles in the grid.
     '''
+    blocks = 1
     if points.triangulation is None:
-        points.triangulate()
+        if threads > 1:
+            # a few more blocks than threads to even out the load
+            blocks = 2 * int(ceil(sqrt(threads)))
+        else:
+            points.triangulate()
 
     triangulated_grid, triangles = points.get_grid(
         x1=extent[0],
@@ -266,7 +279,10 @@ def gridit(points, extent, cell_size, g_warp=None, doround=False):
         cx=cell_size,
         cy=cell_size,
         nd_val=ND_VAL,
-        method="return_triangles")
+        method="return_triangles",
+        engine="scanline",
+        blocks=blocks,
+        threads=threads)
 
     mask = (triangulated_grid.grid != ND_VAL)
     if not mask.any():
@@ -552,16 +568,22 @@ def main(args):
             assert set(ground_cls).issubset(set(surf_cls))
             assert h_system in ["dvr90", "E"]
 
-            tile_pc = pointcloud.fromAny(path, include_return_number=True)
-            tile_pc = tile_pc.cut_to_box(*extent_buf)
-            tile_pc = tile_pc.cut_to_class(surf_cls)
+            if os.path.splitext(path)[1] in (".las", ".laz"):
+                # Let the reader do the filtering - neighbours outside the buffer
+                # (by header bounds) are skipped without reading any points.
+                tile_pc = pointcloud.fromLAS(
+                    path,
+                    include_return_number=True,
+                    xy_box=extent_buf,
+                    cls=surf_cls)
+            else:
+                tile_pc = pointcloud.fromAny(path, include_return_number=True)
+                tile_pc = tile_pc.cut_to_box(*extent_buf)
+                tile_pc = tile_pc.cut_to_class(surf_cls)
 
             if tile_pc.get_size() > 0:
-                mask = np.zeros((tile_pc.get_size(),), dtype=np.bool)
                 #reclass hack
-                for cls in ground_cls:
-                    mask |= (tile_pc.c == cls)
-                tile_pc.c[mask] = SYNTH_TERRAIN
+                tile_pc.c[np.isin(tile_pc.c, ground_cls)] = SYNTH_TERRAIN
 
                 #warping to hsys
                 if h_system != pargs.hsys and not pargs.nowarp:
@@ -570,6 +592,9 @@ def main(args):
                     else:
                         tile_pc.toH(geoid)
 
+                # Keep the merged pointcloud in compact form - attributes are only
+                # converted back to float64 as they are used after cutting below.
+                tile_pc.compact()
                 if bufpc is None:
                     bufpc = tile_pc
                 else:
@@ -619,7 +644,8 @@ def main(args):
     if do_dtm:
         terr_pc = bufpc.cut_to_class(SYNTH_TERRAIN)
         if terr_pc.get_size() > 3:
-            dtm, trig_grid = gridit(terr_pc, grid_buf, pargs.cell_size, None, doround=pargs.round)
+            dtm, trig_grid = gridit(terr_pc, grid_buf, pargs.cell_size, None, doround=pargs.round,
+                                    threads=pargs.threads)
         else:
             rc1 = 3
 
@@ -640,6 +666,8 @@ def main(args):
 
             # Filling in large triangles
             mask = np.logical_and(triangle_mask, water_mask)
+            # the low filter needs a global triangulation (not there if gridded in blocks)
+            terr_pc.triangulate()
             zlow = array_geometry.tri_filter_low(
                 terr_pc.z,
                 terr_pc.triangulation.vertices,
@@ -693,7 +721,8 @@ def main(args):
         del bufpc
 
         if surf_pc.get_size() > 3:
-            dsm, trig_grid = gridit(surf_pc, grid_buf, pargs.cell_size, None, doround=pargs.round)
+            dsm, trig_grid = gridit(surf_pc, grid_buf, pargs.cell_size, None, doround=pargs.round,
+                                    threads=pargs.threads)
         else:
             rc2 = 3
 
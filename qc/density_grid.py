@@ -97,7 +97,7 @@ def main(args):
 
 
     o_name_grid = kmname + "_density"
-    pts = pointcloud.fromLAS(lasname)
+    pts = pointcloud.fromLAS(lasname, mmap=True)
     if classes is not None:
         pts = pts.cut_to_class(classes)
 
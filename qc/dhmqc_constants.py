@@ -87,6 +87,43 @@ def tilename_to_index(tilename):
 	E = int(E)
 	return 6200 - N, E - 600
 
+def hilbert_index(order, row, col):
+	# Distance of the cell (row, col) along a Hilbert curve through a 2**order x 2**order grid.
+	# Cells which are close on the curve are also close in the grid.
+	n = 1 << order
+	d = 0
+	s = n >> 1
+	while s > 0:
+		rx = int((col & s) > 0)
+		ry = int((row & s) > 0)
+		d += s * s * ((3 * rx) ^ ry)
+		# rotate the quadrant, so that the curve continues from the previous one
+		if ry == 0:
+			if rx == 1:
+				col = n - 1 - col
+				row = n - 1 - row
+			col, row = row, col
+		s >>= 1
+	return d
+
+def spatial_order(tilenames):
+	# Return the positions of tilenames sorted along a Hilbert curve through the tile grid - so that
+	# consecutive tiles are mostly neighbours. Names which are not tile names are put last in their original order.
+	indices = {}
+	for i, name in enumerate(tilenames):
+		try:
+			indices[i] = tilename_to_index(name)
+		except (ValueError, IndexError):
+			pass
+	if not indices:
+		return list(range(len(tilenames)))
+	row0 = min(r for r, c in indices.values())
+	col0 = min(c for r, c in indices.values())
+	span = max(max(r - row0, c - col0) for r, c in indices.values())
+	order = max(span.bit_length(), 1)
+	key = dict((i, hilbert_index(order, r - row0, c - col0)) for i, (r, c) in indices.items())
+	return sorted(key, key=lambda i: (key[i], i)) + [i for i in range(len(tilenames)) if i not in key]
+
 def get_tilename(name):
 	b_name = os.path.splitext(os.path.basename(name))[0]
 	i = b_name.find("1km")
@@ -213,8 +213,9 @@ def main(args):
     pc.sort_spatially(FRAD)
     print("Filtering..")
     # so 1 of two criteria should be fullfilled: low, low, density or high pointdistance...
-    d_in = pc.density_filter(FRAD, pc_ref.xy)
-    pd_in = pc.distance_filter(FRAD, pc_ref.xy)
+    stats = pc.multi_filter(FRAD, ("count", "dist"), xy=pc_ref.xy, nd_val=9999)
+    d_in = stats["count"] / (np.pi * FRAD**2)
+    pd_in = stats["dist"]
     M = np.logical_or(d_in < DEN_LIM, pd_in > PDIST_LIM)
     pc_pot = pc_ref.cut(M)
     if pc_pot.get_size() == 0:
@@ -342,8 +342,9 @@ class CleanBuildings(BaseRepairMan):
             return
 
         xyc = np.empty((0,3),dtype=np.float64)
+        classes = pc.partition_by("c")
         for c in BUILDING_RECLASS:
-            pc_ = pc.cut_to_class(c)
+            pc_ = classes.cut(c)
             rc = np.ones((pc_.size,), dtype=np.float64)*BUILDING_RECLASS[c]
             xyc_ = np.column_stack((pc_.xy, rc))
             xyc = np.vstack((xyc, xyc_))
@@ -44,6 +44,7 @@ parser.add_argument("-cs",type=float,help="Specify cell size of grid, defaults t
 parser.add_argument("-nocut",action="store_true",help="Do NOT cut to default terrain grid classes.")
 parser.add_argument("-srad",type=float,help="Search radius for points. Defaults to "+str(SRAD),default=SRAD)
 parser.add_argument("-outdir",help="Specify output directory. Defaults to "+GRIDS_OUT,default=GRIDS_OUT)
+parser.add_argument("-threads",type=int,help="Number of threads used for filtering. Defaults to 1",default=1)
 
 
 def usage():
@@ -88,7 +89,7 @@ def main(args):
 	pc.sort_spatially(pargs.srad)
 	print("Filtering...")
 	xy=pointcloud.mesh_as_points((nrows,ncols),georef)
-	d=pc.distance_filter(pargs.srad,xy=xy,nd_val=9999).reshape((nrows,ncols))
+	d=pc.distance_filter(pargs.srad,xy=xy,nd_val=9999,threads=pargs.threads).reshape((nrows,ncols))
 	g=grid.Grid(d,georef,9999)
 	g.save(outname,dco=["TILED=YES","COMPRESS=LZW"],srs=SRS_WKT)
 	return 0
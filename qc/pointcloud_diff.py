@@ -49,6 +49,7 @@ parser.add_argument("-cs",type=float,help="Specify cell size of grid. Default 10
 parser.add_argument("-toE",action="store_true",help="Warp reference points to ellipsoidal heights.")
 parser.add_argument("-srad",type=float,help="Specify search radius to get interpolated z in input. Defaults to "+str(SRAD),default=SRAD)
 parser.add_argument("-overwrite",action="store_true",help="Overwrite output file if it exists - default is to skip.")
+parser.add_argument("-threads",type=int,help="Number of threads used for filtering. Defaults to 1",default=1)
 parser.add_argument("las_file",help="input 1km las tile.")
 parser.add_argument("las_ref_file",help="reference las tile.")
 
@@ -124,7 +125,7 @@ def main(args):
 		pc_ref.toE(geoid)
 	t0=time.process_time()
 	pc.sort_spatially(pargs.srad)
-	z_new=pc.idw_filter(pargs.srad,xy=pc_ref.xy,nd_val=ND_VAL)
+	z_new=pc.idw_filter(pargs.srad,xy=pc_ref.xy,nd_val=ND_VAL,threads=pargs.threads)
 	M=(z_new!=ND_VAL)
 	z_new=z_new[M]
 	pc_ref=pc_ref.cut(M)
@@ -136,7 +137,7 @@ def main(args):
 	xy=pointcloud.mesh_as_points((nrows,ncols),geo_ref)
 	
 	t1=time.process_time()
-	dz_grid=pc_ref.mean_filter(0.6*cs,xy=xy,nd_val=ND_VAL).reshape((nrows,ncols)) #or median here...
+	dz_grid=pc_ref.mean_filter(0.6*cs,xy=xy,nd_val=ND_VAL,threads=pargs.threads).reshape((nrows,ncols)) #or median here...
 	t2=time.process_time()
 	print("Final filtering: %.3f s" %(t2-t1))
 	print("All in all: %.3f s" %(t2-t0))
@@ -100,7 +100,7 @@ def main(args):
 
     cut_class = pargs.cut_class
     print("Cutting to class (terrain) {0:d}".format(cut_class))
-    pc = pointcloud.fromAny(lasname).cut_to_class(cut_class)
+    pc = pointcloud.fromAny(lasname, mmap=True, lazy=True).cut_to_class(cut_class)
     if pc.get_size() < 10:
         print("Too few points in pointcloud.")
         return
@@ -101,6 +101,22 @@ lib.pc_spike_filter.argtypes = [
     XY_TYPE,
     ctypes.c_int]
 lib.pc_spike_filter.restype = None
+# void pc_multi_filter(double *xy, double *pc_xy, double *pc_z, double *vals_out, double filter_rad, double nd_val, int *stats, int nstats, int *spatial_index, double *header, int npoints);
+lib.pc_multi_filter.argtypes = [
+    XY_TYPE,
+    XY_TYPE,
+    Z_TYPE,
+    XY_TYPE,
+    ctypes.c_double,
+    ctypes.c_double,
+    INT32_TYPE,
+    ctypes.c_int,
+    INT32_TYPE,
+    XY_TYPE,
+    ctypes.c_int]
+lib.pc_multi_filter.restype = None
+# statistics for pc_multi_filter - codes as in array_geometry.h
+MULTI_FILTER_STATS = {"min": 0, "max": 1, "mean": 2, "var": 3, "count": 4, "dist": 5}
 # void pc_noise_filter(double *pc_xy, double *pc_z, double *z_out, double filter_rad, double zlim, double den_cut, int *spatial_index, double *header, int npoints);
 # binning
 # void moving_bins(double *z, int *nout, double rad, int n);
@@ -347,6 +363,62 @@ def points_in_polygon(points, rings):
     return out
 
 
+def _hull_side(a, b, points):
+    """Hull vertices strictly between a and b of the points strictly to the right of a->b (quickhull step)."""
+    if points.shape[0] == 0:
+        return []
+    d = (b[0] - a[0]) * (points[:, 1] - a[1]) - (b[1] - a[1]) * (points[:, 0] - a[0])
+    c = points[np.argmin(d)]
+    P = points[d < 0]
+    d1 = (c[0] - a[0]) * (P[:, 1] - a[1]) - (c[1] - a[1]) * (P[:, 0] - a[0])
+    d2 = (b[0] - c[0]) * (P[:, 1] - c[1]) - (b[1] - c[1]) * (P[:, 0] - c[0])
+    return _hull_side(a, c, P[d1 < 0]) + [c] + _hull_side(c, b, P[d2 < 0])
+
+
+def convex_hull(points):
+    """
+    Calculate the convex hull of a set of points (by quickhull).
+    Args:
+        points: 2d numpy array ( shape (n,2) ).
+    Returns:
+        2d numpy array of the hull vertices in counter clockwise order - not closed, and without collinear vertices.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.shape[0] == 0:
+        return points.copy()
+    # lowest of the leftmost and highest of the rightmost points
+    x = points[:, 0]
+    I = np.flatnonzero(x == x.min())
+    a = points[I[np.argmin(points[I, 1])]]
+    I = np.flatnonzero(x == x.max())
+    b = points[I[np.argmax(points[I, 1])]]
+    if (a == b).all():
+        return a.reshape((1, 2))
+    d = (b[0] - a[0]) * (points[:, 1] - a[1]) - (b[1] - a[1]) * (points[:, 0] - a[0])
+    verts = [a] + _hull_side(a, b, points[d < 0]) + [b] + _hull_side(b, a, points[d > 0])
+    return np.array(verts)
+
+
+def points_in_convex_polygon(points, vertices):
+    """
+    Calculate a mask indicating whether points lie strictly inside a convex polygon.
+    Args:
+        points: 2d numpy array ( shape (n,2) ).
+        vertices: 2d numpy array of the vertices in counter clockwise order, as returned by convex_hull.
+    Returns:
+        1d numpy boolean array.
+    """
+    M = np.ones(points.shape[0], dtype=bool)
+    if vertices.shape[0] < 3:
+        M[:] = False
+        return M
+    for i in range(vertices.shape[0]):
+        a = vertices[i - 1]
+        b = vertices[i]
+        M &= (b[0] - a[0]) * (points[:, 1] - a[1]) - (b[1] - a[1]) * (points[:, 0] - a[0]) > 0
+    return M
+
+
 def get_boundary_vertices(validity_mask, poly_mask, triangles):
     # Experimental: see pointcloud.py for explanation.
     out = np.empty_like(poly_mask)
@@ -392,6 +464,11 @@ def unit_test(n=1000):
     pts += (2.0, 2.0)
     M = points_in_polygon(pts, [verts])
     assert not M.any()
+    pts = np.vstack((np.random.rand(n, 2), verts))
+    hull = convex_hull(pts)
+    assert hull.shape[0] == 4
+    M = points_in_convex_polygon(pts, hull)
+    assert M.sum() == n
 
 
 if __name__ == "__main__":
@@ -168,10 +168,28 @@ def resample_grid(grid, nd_val, geo_ref_in, geo_ref_out, ncols_out, nrows_out):
     return out
 
 
-# slow, but flexible method designed to calc. some algebraic quantity of q's within every single cell
-def make_grid(xy, q, ncols, nrows, georef, nd_val=-9999, method=np.mean, dtype=np.float32):  # gdal-style georef
+# Methods for make_grid which are calculated vectorised (no python loop over cells).
+GRID_METHODS = ("count", "sum", "mean", "var", "std", "min", "max", "median", "percentile")
+# numpy functions which are recognized and replaced by the corresponding vectorised method.
+_NUMPY_GRID_METHODS = {np.mean: "mean", np.sum: "sum", np.var: "var", np.std: "std", np.min: "min",
+                       np.amin: "min", np.max: "max", np.amax: "max", np.median: "median", len: "count"}
+
+
+def cell_indices(xy, ncols, nrows, georef):
+    """Return flattened cell indices of the points inside the grid and the mask selecting those points."""
+    arr_coords = ((xy - (georef[0], georef[3])) / (georef[1], georef[5])).astype(np.int32)
+    M = np.logical_and(arr_coords[:, 0] >= 0, arr_coords[:, 0] < ncols)
+    M &= np.logical_and(arr_coords[:, 1] >= 0, arr_coords[:, 1] < nrows)
+    arr_coords = arr_coords[M]
+    return arr_coords[:, 1].astype(np.int64) * ncols + arr_coords[:, 0], M
+
+
+def make_grid(xy, q, ncols, nrows, georef, nd_val=-9999, method=np.mean, dtype=np.float32, percentile=50.0):  # gdal-style georef
     """
     Apply a function on scattered data (xy) to produce a regular grid. Will apply the supplied method on the points that fall within each output cell.
+    The methods in GRID_METHODS (and the corresponding numpy functions like np.mean, np.min, ...) are calculated vectorised:
+    count, sum, mean, var and std via bincount, min and max via reduceat on the values sorted by cell and median / percentile
+    by sorting the values within each cell. Other callables are applied cell by cell - much slower.
     Args:
         xy: numpy array of shape (n,2).
         q: 1d numpy array. The value to 'grid'.
@@ -179,43 +197,67 @@ def make_grid(xy, q, ncols, nrows, georef, nd_val=-9999, method=np.mean, dtype=n
         nrows: Number of rows in output.
         georef: GDAL style georeference (list / tuple containing 6 floats).
         nd_val: Output no data value.
-        method: The method to apply to the points that are contained in each cell.
+        method: One of GRID_METHODS or a callable to apply to the values of the points that are contained in each cell.
         dtype: Output numpy data type.
+        percentile: The percentile (0-100) to calculate for method 'percentile'. Interpolated linearly like np.percentile.
     Returns:
-        2d numpy array of shape (nrows,ncols).
+        Grid object with a 2d numpy array of shape (nrows,ncols).
+    Raises:
+        ValueError: If method is not supported.
     """
-    out = np.ones((nrows, ncols), dtype=dtype) * nd_val
-    arr_coords = ((xy - (georef[0], georef[3])) / (georef[1], georef[5])).astype(np.int32)
-    M = np.logical_and(arr_coords[:, 0] >= 0, arr_coords[:, 0] < ncols)
-    M &= np.logical_and(arr_coords[:, 1] >= 0, arr_coords[:, 1] < nrows)
-    arr_coords = arr_coords[M]
+    method = _NUMPY_GRID_METHODS.get(method, method)
+    if not callable(method) and method not in GRID_METHODS:
+        raise ValueError("Unsupported method: %s" % method)
+    out = np.empty((nrows * ncols,), dtype=dtype)
+    out.fill(nd_val)
+    B, M = cell_indices(xy, ncols, nrows, georef)
     q = q[M]
-    # create flattened index
-    B = arr_coords[:, 1] * ncols + arr_coords[:, 0]
-    # now sort array
-    I = np.argsort(B)
-    arr_coords = arr_coords[I]
+    if B.shape[0] == 0:
+        return Grid(out.reshape((nrows, ncols)), georef, nd_val)
+    if method in ("count", "sum", "mean", "var", "std"):
+        count = np.bincount(B, minlength=nrows * ncols)
+        H = count > 0
+        if method == "count":
+            vals = count
+        else:
+            vals = np.bincount(B, weights=q, minlength=nrows * ncols)
+            if method != "sum":
+                vals[H] /= count[H]
+            if method in ("var", "std"):
+                # two pass - more stable than E(q^2) - E(q)^2
+                vals[H] = np.bincount(B, weights=(q - vals[B]) ** 2, minlength=nrows * ncols)[H] / count[H]
+                if method == "std":
+                    vals = np.sqrt(vals)
+        out[H] = vals[H]
+        return Grid(out.reshape((nrows, ncols)), georef, nd_val)
+    if method in ("median", "percentile"):
+        # sort by cell, then by value within each cell
+        I = np.lexsort((q, B))
+    else:
+        I = np.argsort(B, kind="stable")
+    B = B[I]
     q = q[I]
-    # and finally loop through pts just one more time...
-    box_index = arr_coords[0, 1] * ncols + arr_coords[0, 0]
-    i0 = 0
-    row = arr_coords[0, 1]
-    col = arr_coords[0, 0]
-    for i in range(arr_coords.shape[0]):
-        b = arr_coords[i, 1] * ncols + arr_coords[i, 0]
-        if (b > box_index):
-            # set the current cell
-            out[row, col] = method(q[i0:i])
-            # set data for the next cell
-            i0 = i
-            box_index = b
-            row = arr_coords[i, 1]
-            col = arr_coords[i, 0]
-    # set the final cell - corresponding to largest box_index
-    assert ((arr_coords[i0] == arr_coords[-1]).all())
-    final_val = method(q[i0:])
-    out[row, col] = final_val
-    return Grid(out, georef, nd_val)
+    # start of each segment of points in the same cell
+    starts = np.flatnonzero(np.concatenate(([True], B[1:] != B[:-1])))
+    cells = B[starts]
+    if method == "min":
+        out[cells] = np.minimum.reduceat(q, starts)
+    elif method == "max":
+        out[cells] = np.maximum.reduceat(q, starts)
+    elif method in ("median", "percentile"):
+        if method == "median":
+            percentile = 50.0
+        counts = np.diff(np.append(starts, B.shape[0]))
+        pos = (counts - 1) * (percentile / 100.0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        q_lo = q[starts + lo]
+        out[cells] = q_lo + (q[starts + hi] - q_lo) * (pos - lo)
+    else:
+        # slow path for arbitrary callables
+        for cell, q_cell in zip(cells, np.split(q, starts[1:])):
+            out[cell] = method(q_cell)
+    return Grid(out.reshape((nrows, ncols)), georef, nd_val)
 
 
 def grid_most_frequent_value(xy, q, ncols, nrows, georef, v1=None, v2=None, nd_val=-9999):
@@ -289,6 +331,74 @@ def intersect_grid_extents(georef1, shape1, georef2, shape2):
     return (rs1, cs1), (rs2, cs2)
 
 
+def save_bands(fname, grids, names=None, format="GTiff", dco=[], srs=None):
+    """
+    Save grids as the bands of a single raster file.
+    Args:
+        fname: Output file name.
+        grids: List of Grid objects of the same shape, data type and geo reference - one per band.
+        names: Optional list of band descriptions.
+        format: GDAL driver name.
+        dco: GDAL dataset creation options.
+        srs: Spatial reference (wkt or EPSG:code). Defaults to the srs of the first grid.
+    Returns:
+        True on success, False if the data type is not supported.
+    Raises:
+        ValueError: If the grids do not agree in shape, data type or geo reference.
+    """
+    first = grids[0]
+    for g in grids[1:]:
+        if g.shape != first.shape or g.dtype != first.dtype or (g.geo_ref != first.geo_ref).any():
+            raise ValueError("All bands must have the same shape, data type and geo reference.")
+    # TODO: map numpy types to gdal types better - done internally in gdal I think...
+    if first.dtype == np.float32:
+        dtype = gdal.GDT_Float32
+    elif first.dtype == np.float64:
+        dtype = gdal.GDT_Float64
+    elif first.dtype == np.int32:
+        dtype = gdal.GDT_Int32
+    elif first.dtype == np.bool or first.dtype == np.uint8:
+        dtype = gdal.GDT_Byte
+    else:
+        return False  # TODO....
+    driver = gdal.GetDriverByName(format)
+    assert(driver is not None)
+    if os.path.exists(fname):
+        try:
+            driver.Delete(fname)
+        except Exception as msg:
+            print(msg)
+        else:
+            print("Overwriting %s..." % fname)
+    else:
+        print("Saving %s..." % fname)
+    if len(dco) > 0:
+        dst_ds = driver.Create(fname, first.shape[1], first.shape[0], len(grids), dtype, options=dco)
+    else:
+        dst_ds = driver.Create(fname, first.shape[1], first.shape[0], len(grids), dtype)
+
+    dst_ds.SetGeoTransform(first.geo_ref)
+
+    if srs is None:  # will override self.srs which is default if set
+        srs = first.srs
+    if srs is not None:
+        if srs[0:5] == 'EPSG:':
+            sr = osr.SpatialReference()
+            sr.ImportFromEPSG(int(srs[5:]))
+            srs = sr.ExportToWkt()
+        dst_ds.SetProjection(srs)
+
+    for i, g in enumerate(grids):
+        band = dst_ds.GetRasterBand(i + 1)
+        if names is not None:
+            band.SetDescription(names[i])
+        if g.nd_val is not None:
+            band.SetNoDataValue(g.nd_val)
+        band.WriteArray(g.grid)
+    dst_ds = None
+    return True
+
+
 class Grid(object):
     """
     Grid abstraction class.
@@ -395,50 +505,7 @@ class Grid(object):
         return bilinear_interpolation(self.grid, xy, nd_val, cell_georef)
 
     def save(self, fname, format="GTiff", dco=[], colortable=None, srs=None):
-        # TODO: map numpy types to gdal types better - done internally in gdal I think...
-        if self.grid.dtype == np.float32:
-            dtype = gdal.GDT_Float32
-        elif self.grid.dtype == np.float64:
-            dtype = gdal.GDT_Float64
-        elif self.grid.dtype == np.int32:
-            dtype = gdal.GDT_Int32
-        elif self.grid.dtype == np.bool or self.grid.dtype == np.uint8:
-            dtype = gdal.GDT_Byte
-        else:
-            return False  # TODO....
-        driver = gdal.GetDriverByName(format)
-        assert(driver is not None)
-        if os.path.exists(fname):
-            try:
-                driver.Delete(fname)
-            except Exception as msg:
-                print(msg)
-            else:
-                print("Overwriting %s..." % fname)
-        else:
-            print("Saving %s..." % fname)
-        if len(dco) > 0:
-            dst_ds = driver.Create(fname, self.grid.shape[1], self.grid.shape[0], 1, dtype, options=dco)
-        else:
-            dst_ds = driver.Create(fname, self.grid.shape[1], self.grid.shape[0], 1, dtype)
-
-        dst_ds.SetGeoTransform(self.geo_ref)
-
-        if srs is None:  # will override self.srs which is default if set
-            srs = self.srs
-        if srs is not None:
-            if srs[0:5] == 'EPSG:':
-                sr = osr.SpatialReference()
-                sr.ImportFromEPSG(int(srs[5:]))
-                srs = sr.ExportToWkt()
-            dst_ds.SetProjection(srs)
-
-        band = dst_ds.GetRasterBand(1)
-        if self.nd_val is not None:
-            band.SetNoDataValue(self.nd_val)
-        band.WriteArray(self.grid)
-        dst_ds = None
-        return True
+        return save_bands(fname, [self], format=format, dco=dco, srs=srs)
 
     def get_bounds(self):
         return grid_extent(self.geo_ref, self.grid.shape)
@@ -0,0 +1,228 @@
+# Copyright (c) 2016, Danish Agency for Data Supply and Efficiency <sdfe@sdfe.dk>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+#########################
+# Lightweight access to las / laz files without going through laspy.
+#########################
+
+import os
+import struct
+import numpy as np
+
+LAS_SIGNATURE = b"LASF"
+# Offsets of the fields we need in the public header block (identical for las 1.0 - 1.4).
+HEADER_FORMAT = "<4s20xBB70xIIBHI20x3d3d6d"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# las 1.4 has a 64 bit point count, since the legacy count might be zero.
+LAS14_POINT_COUNT_OFFSET = 247
+
+
+def read_header(path):
+    """
+    Read the interesting parts of the public header block of a las / laz file.
+
+    Only the header is read - the point data is left untouched. The header of a laz file is
+    not compressed, so this also works for laz files.
+    Args:
+        path: path to las / laz file.
+    Returns:
+        A dict with keys: version, point_data_offset, point_format, compressed, record_length,
+        point_count, scale, offset, bounds (xmin, ymin, xmax, ymax) and z_bounds (zmin, zmax).
+    Raises:
+        ValueError if the file is not a las file.
+    """
+    with open(path, "rb") as f:
+        buf = f.read(LAS14_POINT_COUNT_OFFSET + 8)
+    if len(buf) < HEADER_SIZE:
+        raise ValueError("Too short to be a las file: %s" % path)
+    fields = struct.unpack(HEADER_FORMAT, buf[:HEADER_SIZE])
+    if fields[0] != LAS_SIGNATURE:
+        raise ValueError("Not a las file: %s" % path)
+    v_major, v_minor, data_offset, n_vlrs, point_format, record_length, point_count = fields[1:8]
+    scale = fields[8:11]
+    offset = fields[11:14]
+    xmax, xmin, ymax, ymin, zmax, zmin = fields[14:20]
+    if point_count == 0 and (v_major, v_minor) >= (1, 4) and len(buf) >= LAS14_POINT_COUNT_OFFSET + 8:
+        point_count = struct.unpack("<Q", buf[LAS14_POINT_COUNT_OFFSET:LAS14_POINT_COUNT_OFFSET + 8])[0]
+    return {
+        "version": (v_major, v_minor),
+        "point_data_offset": data_offset,
+        # laszip marks compressed data by setting bit 7 (and 6) of the point format
+        "point_format": point_format & 0x3F,
+        "compressed": bool(point_format & 0x80),
+        "record_length": record_length,
+        "point_count": point_count,
+        "scale": np.array(scale, dtype=np.float64),
+        "offset": np.array(offset, dtype=np.float64),
+        "bounds": np.array((xmin, ymin, xmax, ymax), dtype=np.float64),
+        "z_bounds": np.array((zmin, zmax), dtype=np.float64)}
+
+
+def box_intersects_header(path, xy_box):
+    """
+    Check whether a planar bounding box intersects the bounds stored in the header of a las / laz file.
+    Args:
+        path: path to las / laz file.
+        xy_box: (xmin, ymin, xmax, ymax)
+    Returns:
+        True if the box (inclusively) intersects the header bounds.
+    """
+    bounds = read_header(path)["bounds"]
+    return (xy_box[0] <= bounds[2] and xy_box[2] >= bounds[0] and
+            xy_box[1] <= bounds[3] and xy_box[3] >= bounds[1])
+
+
+# Byte offsets of the fields in the point data records. The gps_time field is
+# only present in some formats. Anything else (rgb, waveform, extra bytes) is ignored.
+_LEGACY_FIELDS = [("X", "<i4", 0), ("Y", "<i4", 4), ("Z", "<i4", 8), ("intensity", "<u2", 12),
+                  ("flag_byte", "u1", 14), ("raw_classification", "u1", 15), ("scan_angle_rank", "i1", 16),
+                  ("user_data", "u1", 17), ("pt_src_id", "<u2", 18)]
+_EXTENDED_FIELDS = [("X", "<i4", 0), ("Y", "<i4", 4), ("Z", "<i4", 8), ("intensity", "<u2", 12),
+                    ("flag_byte", "u1", 14), ("classification_flags", "u1", 15), ("classification", "u1", 16),
+                    ("user_data", "u1", 17), ("scan_angle", "<i2", 18), ("pt_src_id", "<u2", 20),
+                    ("gps_time", "<f8", 22)]
+# point format: (fields, minimal record length)
+_POINT_FORMATS = {0: (_LEGACY_FIELDS, 20),
+                  1: (_LEGACY_FIELDS + [("gps_time", "<f8", 20)], 28),
+                  2: (_LEGACY_FIELDS, 26),
+                  3: (_LEGACY_FIELDS + [("gps_time", "<f8", 20)], 34),
+                  4: (_LEGACY_FIELDS + [("gps_time", "<f8", 20)], 57),
+                  5: (_LEGACY_FIELDS + [("gps_time", "<f8", 20)], 63),
+                  6: (_EXTENDED_FIELDS, 30),
+                  7: (_EXTENDED_FIELDS, 36),
+                  8: (_EXTENDED_FIELDS, 38),
+                  9: (_EXTENDED_FIELDS, 59),
+                  10: (_EXTENDED_FIELDS, 67)}
+
+
+def point_dtype(point_format, record_length):
+    """
+    Construct a numpy structured dtype matching the point data records of a las file.
+    Args:
+        point_format: las point data format id (0-10).
+        record_length: length of a point data record in bytes (including extra bytes).
+    Returns:
+        numpy.dtype with itemsize equal to record_length.
+    Raises:
+        ValueError if the format is not supported or the record length too short.
+    """
+    if point_format not in _POINT_FORMATS:
+        raise ValueError("Unsupported point format: %d" % point_format)
+    fields, min_length = _POINT_FORMATS[point_format]
+    if record_length < min_length:
+        raise ValueError("Record length %d too short for point format %d" % (record_length, point_format))
+    names, formats, offsets = zip(*fields)
+    return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": record_length})
+
+
+class LasMemmap(object):
+    """
+    Zero-copy access to the point records of an uncompressed las file via a numpy memmap.
+
+    Nothing is read until fields are accessed, and then only the pages touched are read (and shared
+    via the page cache with other processes reading the same file).
+    Can be used as a 'source' for a pointcloud.Pointcloud, with the attributes xy, z, c, pid and rn.
+    """
+    attrs = ("xy", "z", "c", "pid", "rn")
+
+    def __init__(self, path):
+        """
+        Args:
+            path: path to uncompressed las file.
+        Raises:
+            ValueError if the file is compressed or not a valid las file.
+        """
+        self.path = path
+        self.header = read_header(path)
+        if self.header["compressed"]:
+            raise ValueError("Cannot memory map a compressed las file: %s" % path)
+        fmt = self.header["point_format"]
+        dtype = point_dtype(fmt, self.header["record_length"])
+        n = self.header["point_count"]
+        if self.header["point_data_offset"] + n * dtype.itemsize > os.path.getsize(path):
+            raise ValueError("File too short for %d point records: %s" % (n, path))
+        if n > 0:
+            self.points = np.memmap(path, dtype=dtype, mode="r", offset=self.header["point_data_offset"], shape=(n,))
+        else:
+            self.points = np.empty((0,), dtype=dtype)
+        self.scale = self.header["scale"]
+        self.offset = self.header["offset"]
+        self.extended = fmt >= 6
+
+    @property
+    def size(self):
+        return self.points.shape[0]
+
+    def field(self, name, index=None):
+        """Return a raw point record field - a view into the file if index is None."""
+        arr = self.points[name]
+        if index is None:
+            return arr
+        return arr[index]
+
+    def raw_views(self):
+        """
+        Get views of the raw fields needed for filtering.
+        Returns:
+            Tuple of (X, Y, Z, raw classification, classification mask, raw return number, return number mask).
+        """
+        if self.extended:
+            return (self.points["X"], self.points["Y"], self.points["Z"],
+                    self.points["classification"], 0xFF, self.points["flag_byte"], 0x0F)
+        return (self.points["X"], self.points["Y"], self.points["Z"],
+                self.points["raw_classification"], 0x1F, self.points["flag_byte"], 0x07)
+
+    def get(self, attr, index=None):
+        """
+        Get a (scaled / unpacked) pointcloud attribute.
+        Args:
+            attr: one of xy, z, c, pid or rn.
+            index: optional index array or mask selecting the points to read.
+        Returns:
+            numpy array.
+        """
+        if attr == "xy":
+            return np.column_stack((self.field("X", index) * self.scale[0] + self.offset[0],
+                                    self.field("Y", index) * self.scale[1] + self.offset[1]))
+        if attr == "z":
+            return self.field("Z", index) * self.scale[2] + self.offset[2]
+        if attr == "c":
+            if self.extended:
+                return self.field("classification", index)
+            return self.field("raw_classification", index) & 0x1F
+        if attr == "pid":
+            return self.field("pt_src_id", index)
+        if attr == "rn":
+            return self.field("flag_byte", index) & (0x0F if self.extended else 0x07)
+        raise ValueError("Unknown attribute: %s" % attr)
+
+
+def unit_test(path):
+    print("Reading header of %s" % path)
+    header = read_header(path)
+    print(header)
+    assert (header["bounds"][:2] <= header["bounds"][2:]).all()
+    assert box_intersects_header(path, header["bounds"])
+    b = header["bounds"]
+    assert not box_intersects_header(path, (b[2] + 1, b[3] + 1, b[2] + 2, b[3] + 2))
+    if not header["compressed"]:
+        print("Memory mapping")
+        las = LasMemmap(path)
+        assert las.size == header["point_count"]
+        xy = las.get("xy")
+        assert (xy.min(axis=0) >= b[:2] - 1e-6).all()
+        assert (xy.max(axis=0) <= b[2:] + 1e-6).all()
+        I = np.arange(0, las.size, 7)
+        assert (las.get("z", I) == las.get("z")[I]).all()
+    return 0
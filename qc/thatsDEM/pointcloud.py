@@ -22,12 +22,20 @@ from builtins import range
 from builtins import object
 import sys
 import os
+import json
+import hashlib
+import shutil
+import time
+import errno
+import copy
+from multiprocessing.pool import ThreadPool
 import numpy as np
 
 from osgeo import gdal
 import laspy
 
 from . import triangle
+from . import las_io
 # should perhaps not be done for the user behind the curtains?? Might copy data!
 from .array_factory import point_factory, z_factory, int_array_factory
 from . import array_geometry
@@ -38,6 +46,319 @@ from math import ceil
 
 gdal.UseExceptions()
 
+# Cache of spatial sort orders (see Pointcloud.sort_spatially). None disables caching. Either a directory
+# or INDEX_CACHE_SIDECAR to store the cache files next to the las files. Can be set via the environment.
+INDEX_CACHE_SIDECAR = "sidecar"
+INDEX_CACHE_VERSION = 1
+INDEX_CACHE_ENV = "DHMQC_INDEX_CACHE"
+_INDEX_CACHE = None
+# Cleared after a failed write to the cache (e.g. sidecar files on read only tile storage).
+_INDEX_CACHE_WRITABLE = True
+# Number of evenly spaced entries of the point selection included in the cache key.
+INDEX_CACHE_KEY_SAMPLES = 1024
+# Cache of decoded las tiles shared by several processes (see set_tile_cache). None disables caching.
+TILE_CACHE_VERSION = 1
+_TILE_CACHE = None
+_TILE_CACHE_BUDGET = 0
+# Max. time (s) to wait for another (running) process reading a tile into the cache, before reading it as well.
+# The lock of a process which has stopped is broken right away.
+TILE_CACHE_WAIT = 120
+
+
+# Default number of threads used by the filter methods of Pointcloud - and the minimal number of
+# input points handled by a thread.
+FILTER_THREADS = 1
+FILTER_MIN_CHUNK = 4096
+# Initial buffer (in map units) around each block when triangulating in blocks. It is doubled until the triangles
+# in the core area of the block are known to match those of a global triangulation (see Pointcloud._core_triangles_stable).
+GRID_BLOCK_BUFFER = 50.0
+# (absolute path, Pointcloud) serving fromLAS calls for that path from memory - see set_preloaded.
+_PRELOADED = None
+
+
+def set_filter_threads(n):
+    """
+    Set the default number of threads used by the filter methods of Pointcloud.
+    Args:
+        n: number of threads - 1 to disable threading.
+    """
+    global FILTER_THREADS
+    if n < 1:
+        raise ValueError("Number of threads must be positive.")
+    FILTER_THREADS = n
+
+
+def set_index_cache(location):
+    """
+    Enable (or disable) caching of spatial sort orders of pointclouds read from las files.
+
+    When enabled, pointclouds read by fromLAS remember which points of which file (identified by
+    path, modification time and size) they consist of. sort_spatially will then store the sort order
+    and spatial index in versioned cache files, and later sorts of the same points with the same
+    parameters will load them rather than sorting again.
+    Args:
+        location: a directory (created if needed), INDEX_CACHE_SIDECAR to store next to the las files,
+            or None to disable.
+    """
+    global _INDEX_CACHE, _INDEX_CACHE_WRITABLE
+    if location is not None and location != INDEX_CACHE_SIDECAR and not os.path.isdir(location):
+        os.makedirs(location)
+    _INDEX_CACHE = location
+    _INDEX_CACHE_WRITABLE = True
+
+
+if os.environ.get(INDEX_CACHE_ENV):
+    set_index_cache(os.environ[INDEX_CACHE_ENV])
+
+
+def set_tile_cache(location, max_mb=1024):
+    """
+    Enable (or disable) a cache of decoded las tiles, which can be shared by several processes.
+
+    When enabled, fromLAS stores the points of the files it reads in compact form (see CompactSource)
+    as .npy files in the cache directory. Later reads of the same file (identified by path, modification
+    time and size) - also from other processes - memory map these files rather than reading and
+    decompressing the file again, and load time filters only copy the selected points. The least recently
+    used tiles are removed when the cache grows beyond max_mb. Use a directory on a memory backed file
+    system, like /dev/shm, to keep the cache in shared memory.
+    Args:
+        location: a directory or None to disable.
+        max_mb: size budget of the cache in megabytes.
+    """
+    global _TILE_CACHE, _TILE_CACHE_BUDGET
+    if location is not None and not os.path.isdir(location):
+        os.makedirs(location)
+    _TILE_CACHE = location
+    _TILE_CACHE_BUDGET = int(max_mb * 2**20)
+
+
+def evict_tile_cache(location, max_bytes, keep=None):
+    """
+    Remove the least recently used entries of a tile cache until its size is within max_bytes.
+    Processes which have already mapped a removed entry can keep using it (on posix systems).
+    Args:
+        location: tile cache directory.
+        max_bytes: size budget in bytes.
+        keep: name of an entry not to remove.
+    Returns:
+        The size of the cache in bytes afterwards.
+    """
+    entries = []
+    for f in os.listdir(location):
+        name = os.path.join(location, f)
+        if not f.endswith(".tile"):
+            continue
+        try:
+            entries.append((os.path.getmtime(name), _tile_entry_size(name), name))
+        except OSError:  # removed by another process
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(name, ignore_errors=True)
+        if not os.path.exists(name):
+            total -= size
+    return total
+
+
+def _tile_entry_size(name):
+    """Size in bytes of a tile cache entry."""
+    return sum(os.path.getsize(os.path.join(name, f)) for f in os.listdir(name))
+
+
+def _tile_cache_name(path):
+    """Return the name of the tile cache entry of a las file - a digest of the file identity."""
+    key = hashlib.sha1(repr((TILE_CACHE_VERSION,) + _file_identity(path)).encode("utf-8"))
+    return os.path.join(_TILE_CACHE, "%s.%s.tile" % (os.path.basename(path), key.hexdigest()[:24]))
+
+
+def _load_cached_tile(name):
+    """Memory map the arrays of a tile cache entry. Returns a CompactSource or None if not cached."""
+    try:
+        with open(os.path.join(name, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != TILE_CACHE_VERSION:
+            return None
+        arrays = dict((k, np.load(os.path.join(name, k + ".npy"), mmap_mode="r")) for k in meta["arrays"])
+        os.utime(name, None)  # mark as recently used
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    return CompactSource(arrays, meta["scale"], meta["offset"])
+
+
+def _save_cached_tile(name, source, path):
+    """Save the arrays of a CompactSource as a tile cache entry. Returns True if the entry exists afterwards."""
+    # write to a temporary directory and rename, so concurrent readers never see partial entries.
+    tmp = "%s.%d.tmp" % (name, os.getpid())
+    meta = {"version": TILE_CACHE_VERSION, "las": os.path.abspath(path), "arrays": sorted(source.arrays),
+            "scale": source.scale.tolist(), "offset": source.offset.tolist()}
+    try:
+        os.makedirs(tmp)
+        for k, arr in source.arrays.items():
+            np.save(os.path.join(tmp, k + ".npy"), arr)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp, name)
+    except (IOError, OSError) as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # another process might just have cached the same tile
+        if os.path.isdir(name):
+            return True
+        print("Unable to write tile cache: %s" % str(e))
+        return False
+    return True
+
+
+def _process_alive(pid):
+    """Check whether a process with the given pid is running on this machine."""
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x100000, False, pid)  # SYNCHRONIZE
+        if not handle:
+            return kernel32.GetLastError() == 5  # access denied - so it exists
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == 0x102  # WAIT_TIMEOUT - not signaled, i.e. running
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _claim_tile_lock(lock):
+    """Create a lock file holding the pid of this process. Returns False if it already exists."""
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        return False
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+    finally:
+        os.close(fd)
+    return True
+
+
+def _tile_lock_owner(lock):
+    """Return the pid in a lock file - None if it does not exist or the pid is not written yet."""
+    try:
+        with open(lock) as f:
+            return int(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def release_tile_locks(location, pid):
+    """
+    Remove the tile cache locks held by a process, e.g. after it has been terminated while reading a tile.
+    Args:
+        location: the tile cache directory.
+        pid: the process id.
+    Returns:
+        The number of locks removed.
+    """
+    n = 0
+    if not os.path.isdir(location):
+        return n
+    for entry in os.listdir(location):
+        lock = os.path.join(location, entry)
+        if entry.endswith(".lock") and _tile_lock_owner(lock) == pid:
+            try:
+                os.remove(lock)
+                n += 1
+            except OSError:
+                pass
+    return n
+
+
+def _cached_tile_source(path):
+    """
+    Get a CompactSource with all points of a las file from the tile cache. The file is read and
+    added to the cache if not there already.
+    """
+    name = _tile_cache_name(path)
+    source = _load_cached_tile(name)
+    if source is not None:
+        return source
+    # claim the tile, so that other processes wait for it rather than reading it too
+    lock = name + ".lock"
+    t_end = time.time() + TILE_CACHE_WAIT
+    while not _claim_tile_lock(lock):
+        owner = _tile_lock_owner(lock)
+        if owner is not None and not _process_alive(owner):
+            # left behind by a process which stopped while reading the tile
+            try:
+                os.remove(lock)
+            except OSError:
+                pass
+            continue
+        source = _load_cached_tile(name)
+        if source is not None:
+            return source
+        if time.time() >= t_end:
+            # the owner is still reading - read it as well rather than waiting any longer
+            return _read_tile_to_cache(name, path)
+        time.sleep(0.1)
+    try:
+        # the previous owner might have finished just before we claimed the tile
+        source = _load_cached_tile(name)
+        if source is None:
+            source = _read_tile_to_cache(name, path)
+        return source
+    finally:
+        # a waiter might have broken the lock in the meantime - only remove our own
+        if _tile_lock_owner(lock) == os.getpid():
+            try:
+                os.remove(lock)
+            except OSError:
+                pass
+
+
+def _read_tile_to_cache(name, path):
+    """Read all points of a las file into a CompactSource and add it to the tile cache if within budget."""
+    if not path.endswith(".laz") and not las_io.read_header(path)["compressed"]:
+        source = CompactSource.from_pointcloud(fromLasSource(las_io.LasMemmap(path), True))
+    else:
+        las = laspy.file.File(path)
+        source = CompactSource.from_pointcloud(fromLaspy(las, True, lazy=True))
+        las.close()
+    size = sum(arr.nbytes for arr in source.arrays.values())
+    if size <= _TILE_CACHE_BUDGET and _save_cached_tile(name, source, path):
+        evict_tile_cache(_TILE_CACHE, _TILE_CACHE_BUDGET, keep=name)
+    return source
+
+
+def set_preloaded(path, pc=None):
+    """
+    Serve fromLAS calls for a file from a pointcloud kept in memory, so that several checks
+    of the same tile only read (and decompress) it once. Load time filters are applied to the
+    preloaded pointcloud and every call gets its own copy of the points.
+    Args:
+        path: path to las / laz file, or None to stop serving a preloaded pointcloud.
+        pc: unfiltered Pointcloud with return numbers read from path. Read here if not given.
+    Returns:
+        The preloaded Pointcloud (None if path is None).
+    """
+    global _PRELOADED
+    _PRELOADED = None
+    if path is None:
+        return None
+    if pc is None:
+        pc = fromLAS(path, include_return_number=True)
+    _PRELOADED = (os.path.abspath(path), pc)
+    return pc
+
+
+def _file_identity(path):
+    """Return (absolute path, modification time, size) of a file."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime, st.st_size)
+
 def fromAny(path, **kwargs):
     """
     Load a pointcloud from a range of 'formats'. The specific 'driver' to use is decided from the filename extension.
@@ -72,7 +393,7 @@ def fromAny(path, **kwargs):
 
 # read a las file and return a pointcloud - spatial selection by xy_box
 # (x1,y1,x2,y2) and / or z_box (z1,z2) and/or list of classes...
-def fromLAS(path, include_return_number=False, xy_box=None, z_box=None, cls=None, **kwargs):
+def fromLAS(path, include_return_number=False, xy_box=None, z_box=None, cls=None, mmap=False, lazy=False, **kwargs):
     """
     Load a pointcloud from las / laz format via laspy.
 
@@ -83,61 +404,390 @@ def fromLAS(path, include_return_number=False, xy_box=None, z_box=None, cls=None
         xy_box: (x1,y2,x2,y2), filter by extent in load time. Will NOT work for laz files.
         z_box: (z1,z2), filter by z-extent in load time. Will NOT work for laz files.
         cls: list of classes to filter by in load time. Will NOT work for laz files.
+        chunk_size: number of point records to process at a time (default LAS_CHUNK_SIZE).
+        mmap: bool, memory map an uncompressed las file and only read attributes as they are used.
+              Compressed files are read normally (or lazily if lazy is True).
+        lazy: bool, keep the laspy file open and only read attributes as they are used.
     Returns:
         A pointcloud.Pointcloud object.
     """
-    las = laspy.file.File(path)
-    pc = fromLaspy(las, include_return_number, xy_box, z_box, cls, close=False)
-    las.close()
+    if _PRELOADED is not None and _PRELOADED[0] == os.path.abspath(path):
+        return fromPreloaded(_PRELOADED[1], include_return_number, xy_box, z_box, cls)
+    if xy_box is not None and not las_io.box_intersects_header(path, xy_box):
+        # Nothing to read - skip opening the point data.
+        return empty_pointcloud(include_return_number)
+    if _TILE_CACHE is not None:
+        pc = fromLasSource(_cached_tile_source(path), include_return_number, xy_box, z_box, cls, **kwargs)
+    elif mmap and not path.endswith(".laz") and not las_io.read_header(path)["compressed"]:
+        source = las_io.LasMemmap(path)
+        pc = fromLasSource(source, include_return_number, xy_box, z_box, cls, **kwargs)
+    else:
+        las = laspy.file.File(path)
+        pc = fromLaspy(las, include_return_number, xy_box, z_box, cls, close=False, lazy=lazy, **kwargs)
+        if not lazy:
+            las.close()
+    if _INDEX_CACHE is not None:
+        pc.origin = _file_identity(path)
     return pc
 
-def fromLaspy(las, include_return_number=False, xy_box=None, z_box=None, cls=None, **kwargs):
+
+# Number of point records handled at a time when reading via laspy. Keeps the
+# float64 temporaries small, so peak memory follows the size of the output.
+LAS_CHUNK_SIZE = 2**20
+
+
+def _laspy_raw_views(las):
+    """
+    Get (mostly) uncopied views of the point record fields we need from a laspy file object.
+
+    Args:
+        las: laspy.file.File object.
+    Returns:
+        Tuple of (X, Y, Z, raw classification, classification mask, raw return number, return number mask).
+    """
+    if las.header.data_format_id < 6:
+        # classification and return number are packed bit fields - mask per chunk.
+        return las.X, las.Y, las.Z, las.raw_classification, 31, las.flag_byte, 7
+    return las.X, las.Y, las.Z, las.classification, 0xFF, las.return_num, 0xFF
+
+
+class LaspySource(object):
+    """
+    Pointcloud source reading attributes from an open laspy file object on request.
+    """
+    attrs = ("xy", "z", "c", "pid", "rn")
+
+    def __init__(self, las):
+        """
+        Args:
+            las: laspy.file.File object - must be kept open as long as the source is used.
+        """
+        self.las = las
+        self.scale = las.header.scale
+        self.offset = las.header.offset
+        self._views = _laspy_raw_views(las)
+
+    @property
+    def size(self):
+        return self._views[0].shape[0]
+
+    def raw_views(self):
+        """Return (X, Y, Z, raw classification, classification mask, raw return number, return number mask)."""
+        return self._views
+
+    def get(self, attr, index=None):
+        """
+        Get a (scaled / unpacked) pointcloud attribute.
+        Args:
+            attr: one of xy, z, c, pid or rn.
+            index: optional index array or mask selecting the points to read.
+        Returns:
+            numpy array.
+        """
+        X, Y, Z, c_raw, c_mask, r_raw, r_mask = self._views
+        if index is None:
+            index = slice(None)
+        if attr == "xy":
+            return np.column_stack((X[index] * self.scale[0] + self.offset[0],
+                                    Y[index] * self.scale[1] + self.offset[1]))
+        if attr == "z":
+            return Z[index] * self.scale[2] + self.offset[2]
+        if attr == "c":
+            return c_raw[index] & c_mask
+        if attr == "pid":
+            return self.las.pt_src_id[index]
+        if attr == "rn":
+            return r_raw[index] & r_mask
+        raise ValueError("Unknown attribute: %s" % attr)
+
+
+# Default resolution of compact coordinates - mm, which keeps e.g. geoid warped heights.
+COMPACT_SCALE = 0.001
+# Storage types of the compact attributes.
+COMPACT_DTYPES = {"c": np.uint8, "pid": np.uint16, "rn": np.uint8}
+COMPACT_INT32_LIMIT = 2**31 - 1
+
+
+class CompactSource(object):
+    """
+    Pointcloud source keeping the attributes in memory in compact form, like in a las file:
+    coordinates as int32 with a scale and an offset, class and return number as uint8 and
+    point source id as uint16. Attributes are converted back to float64 / int32 when read.
+    """
+
+    def __init__(self, arrays, scale, offset):
+        """
+        Args:
+            arrays: dict with the int32 arrays X, Y, Z and (optionally) c, pid and rn in compact dtypes.
+            scale: (sx, sy, sz)
+            offset: (ox, oy, oz)
+        """
+        self.arrays = arrays
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.attrs = ("xy", "z") + tuple(a for a in ("c", "pid", "rn") if a in arrays)
+
+    @classmethod
+    def from_pointcloud(cls, pc, scale=None, offset=None, chunk_size=LAS_CHUNK_SIZE):
+        """
+        Create a CompactSource from the attributes of a pointcloud. Converts chunkwise, so that
+        attributes of a source backed pointcloud are never fully loaded as float64.
+        Args:
+            pc: Pointcloud object.
+            scale: (sx, sy, sz). Defaults to the scale of the source of pc or COMPACT_SCALE.
+            offset: (ox, oy, oz). Defaults to the offset of the source of pc or the lower left corner of pc.
+            chunk_size: number of points to convert at a time.
+        Returns:
+            A CompactSource object.
+        Raises:
+            ValueError if attributes do not fit in the compact dtypes.
+        """
+        source = pc.source
+        n = pc.get_size()
+        if scale is None:
+            scale = source.scale if hasattr(source, "scale") else (COMPACT_SCALE,) * 3
+        if offset is None:
+            if hasattr(source, "offset"):
+                offset = source.offset
+            elif n > 0:
+                offset = np.floor(np.append(pc.get_bounds()[:2], pc.get_z_bounds()[0]))
+            else:
+                offset = (0.0, 0.0, 0.0)
+        scale = np.asarray(scale, dtype=np.float64)
+        offset = np.asarray(offset, dtype=np.float64)
+        if isinstance(source, CompactSource) and (source.scale == scale).all() and (source.offset == offset).all() \
+                and not any(a in pc.__dict__ for a in ("xy", "z")):
+            # Already in the right form - just take what is referenced.
+            index = pc.source_index if pc.source_index is not None else slice(None)
+            arrays = dict((k, v[index]) for k, v in source.arrays.items() if k in ("X", "Y", "Z") or pc.has_attr(k))
+            for a in ("c", "pid", "rn"):
+                if pc.__dict__.get(a) is not None:
+                    arrays[a] = _to_compact_int(pc.__dict__[a], COMPACT_DTYPES[a])
+            return cls(arrays, scale, offset)
+        arrays = {"X": np.empty((n,), dtype=np.int32), "Y": np.empty((n,), dtype=np.int32),
+                  "Z": np.empty((n,), dtype=np.int32)}
+        for a in ("c", "pid", "rn"):
+            if pc.has_attr(a):
+                arrays[a] = np.empty((n,), dtype=COMPACT_DTYPES[a])
+        for i in range(0, n, chunk_size):
+            sl = slice(i, min(i + chunk_size, n))
+            xy = pc._get_chunk("xy", sl)
+            arrays["X"][sl] = _to_compact_coord(xy[:, 0], scale[0], offset[0])
+            arrays["Y"][sl] = _to_compact_coord(xy[:, 1], scale[1], offset[1])
+            arrays["Z"][sl] = _to_compact_coord(pc._get_chunk("z", sl), scale[2], offset[2])
+            for a in ("c", "pid", "rn"):
+                if a in arrays:
+                    arrays[a][sl] = _to_compact_int(pc._get_chunk(a, sl), COMPACT_DTYPES[a])
+        return cls(arrays, scale, offset)
+
+    @property
+    def size(self):
+        return self.arrays["X"].shape[0]
+
+    def raw_views(self):
+        """Return (X, Y, Z, class, class mask, return number, return number mask) - the latter None if not stored."""
+        return (self.arrays["X"], self.arrays["Y"], self.arrays["Z"], self.arrays.get("c"), 0xFF,
+                self.arrays.get("rn"), 0xFF)
+
+    def concatenate(self, other):
+        """
+        Concatenate with another CompactSource with the same scale, offset and attributes.
+        Returns:
+            A new CompactSource object.
+        """
+        if not ((self.scale == other.scale).all() and (self.offset == other.offset).all()):
+            raise ValueError("Compact sources must have the same scale and offset.")
+        if set(self.arrays) != set(other.arrays):
+            raise ValueError("Compact sources must have the same attributes.")
+        arrays = dict((k, np.concatenate((self.arrays[k], other.arrays[k]))) for k in self.arrays)
+        return CompactSource(arrays, self.scale, self.offset)
+
+    def get(self, attr, index=None):
+        """
+        Get an attribute converted back to float64 / int32.
+        Args:
+            attr: one of xy, z, c, pid or rn.
+            index: optional index array or mask selecting the points to read.
+        Returns:
+            numpy array.
+        """
+        if index is None:
+            index = slice(None)
+        if attr == "xy":
+            return np.column_stack((self.arrays["X"][index] * self.scale[0] + self.offset[0],
+                                    self.arrays["Y"][index] * self.scale[1] + self.offset[1]))
+        if attr == "z":
+            return self.arrays["Z"][index] * self.scale[2] + self.offset[2]
+        if attr in self.arrays:
+            return self.arrays[attr][index].astype(np.int32)
+        raise ValueError("Unknown attribute: %s" % attr)
+
+
+def _to_compact_coord(v, scale, offset):
+    """Convert float64 coordinates to scaled int32 values."""
+    v = np.rint((v - offset) / scale)
+    if v.size > 0 and (v.min() < -COMPACT_INT32_LIMIT or v.max() > COMPACT_INT32_LIMIT):
+        raise ValueError("Coordinates out of range for compact storage with scale %g and offset %g" % (scale, offset))
+    return v.astype(np.int32)
+
+
+def _to_compact_int(v, dtype):
+    """Convert an integer attribute to a compact dtype."""
+    info = np.iinfo(dtype)
+    if v.size > 0 and (v.min() < info.min or v.max() > info.max):
+        raise ValueError("Values out of range for compact storage as %s" % np.dtype(dtype).name)
+    return v.astype(dtype)
+
+
+def _filter_mask(x, y, z, c, xy_box, z_box, cls):
+    """Boolean mask of points satisfying the load time filters. xy limits are inclusive, z limits exclusive."""
+    I = np.ones(c.shape[0], dtype=bool)
+    if cls is not None:
+        I &= np.isin(c, cls)
+    if xy_box is not None:
+        (xmin, ymin, xmax, ymax) = xy_box
+        I &= np.logical_and(x >= xmin, x <= xmax)
+        I &= np.logical_and(y >= ymin, y <= ymax)
+    if z_box is not None:
+        (zmin, zmax) = z_box
+        I &= np.logical_and(z > zmin, z < zmax)
+    return I
+
+
+def fromPreloaded(pc, include_return_number=False, xy_box=None, z_box=None, cls=None):
+    """
+    Apply the load time filters of fromLAS to a pointcloud already in memory.
+    Args:
+        pc: Pointcloud to select from - not modified.
+        include_return_number: bool, indicates whether return number should be included.
+        xy_box: (x1,y2,x2,y2), filter by extent.
+        z_box: (z1,z2), filter by z-extent.
+        cls: list of classes to filter by.
+    Returns:
+        A new pointcloud.Pointcloud object.
+    """
+    if cls is not None:
+        cls = np.asarray(cls)
+    I = _filter_mask(pc.xy[:, 0] if xy_box is not None else None,
+                     pc.xy[:, 1] if xy_box is not None else None,
+                     pc.z if z_box is not None else None,
+                     pc.c, xy_box, z_box, cls)
+    out = pc.cut(I)
+    if not include_return_number:
+        out.rn = None
+    return out
+
+
+def fromLaspy(las, include_return_number=False, xy_box=None, z_box=None, cls=None, chunk_size=LAS_CHUNK_SIZE, lazy=False, **kwargs):
     '''
     Create a Pointcloud object from an existing laspy object.
 
+    The point records are processed in chunks of chunk_size points, applying the
+    filters per chunk, so only the surviving points are ever converted to float64.
+
     Args:
         path: path to las / laz file.
         include_return_number: bool, indicates whether return number should be included.
         xy_box: (x1,y2,x2,y2), filter by extent in load time. Will NOT work for laz files.
         z_box: (z1,z2), filter by z-extent in load time. Will NOT work for laz files.
         cls: list of classes to filter by in load time. Will NOT work for laz files.
+        chunk_size: number of point records to process at a time.
+        lazy: bool, do not read any attributes before they are used. The laspy object must be kept open.
 
     Returns:
         A pointcloud.Pointcloud object.
     '''
     assert isinstance(las, laspy.file.File)
-
+    if lazy:
+        return fromLasSource(LaspySource(las), include_return_number, xy_box, z_box, cls, chunk_size)
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+
+    X, Y, Z, c_raw, c_mask, r_raw, r_mask = _laspy_raw_views(las)
+    scale = las.header.scale
+    offset = las.header.offset
     if cls is not None:
-        # If we only want to read certain classes we start with a blank
-        # index array and add the relevant points to it.
-        I = np.zeros(len(las.x), dtype=bool)
-        for c in cls:
-            I |= las.classification == c
-    else:
-        # otherwise we allow all classes (and hence all points)
-        I = np.ones(len(las.x), dtype=bool)
-
-    # from here on down we only reduce the index array
-    # first by a xy bounding box and the by z-limits
-    if xy_box is not None:
-        (xmin, ymin, xmax, ymax) = xy_box
-        I &= np.logical_and(las.x >= xmin, las.x <= xmax)
-        I &= np.logical_and(las.y >= ymin, las.y <= ymax)
+        cls = np.asarray(cls)
+
+    out = {"xy": [], "z": [], "c": [], "pid": [], "rn": [], "index": []}
+    pid_raw = las.pt_src_id
+    n = X.shape[0]
+    # keep track of which points we read, if needed for the index cache
+    track = _INDEX_CACHE is not None and (xy_box is not None or z_box is not None or cls is not None)
+
+    for i in range(0, n, chunk_size):
+        sl = slice(i, min(i + chunk_size, n))
+        c = c_raw[sl] & c_mask
+        x = X[sl] * scale[0] + offset[0]
+        y = Y[sl] * scale[1] + offset[1]
+        z = Z[sl] * scale[2] + offset[2]
+
+        I = _filter_mask(x, y, z, c, xy_box, z_box, cls)
+        out["xy"].append(np.column_stack((x[I], y[I])))
+        out["z"].append(z[I])
+        out["c"].append(c[I])
+        out["pid"].append(pid_raw[sl][I])
+        if include_return_number:
+            out["rn"].append(r_raw[sl][I] & r_mask)
+        if track:
+            out["index"].append(np.flatnonzero(I) + i)
+
+    if n == 0:
+        return empty_pointcloud(include_return_number)
+    xy = np.vstack(out["xy"])
+    z = np.concatenate(out["z"])
+    c = np.concatenate(out["c"])
+    pid = np.concatenate(out["pid"])
+    r = np.concatenate(out["rn"]) if include_return_number else None
+    index = np.concatenate(out["index"]) if track else None
+    del out
+
+    pc = Pointcloud(xy, z, c, pid, r)
+    pc.origin_index = index
+    return pc
 
-    if z_box is not None:
-        (zmin, zmax) = z_box
-        I &= np.logical_and(las.z > zmin, las.z < zmax)
 
-    r = None
-    if include_return_number:
-        r = las.return_num[I]
+def fromLasSource(source, include_return_number=False, xy_box=None, z_box=None, cls=None, chunk_size=LAS_CHUNK_SIZE, **kwargs):
+    """
+    Create a Pointcloud object backed by a las source (a memory mapped las file or an open laspy file).
 
-    xy = np.column_stack((las.x[I], las.y[I]))
-    z = las.z[I]
-    cls = las.classification[I]
-    pid = las.pt_src_id[I]
+    No attributes are read before they are used. If filters are given, the needed fields are scanned
+    in chunks of chunk_size points and the pointcloud will reference the surviving points only.
 
-    return Pointcloud(xy, z, cls, pid, r)
+    Args:
+        source: las_io.LasMemmap or LaspySource object.
+        include_return_number: bool, indicates whether return number should be included.
+        xy_box: (x1,y2,x2,y2), filter by extent in load time.
+        z_box: (z1,z2), filter by z-extent in load time.
+        cls: list of classes to filter by in load time.
+        chunk_size: number of point records to process at a time.
+    Returns:
+        A pointcloud.Pointcloud object.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    index = None
+    if xy_box is not None or z_box is not None or cls is not None:
+        X, Y, Z, c_raw, c_mask, _, _ = source.raw_views()
+        scale, offset = source.scale, source.offset
+        if cls is not None:
+            cls = np.asarray(cls)
+        n = source.size
+        index = []
+        for i in range(0, n, chunk_size):
+            sl = slice(i, min(i + chunk_size, n))
+            # only scale what is needed by the filters
+            x = X[sl] * scale[0] + offset[0] if xy_box is not None else None
+            y = Y[sl] * scale[1] + offset[1] if xy_box is not None else None
+            z = Z[sl] * scale[2] + offset[2] if z_box is not None else None
+            I = _filter_mask(x, y, z, c_raw[sl] & c_mask, xy_box, z_box, cls)
+            index.append(np.flatnonzero(I) + i)
+        index = np.concatenate(index) if index else np.empty((0,), dtype=np.int64)
+    pc = Pointcloud(None, None, source=source, source_index=index)
+    pc.origin_index = index
+    if not include_return_number:
+        pc.rn = None
+    return pc
 
 
 def fromNpy(path, **kwargs):
@@ -294,31 +944,295 @@ def empty_like(pc):
     """
     out = Pointcloud(np.empty((0, 2), dtype=np.float64), np.empty((0,), dtype=np.float64))
     for a in ["c", "pid", "rn"]:
-        if pc.__dict__[a] is not None:
-            out.__dict__[a] = np.empty((0,), dtype=np.int32)
+        if pc.has_attr(a):
+            setattr(out, a, np.empty((0,), dtype=np.int32))
     return out
 
 
+def empty_pointcloud(include_return_number=False):
+    """
+    Construct an empty Pointcloud object with the attributes we get when reading a las file.
+    Args:
+        include_return_number: bool, indicates whether return number should be included.
+    Returns:
+        Pointcloud.pointcloud object.
+    """
+    rn = np.empty((0,), dtype=np.int32) if include_return_number else None
+    return Pointcloud(np.empty((0, 2), dtype=np.float64), np.empty((0,), dtype=np.float64),
+                      np.empty((0,), dtype=np.int32), np.empty((0,), dtype=np.int32), rn)
+
+
+def _compose_index(index, mask):
+    """Compose an index array (None meaning everything) with a mask or index array."""
+    if index is not None:
+        return index[mask]
+    mask = np.asarray(mask)
+    if mask.dtype == bool:
+        return np.flatnonzero(mask)
+    return mask
+
+
+def _is_iterable(x):
+    try:
+        iter(x)
+    except TypeError:
+        return False
+    return True
+
+
+class Partition(object):
+    """
+    Grouping of the points of a pointcloud by the values of an integer attribute (like class or point source id).
+
+    The indices of the points with a given value are stored contiguously in order, so the points of each
+    value are available as a slice - without scanning the full pointcloud again.
+    Attributes:
+        keys: sorted array of the unique values.
+        counts: number of points for each key.
+        offsets: start of the slice of order for each key (with the total count appended).
+        order: the indices of the points, stably sorted by value.
+    """
+
+    def __init__(self, pc, values):
+        """
+        Args:
+            pc: the Pointcloud object to partition (can be None, if the partition is not used for cutting).
+            values: 1d integer array with a value for each point.
+        """
+        self._pc = pc
+        self.values = values
+        if values.size == 0:
+            self.keys = np.empty((0,), dtype=values.dtype)
+            self.counts = np.empty((0,), dtype=np.int64)
+            self.order = np.empty((0,), dtype=np.int64)
+        else:
+            vmin = values.min()
+            vrange = int(values.max()) - int(vmin)
+            if vrange < 2**16:
+                # Small range (always the case for classes and strips): bincount and a stable
+                # sort of 8 / 16 bit keys, which numpy does by radix sort in linear time.
+                shifted = (values - vmin).astype(np.uint8 if vrange < 2**8 else np.uint16)
+                counts = np.bincount(shifted, minlength=vrange + 1)
+                self.keys = (np.flatnonzero(counts) + vmin).astype(values.dtype)
+                self.counts = counts[counts > 0]
+                self.order = np.argsort(shifted, kind="stable")
+            else:
+                self.keys, self.counts = np.unique(values, return_counts=True)
+                self.order = np.argsort(values, kind="stable")
+        self.offsets = np.zeros((self.keys.size + 1,), dtype=np.int64)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+    def __len__(self):
+        return self.keys.size
+
+    def _position(self, key):
+        i = np.searchsorted(self.keys, key)
+        if i < self.keys.size and self.keys[i] == key:
+            return i
+        return None
+
+    def count(self, key):
+        """
+        Number of points with value key.
+        Args:
+            key: a value or an iterable of values.
+        Returns:
+            Integer count.
+        """
+        if _is_iterable(key):
+            return sum(self.count(k) for k in key)
+        i = self._position(key)
+        return int(self.counts[i]) if i is not None else 0
+
+    def indices(self, key):
+        """
+        Indices (in increasing order) of the points with value key.
+        Args:
+            key: a value or an iterable of values.
+        Returns:
+            Index array - a view for a single value.
+        """
+        if _is_iterable(key):
+            parts = [self.indices(k) for k in key]
+            return np.sort(np.concatenate(parts)) if parts else np.empty((0,), dtype=np.int64)
+        i = self._position(key)
+        if i is None:
+            return self.order[:0]
+        return self.order[self.offsets[i]:self.offsets[i + 1]]
+
+    def cut(self, key):
+        """
+        Cut the pointcloud to the points with value key.
+        Args:
+            key: a value or an iterable of values.
+        Returns:
+            A new Pointcloud object.
+        Raises:
+            ValueError: if the partition is not bound to a pointcloud.
+        """
+        if self._pc is None:
+            raise ValueError("Partition is not bound to a pointcloud.")
+        return self._pc.cut(self.indices(key))
+
+    def _bind(self, pc):
+        # a shallow copy sharing the arrays, which cuts from pc
+        part = copy.copy(self)
+        part._pc = pc
+        return part
+
+    def items(self):
+        """Iterate over (key, indices) pairs."""
+        for i, key in enumerate(self.keys):
+            yield key, self.order[self.offsets[i]:self.offsets[i + 1]]
+
+
+# Pointcloud attributes and the factories used to bring them on the expected form.
+PC_ATTRS = ("xy", "z", "c", "pid", "rn")
+PC_ATTR_FACTORIES = {"xy": point_factory, "z": z_factory, "c": int_array_factory,
+                     "pid": int_array_factory, "rn": int_array_factory}
+
+
 class Pointcloud(object):
     """
     Pointcloud class constructed from a xy and a z array. Optionally also classification,point source id and return number integer arrays
+
+    Alternatively the pointcloud can be backed by a 'source' (like a las_io.LasMemmap), from which the
+    attributes are read on first access. A source must have a size, a tuple attrs of the attributes it
+    can deliver and a get(attr, index=None) method. Cutting, thinning and sorting only slice the loaded
+    attributes and compose the index into the source for the rest.
     """
 
-    def __init__(self, xy, z, c=None, pid=None, rn=None):
-        self.xy = point_factory(xy)
-        self.z = z_factory(z)
-        if z.shape[0] != xy.shape[0]:
-            raise ValueError("z must have length equal to number of xy-points")
-        self.c = int_array_factory(c)
-        self.rn = int_array_factory(rn)
-        self.pid = int_array_factory(pid)
+    def __init__(self, xy, z, c=None, pid=None, rn=None, source=None, source_index=None):
+        # source_index: None or an index array selecting the points of this pointcloud in the source.
+        self.source = source
+        self.source_index = source_index
+        if source is None:
+            self.xy = point_factory(xy)
+            self.z = z_factory(z)
+            if z.shape[0] != xy.shape[0]:
+                raise ValueError("z must have length equal to number of xy-points")
+            self.c = int_array_factory(c)
+            self.rn = int_array_factory(rn)
+            self.pid = int_array_factory(pid)
         self.triangulation = None
         self.triangle_validity_mask = None
         self.bbox = None  # [x1,y1,x2,y2]
         self.index_header = None
         self.spatial_index = None
+        self.strip_partition = None
+        self.strip_partition_key = None
+        # (path, mtime, size) of the las file the points were read from and an index array of the
+        # points in the file (None means all points in file order). Only tracked when the index cache
+        # is enabled and cleared when xy is modified by a method of the pointcloud.
+        self.origin = None
+        self.origin_index = None
+        # Set by compact(): attributes are then decoded from the compact source on each access and not kept.
+        self.keep_compact = False
         # TODO: implement attribute handling nicer....
-        self.pc_attrs = ["xy", "z", "c", "pid", "rn"]
+        self.pc_attrs = list(PC_ATTRS)
+
+    def __setattr__(self, name, value):
+        if name == "xy":
+            # the points might have moved - a cached sort order of the origin does not apply anymore.
+            # Note that modifying xy in place will not be detected.
+            self.__dict__["origin"] = None
+        object.__setattr__(self, name, value)
+
+    def __getattr__(self, name):
+        # Only called when an attribute is not found the normal way - i.e. not loaded yet.
+        source = self.__dict__.get("source")
+        if source is None or name not in PC_ATTRS:
+            raise AttributeError(name)
+        value = self._read_from_source(name, self.source_index)
+        if self.__dict__.get("keep_compact") and isinstance(source, CompactSource):
+            # transient - read only, so that modifications in place are not silently lost
+            if value is not None:
+                value.flags.writeable = False
+            return value
+        self.__dict__[name] = value
+        return value
+
+    def _read_from_source(self, a, index):
+        """Read an attribute for the points given by index from the source, or None if not available."""
+        if a not in self.source.attrs:
+            return None
+        return PC_ATTR_FACTORIES[a](self.source.get(a, index))
+
+    def _modifiable(self, a):
+        """Get an attribute for modification in place - a transiently decoded attribute is kept from now on."""
+        if a not in self.__dict__:
+            self.__dict__[a] = self._read_from_source(a, self.source_index)
+        return self.__dict__[a]
+
+    def _attr_identity(self, a):
+        """Identify the current values of an attribute without reading it: the loaded array, or the source and index it is read from."""
+        if a in self.__dict__:
+            return (self.__dict__[a], None)
+        return (self.source, self.source_index)
+
+    def _source_index(self, mask):
+        """Compose the current source index with a mask or index array."""
+        return _compose_index(self.source_index, mask)
+
+    def has_attr(self, a):
+        """Check whether the attribute a (one of pc_attrs) is set - without loading it from a source."""
+        if a in self.__dict__:
+            return self.__dict__[a] is not None
+        if self.source is not None:
+            return a in self.source.attrs
+        return False
+
+    def _get_chunk(self, a, sl):
+        """Get the points given by the slice sl of an attribute - without loading it from a source."""
+        if a in self.__dict__:
+            return self.__dict__[a][sl]
+        if self.source_index is not None:
+            return self.source.get(a, self.source_index[sl])
+        return self.source.get(a, sl)
+
+    def compact(self, scale=None, offset=None):
+        """
+        Convert the pointcloud 'in place' to compact storage (see CompactSource). Attributes are converted
+        back to float64 / int32 on each access and not kept, so the full sized attributes never take up
+        memory for longer than they are used - so read an attribute once, rather than on each pass of a loop.
+        The converted attributes are read only - assign to an attribute (or call load_attrs) to modify it.
+        Pointclouds cut from this keep their converted attributes as usual.
+        Args:
+            scale: (sx, sy, sz). Defaults to the scale of the current source or COMPACT_SCALE.
+            offset: (ox, oy, oz). Defaults to the offset of the current source or the lower left corner.
+        Returns:
+            A reference to self.
+        Raises:
+            ValueError if attributes do not fit in the compact representation.
+        """
+        source = CompactSource.from_pointcloud(self, scale, offset)
+        self._attach_source(source)
+        self.keep_compact = True
+        return self
+
+    def is_compact(self):
+        """Return True if the pointcloud is backed by a CompactSource."""
+        return isinstance(self.source, CompactSource)
+
+    def _attach_source(self, source):
+        """Make a source the sole storage of the pointcloud - except for attributes set to None."""
+        self.clear_derived_attrs()
+        for a in self.pc_attrs:
+            if self.__dict__.get(a, 0) is not None:
+                self.__dict__.pop(a, None)
+        self.source = source
+        self.source_index = None
+
+    def load_attrs(self):
+        """
+        Read all attributes which are not loaded yet from the source (if any) and detach from the source.
+        """
+        if self.source is not None:
+            for a in self.pc_attrs:
+                self._modifiable(a)
+            self.source = None
+            self.source_index = None
+            self.keep_compact = False
 
     def extend(self, other, least_common=False):
         """
@@ -334,8 +1248,11 @@ class Pointcloud(object):
         # tell what the proper implementation is...
         if not isinstance(other, Pointcloud):
             raise ValueError("Other argument must be a Pointcloud")
+        compact = self.is_compact()
+        if not compact:
+            self.load_attrs()
         for a in self.pc_attrs:
-            if (self.__dict__[a] is not None) and (other.__dict__[a] is None):
+            if self.has_attr(a) and not other.has_attr(a):
                 if not least_common:
                     raise ValueError(
                         "Other pointcloud does not have attribute " +
@@ -345,18 +1262,28 @@ class Pointcloud(object):
                     self.__dict__[a] = None  # delete attr
         # all is well and we continue - garbage collect previous deduced objects...
         self.clear_derived_attrs()
+        self.origin = None
+        if compact:
+            # Stay compact - other is converted to the scale and offset of this.
+            this = CompactSource.from_pointcloud(self, self.source.scale, self.source.offset)
+            that = CompactSource.from_pointcloud(other, self.source.scale, self.source.offset)
+            for a in ("c", "pid", "rn"):
+                if a not in this.arrays:
+                    that.arrays.pop(a, None)
+            self._attach_source(this.concatenate(that))
+            return
         for a in self.pc_attrs:
             if self.__dict__[a] is not None:
                 self.__dict__[a] = np.require(
                     np.concatenate(
-                        (self.__dict__[a], other.__dict__[a])), requirements=[
+                        (self.__dict__[a], getattr(other, a))), requirements=[
                         'A', 'O', 'C'])
 
     def might_overlap(self, other):
         return self.might_intersect_box(other.get_bounds())
 
     def might_intersect_box(self, box):  # box=(x1,y1,x2,y2)
-        if self.xy.shape[0] == 0 or box is None:
+        if self.get_size() == 0 or box is None:
             return False
         b1 = self.get_bounds()
         xhit = box[0] <= b1[0] <= box[2] or b1[0] <= box[0] <= b1[2]
@@ -407,6 +1334,10 @@ class Pointcloud(object):
 
     def get_size(self):
         """Return point count."""
+        if self.source is not None and "xy" not in self.__dict__:
+            if self.source_index is not None:
+                return self.source_index.shape[0]
+            return self.source.size
         return self.xy.shape[0]
 
     def get_classes(self):
@@ -422,11 +1353,46 @@ class Pointcloud(object):
 
     def get_pids(self):
         """Return the list of unique point source ids"""
-        if self.pid is not None:
-            return np.unique(self.pid)
+        if self.has_attr("pid"):
+            return self.get_strip_partition().keys
         else:
             return []
 
+    def get_strip_partition(self):
+        """
+        Return the Partition of the points by point source id. It is cached until the pointcloud is modified
+        in place (or pid is reassigned), so repeated strip cuts do not rescan the pointcloud. For a compacted
+        pointcloud it is kept as long as the points read from the source are the same.
+        Note that modifying pid in place will not be detected.
+        Raises:
+            ValueError: If point source id attribute is not set.
+        """
+        if not self.has_attr("pid"):
+            raise ValueError("Point source id attribute not set")
+        key = self._attr_identity("pid")
+        if self.strip_partition is None or any(x is not y for x, y in zip(key, self.strip_partition_key)):
+            # cached without a reference back to the pointcloud, to avoid a reference cycle
+            self.strip_partition = Partition(None, self.pid)
+            self.strip_partition_key = key
+        return self.strip_partition._bind(self)
+
+    def partition_by(self, attr):
+        """
+        Group the points by the values of an integer attribute in a single pass.
+        Args:
+            attr: name of the attribute - "c", "pid" or "rn".
+        Returns:
+            A Partition object with keys, counts and per key index slices.
+        Raises:
+            ValueError: if the attribute is not set.
+        """
+        if attr not in ("c", "pid", "rn"):
+            raise ValueError("Can only partition by c, pid or rn.")
+        values = getattr(self, attr)
+        if values is None:
+            raise ValueError("Attribute " + attr + " not set.")
+        return Partition(self, values)
+
     def get_return_numbers(self):
         """Return the list of unique return numbers (rn_min,...,rn_max)"""
         if self.rn is not None:
@@ -442,8 +1408,12 @@ class Pointcloud(object):
         """
         #modify in place
         self.clear_derived_attrs()
+        if self.source is not None:
+            self.source_index = self._source_index(I)
+        if self.origin is not None:
+            self.origin_index = _compose_index(self.origin_index, I)
         for a in self.pc_attrs:
-            attr = self.__dict__[a]
+            attr = self.__dict__.get(a)  # attributes not loaded from a source yet are left alone
             if attr is not None:
                 self.__dict__[a] = np.require(attr[I], requirements=['A', 'O', 'C'])
 
@@ -455,13 +1425,24 @@ class Pointcloud(object):
         Returns:
             The 'sliced' Pointcloud object.
         """
-        if self.xy.size == 0:  # just return something empty to protect chained calls...
+        if self.get_size() == 0:  # just return something empty to protect chained calls...
             return empty_like(self)
-        pc = Pointcloud(self.xy[mask], self.z[mask])
-        for a in ["c", "pid", "rn"]:
-            attr = self.__dict__[a]
-            if attr is not None:
-                pc.__dict__[a] = attr[mask]
+        if self.source is not None and not all(a in self.__dict__ for a in self.pc_attrs):
+            # Only slice what is loaded - the rest is read later (if ever) via the composed index.
+            pc = Pointcloud(None, None, source=self.source, source_index=self._source_index(mask))
+            for a in self.pc_attrs:
+                if a in self.__dict__:
+                    attr = self.__dict__[a]
+                    pc.__dict__[a] = attr[mask] if attr is not None else None
+        else:
+            pc = Pointcloud(self.xy[mask], self.z[mask])
+            for a in ["c", "pid", "rn"]:
+                attr = self.__dict__[a]
+                if attr is not None:
+                    pc.__dict__[a] = attr[mask]
+        if self.origin is not None:
+            pc.origin = self.origin
+            pc.origin_index = _compose_index(self.origin_index, mask)
         return pc
 
     def cut_to_polygon(self, rings):
@@ -587,20 +1568,19 @@ class Pointcloud(object):
         Raises:
             ValueError: If point source id attribute is not set.
         """
-        if self.pid is None:
-            raise ValueError("Point source id attribute not set")
-        I = (self.pid == id)
-        return self.cut(I)
+        return self.get_strip_partition().cut(id)
 
-    def triangulate(self):
+    def triangulate(self, cs=-1):
         """
         Triangulate the pointcloud. Will do nothing if triangulation is already calculated.
+        Args:
+            cs: Cell size of the triangle index. Use -1 to guess a proper cell size from the point density.
         Raises:
             ValueError: If not at least 3 points in pointcloud
         """
         if self.triangulation is None:
             if self.xy.shape[0] > 2:
-                self.triangulation = triangle.Triangulation(self.xy)
+                self.triangulation = triangle.Triangulation(self.xy, cs)
             else:
                 raise ValueError("Less than 3 points - unable to triangulate.")
 
@@ -639,7 +1619,8 @@ class Pointcloud(object):
         return self.triangle_validity_mask
 
     def get_grid(self, ncols=None, nrows=None, x1=None, x2=None, y1=None, y2=None,
-                 cx=None, cy=None, nd_val=-999, crop=0, method="triangulation"):
+                 cx=None, cy=None, nd_val=-999, crop=0, method="triangulation", engine="index",
+                 blocks=1, block_buffer=GRID_BLOCK_BUFFER, threads=None):
         """
         Grid (an attribute of) the pointcloud.
         Will calculate grid size and georeference from supplied input (or pointcloud extent).
@@ -655,6 +1636,11 @@ class Pointcloud(object):
             nd_val: grid no data value.
             crop: if calculating grid extent from pointcloud extent, crop the extent by this amount (should not be needed).
             method: One of the supported method/attribute names - triangulation,return_triangles,density,class,pid.
+            engine: Gridding engine for triangulation and return_triangles - 'index' or 'scanline'.
+            blocks: For triangulation and return_triangles - if larger than 1, split the grid into blocks x blocks
+                    blocks, which are triangulated (with a buffer) and gridded in parallel. An existing triangulation is not used.
+            block_buffer: Initial buffer around each block - grown as needed to match a global triangulation.
+            threads: Number of threads used for blocks (default FILTER_THREADS).
         Returns:
             A grid.Grid object and a grid.Grid object with triangle sizes if 'return_triangles' is specified.
         Raises:
@@ -692,17 +1678,23 @@ class Pointcloud(object):
             cy = (y2 - y1) / float(nrows)
         # geo ref gdal style...
         geo_ref = [x1, cx, 0, y2, 0, -cy]
+        if method in ("triangulation", "return_triangles") and blocks > 1:
+            g, t = self._get_block_triangulation_grid(ncols, nrows, x1, cx, y2, cy, nd_val,
+                                                      method == "return_triangles", blocks, block_buffer, threads)
+            if t is not None:
+                return grid.Grid(g, geo_ref, nd_val), grid.Grid(t, geo_ref, nd_val)
+            return grid.Grid(g, geo_ref, nd_val)
         if method == "triangulation":  # should be special method not to mess up earlier code...
             if self.triangulation is None:
                 raise ValueError("Create a triangulation first...")
             g = self.triangulation.make_grid(
-                self.z, ncols, nrows, x1, cx, y2, cy, nd_val, return_triangles=False)
+                self.z, ncols, nrows, x1, cx, y2, cy, nd_val, return_triangles=False, engine=engine)
             return grid.Grid(g, geo_ref, nd_val)
         elif method == "return_triangles":
             if self.triangulation is None:
                 raise ValueError("Create a triangulation first...")
             g, t = self.triangulation.make_grid(
-                self.z, ncols, nrows, x1, cx, y2, cy, nd_val, return_triangles=True)
+                self.z, ncols, nrows, x1, cx, y2, cy, nd_val, return_triangles=True, engine=engine)
             return grid.Grid(g, geo_ref, nd_val), grid.Grid(t, geo_ref, nd_val)
         elif method == "density":  # density grid
             arr_coords = ((self.xy - (geo_ref[0], geo_ref[3])) /
@@ -713,9 +1705,7 @@ class Pointcloud(object):
             # Wow - this gridding is sooo simple! and fast!
             # create flattened index
             B = arr_coords[:, 1] * ncols + arr_coords[:, 0]
-            bins = np.arange(0, ncols * nrows + 1)
-            h, b = np.histogram(B, bins)
-            h = h.reshape((nrows, ncols))
+            h = np.bincount(B, minlength=ncols * nrows).reshape((nrows, ncols))
             return grid.Grid(h, geo_ref, nd_val)  # zero always nodata value here...
         elif method == "class":
             # define method which takes the most frequent value in a cell... could be only mean...
@@ -728,12 +1718,125 @@ class Pointcloud(object):
         else:
             raise ValueError("Unsupported method.")
 
-    def find_triangles(self, xy_in, mask=None):
+    def _core_triangles_stable(self, core, box, bounds):
+        """
+        Check that the triangles of this pointcloud (triangulated from the points within box) which touch the core box
+        are triangles of the Delaunay triangulation of all points. This holds when their circumcircles are within
+        box - or outside it only where there are no points at all (beyond bounds).
+        Args:
+            core: (xmin, ymin, xmax, ymax) of the area of interest.
+            box: (xmin, ymin, xmax, ymax) of the area this pointcloud was cut from.
+            bounds: (xmin, ymin, xmax, ymax) of all points.
+        Returns:
+            True if the triangles touching core are stable.
+        """
+        P = self.xy[self.triangulation.get_triangles()]
+        pmin = P.min(axis=1)
+        pmax = P.max(axis=1)
+        M = (pmax[:, 0] >= core[0]) & (pmin[:, 0] <= core[2]) & (pmax[:, 1] >= core[1]) & (pmin[:, 1] <= core[3])
+        P = P[M]
+        if P.shape[0] == 0:
+            return True
+        # circumcentre relative to the first vertex
+        b = P[:, 1] - P[:, 0]
+        c = P[:, 2] - P[:, 0]
+        d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ux = (c[:, 1] * (b ** 2).sum(axis=1) - b[:, 1] * (c ** 2).sum(axis=1)) / d
+            uy = (b[:, 0] * (c ** 2).sum(axis=1) - c[:, 0] * (b ** 2).sum(axis=1)) / d
+            r = np.sqrt(ux ** 2 + uy ** 2)
+        cx = ux + P[:, 0, 0]
+        cy = uy + P[:, 0, 1]
+        limits = [box[i] if (box[i] > bounds[i] if i < 2 else box[i] < bounds[i]) else (-np.inf if i < 2 else np.inf)
+                  for i in range(4)]
+        with np.errstate(invalid="ignore"):
+            ok = (cx - r >= limits[0]) & (cy - r >= limits[1]) & (cx + r <= limits[2]) & (cy + r <= limits[3])
+        return bool(ok.all())
+
+    def _get_block_triangulation_grid(self, ncols, nrows, x1, cx, y2, cy, nd_val, return_triangles, blocks,
+                                      block_buffer, threads):
+        """
+        Internal utility - triangulate and grid the pointcloud in blocks x blocks blocks using a pool of threads.
+        Each block is triangulated with the points within a buffer of the block and gridded (by scanline) in its core area only.
+        The buffer starts at block_buffer and is doubled until the triangles touching the core area match those of a
+        global triangulation, and the cells left uncovered by the triangulation of the block are outside the convex hull
+        of all points - so the result matches that of a global triangulation.
+        Returns:
+            Numpy 2d float32 grid and triangle size grid (None unless return_triangles is True).
+        """
+        g = np.empty((nrows, ncols), dtype=np.float32)
+        g.fill(nd_val)
+        if return_triangles:
+            t = np.empty((nrows, ncols), dtype=np.float32)
+            t.fill(nd_val)
+        else:
+            t = None
+        rows = np.linspace(0, nrows, blocks + 1).astype(np.int64)
+        cols = np.linspace(0, ncols, blocks + 1).astype(np.int64)
+        bounds = self.get_bounds()
+        hull = array_geometry.convex_hull(self.xy)
+
+        def in_hull(M, xl, yu):
+            # True if the centre of any cell in the mask M of a block with upper left corner (xl, yu) is inside the hull
+            if not M.any():
+                return False
+            r, c = np.nonzero(M)
+            xy = np.column_stack((xl + (c + 0.5) * cx, yu - (r + 0.5) * cy))
+            return bool(array_geometry.points_in_convex_polygon(xy, hull).any())
+
+        def grid_block(ij):
+            r1, r2 = rows[ij[0]], rows[ij[0] + 1]
+            c1, c2 = cols[ij[1]], cols[ij[1] + 1]
+            if r2 <= r1 or c2 <= c1:
+                return
+            xl = x1 + c1 * cx
+            yu = y2 - r1 * cy
+            core = (xl, y2 - r2 * cy, x1 + c2 * cx, yu)
+            buf = block_buffer
+            while True:
+                box = (core[0] - buf, core[1] - buf, core[2] + buf, core[3] + buf)
+                # all points are used - this is the global triangulation
+                whole = box[0] <= bounds[0] and box[1] <= bounds[1] and box[2] >= bounds[2] and box[3] >= bounds[3]
+                pc = self.cut_to_box(*box)
+                if pc.get_size() >= 3:
+                    pc.triangulate()
+                    if whole or pc._core_triangles_stable(core, box, bounds):
+                        out = pc.triangulation.make_grid(pc.z, c2 - c1, r2 - r1, xl, cx, yu, cy, nd_val,
+                                                         return_triangles=return_triangles, engine="scanline")
+                        gz = out[0] if return_triangles else out
+                        if whole or not in_hull(gz == nd_val, xl, yu):
+                            break
+                elif whole or not in_hull(np.ones((r2 - r1, c2 - c1), dtype=bool), xl, yu):
+                    return
+                buf *= 2
+            if return_triangles:
+                g[r1:r2, c1:c2] = out[0]
+                t[r1:r2, c1:c2] = out[1]
+            else:
+                g[r1:r2, c1:c2] = out
+
+        if threads is None:
+            threads = FILTER_THREADS
+        jobs = [(i, j) for i in range(blocks) for j in range(blocks)]
+        if threads <= 1:
+            for ij in jobs:
+                grid_block(ij)
+        else:
+            pool = ThreadPool(threads)
+            try:
+                pool.map(grid_block, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        return g, t
+
+    def find_triangles(self, xy_in, mask=None, walk=False):
         """
         Find the (valid) containing triangles for an array of points.
         Args:
             xy_in: Numpy array of points ( shape (n,2), dtype float64)
             mask: optional triangle validity mask.
+            walk: optional, locate by walking the triangulation from the previous hit (can be faster for densely sampled, ordered input).
         Returns:
             Numpy array of triangle indices where -1 signals no (valid) triangle.
         """
@@ -741,7 +1844,7 @@ class Pointcloud(object):
             raise Exception("Create a triangulation first...")
         xy_in = point_factory(xy_in)
         #-2 indices signals outside triangulation, -1 signals invalid, else valid
-        return self.triangulation.find_triangles(xy_in, mask)
+        return self.triangulation.find_triangles(xy_in, mask, walk)
 
     def find_appropriate_triangles(self, xy_in, mask=None):
         """
@@ -778,13 +1881,14 @@ class Pointcloud(object):
         M_out = array_geometry.get_boundary_vertices(M_t, M_p, self.triangulation.vertices)
         return M_out
 
-    def interpolate(self, xy_in, nd_val=-999, mask=None):
+    def interpolate(self, xy_in, nd_val=-999, mask=None, walk=False):
         """
         TIN interpolate values in input points.
         Args:
             xy_in: The input points (anything that is convertable to a numpy (n,2) float64 array).
             nd_val: No data value for points not in any (valid) triangle.
             mask: Optional triangle validity mask.
+            walk: Optional, locate triangles by walking from the previous hit. Can be faster for densely sampled, ordered input.
         Returns:
             1d numpy array of interpolated values.
         Raises:
@@ -793,16 +1897,17 @@ class Pointcloud(object):
         if self.triangulation is None:
             raise ValueError("Create a triangulation first...")
         xy_in = point_factory(xy_in)
-        return self.triangulation.interpolate(self.z, xy_in, nd_val, mask)
+        return self.triangulation.interpolate(self.z, xy_in, nd_val, mask, walk)
     # Interpolates points in valid triangles
 
-    def controlled_interpolation(self, xy_in, mask=None, nd_val=-999):
+    def controlled_interpolation(self, xy_in, mask=None, nd_val=-999, walk=False):
         """
         TIN interpolate values in input points using only valid triangles.
         Args:
             xy_in: The input points (anything that is convertable to a numpy (n,2) float64 array).
             nd_val: No data value for points not in any (valid) triangle.
             mask: Optional triangle validity mask. Will use internal triangle_validity_mask if  mask not supplied in call.
+            walk: Optional, locate triangles by walking (see interpolate).
         Returns:
             1d numpy array of interpolated values.
         Raises:
@@ -812,7 +1917,7 @@ class Pointcloud(object):
             mask = self.triangle_validity_mask
         if mask is None:
             raise ValueError("This method needs a triangle validity mask.")
-        return self.interpolate(xy_in, nd_val, mask)
+        return self.interpolate(xy_in, nd_val, mask, walk)
 
     def get_triangle_geometry(self):
         """
@@ -840,6 +1945,7 @@ class Pointcloud(object):
         """
         # Wasting a bit of memory here to keep it simple!
         self.clear_derived_attrs()
+        self.origin = None
         xyz = np.column_stack((self.xy, self.z))
         if R is not None:
             xyz = np.dot(R, xyz.T).T
@@ -856,9 +1962,11 @@ class Pointcloud(object):
             T: Translation vector (dx,dy)
         """
         self.clear_derived_attrs()
+        self.origin = None
         if R is not None:
             self.xy = (np.dot(R, self.xy.T).T).copy()
         if T is not None:
+            self._modifiable("xy")
             self.xy += T
 
     def toE(self, geoid):
@@ -870,6 +1978,7 @@ class Pointcloud(object):
         # warp to ellipsoidal heights
         toE = geoid.interpolate(self.xy)
         assert((toE != geoid.nd_val).all())
+        self._modifiable("z")
         self.z += toE
 
     def toH(self, geoid):
@@ -881,6 +1990,7 @@ class Pointcloud(object):
         # warp to orthometric heights. z bounds not stored, so no need to recalculate.
         toE = geoid.interpolate(self.xy)
         assert((toE != geoid.nd_val).all())
+        self._modifiable("z")
         self.z -= toE
 
     def set_class(self, c):
@@ -947,6 +2057,8 @@ class Pointcloud(object):
         Primitive spatial sorting by creating a 'virtual' 2D grid covering the pointcloud and thus a 1D index by consecutive c style numbering of cells.
         Keep track of 'slices' of the pointcloud within each 'virtual' cell.
         As the pointcloud is reordered all derived attributes will be cleared.
+        If the index cache is enabled (see set_index_cache) and the pointcloud was read from a las file,
+        the sort order and spatial index are loaded from / saved to the cache.
         Returns:
             A reference to self.
         """
@@ -956,6 +2068,9 @@ class Pointcloud(object):
         if (bool(shape) != bool(xy_ul)):  # either both None or both given
             raise ValueError("Neither or both of shape and xy_ul should be specified.")
         self.clear_derived_attrs()
+        cache_name = self._index_cache_name(cs, shape, xy_ul)
+        if cache_name is not None and self._load_spatial_index(cache_name):
+            return self
         if shape is None:
             x1, y1, x2, y2 = self.get_bounds()
             ncols = int((x2 - x1) / cs) + 1
@@ -975,12 +2090,94 @@ class Pointcloud(object):
         res = array_geometry.lib.fill_spatial_index(B, self.spatial_index, B.shape[0], ncols * nrows)
         if res != 0:
             raise Exception("Size of spatial index array too small! Programming error!")
+        del B
+        self._reorder(I)
+        self.index_header = np.asarray((ncols, nrows, x1, y2, cs), dtype=np.float64)
+        if cache_name is not None and _INDEX_CACHE_WRITABLE:
+            self._save_spatial_index(cache_name, I)
+        return self
+
+    def _reorder(self, I):
+        """Reorder the pointcloud in place by a permutation."""
+        if self.source is not None:
+            self.source_index = self._source_index(I)
+        if self.origin is not None:
+            self.origin_index = _compose_index(self.origin_index, I)
         for a in self.pc_attrs:
-            attr = self.__dict__[a]
+            attr = self.__dict__.get(a)  # attributes not loaded from a source yet are left alone
             if attr is not None:
                 self.__dict__[a] = attr[I]
-        self.index_header = np.asarray((ncols, nrows, x1, y2, cs), dtype=np.float64)
-        return self
+
+    def _index_cache_name(self, cs, shape, xy_ul):
+        """
+        Return the base name of the cache files for a spatial sort of this pointcloud, or None if not cached.
+        The name is a digest of the origin file identity, the selected points and the sort parameters.
+        The selected points are identified cheaply by their number and a sample of their indices.
+        """
+        if _INDEX_CACHE is None or self.origin is None:
+            return None
+        path, mtime, size = self.origin
+        key = hashlib.sha1()
+        key.update(repr((INDEX_CACHE_VERSION, path, mtime, size, float(cs), shape, xy_ul)).encode("utf-8"))
+        if self.origin_index is not None:
+            index = self.origin_index
+            n = index.shape[0]
+            sample = index[::max(n // INDEX_CACHE_KEY_SAMPLES, 1)]
+            key.update(repr(n).encode("utf-8"))
+            for arr in (index[:16], sample, index[-16:]):
+                key.update(np.ascontiguousarray(arr, dtype=np.int64).tobytes())
+        else:
+            key.update(b"all")
+        if _INDEX_CACHE == INDEX_CACHE_SIDECAR:
+            folder = os.path.dirname(path)
+        else:
+            folder = _INDEX_CACHE
+        return os.path.join(folder, "%s.%s.sidx" % (os.path.basename(path), key.hexdigest()[:24]))
+
+    def _load_spatial_index(self, name):
+        """Load a cached sort order and spatial index and reorder accordingly. Returns True on success."""
+        try:
+            with open(name + ".json") as f:
+                meta = json.load(f)
+            path, mtime, size = self.origin
+            if (meta["version"] != INDEX_CACHE_VERSION or meta["mtime"] != mtime or meta["size"] != size or
+                    meta["npoints"] != self.get_size()):
+                return False
+            # the order is only read once when reordering - no need to hold it in memory.
+            order = np.load(name + ".order.npy", mmap_mode="r")
+            spatial_index = np.load(name + ".index.npy")
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        if order.shape[0] != self.get_size():
+            return False
+        self._reorder(np.asarray(order))
+        self.spatial_index = np.require(spatial_index, dtype=np.int32, requirements=['A', 'O', 'C', 'W'])
+        self.index_header = np.asarray(meta["index_header"], dtype=np.float64)
+        return True
+
+    def _save_spatial_index(self, name, I):
+        """
+        Save a sort order and the spatial index to the cache. The meta file is written last, marking completion.
+        If writing fails, writing to the cache is disabled (until set_index_cache is called again).
+        """
+        global _INDEX_CACHE_WRITABLE
+        path, mtime, size = self.origin
+        meta = {"version": INDEX_CACHE_VERSION, "las": path, "mtime": mtime, "size": size,
+                "npoints": self.get_size(), "index_header": self.index_header.tolist()}
+        dtype = np.int32 if I.shape[0] < 2**31 else np.int64
+        try:
+            # write to temporary files and rename, so concurrent readers never see partial files.
+            tmp = "%s.%d.tmp" % (name, os.getpid())
+            for ext, arr in ((".order.npy", I.astype(dtype)), (".index.npy", self.spatial_index)):
+                with open(tmp, "wb") as f:
+                    np.save(f, arr)
+                os.replace(tmp, name + ext)
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, name + ".json")
+        except (IOError, OSError) as e:
+            print("Unable to write spatial index cache - disabling writes: %s" % str(e))
+            _INDEX_CACHE_WRITABLE = False
 
     def clear_derived_attrs(self):
         """
@@ -992,6 +2189,7 @@ class Pointcloud(object):
         self.spatial_index = None
         self.bbox = None
         self.triangle_validity_mask = None
+        self.strip_partition = None
     # Filterering methods below...
 
     def validate_filter_args(self, rad):
@@ -1001,198 +2199,207 @@ class Pointcloud(object):
         if rad > self.index_header[4]:
             raise Warning("Filter radius larger than cell size of spatial index will not catch all points!")
 
-    def min_filter(self, filter_rad, xy=None, nd_val=-9999):
+    def _run_filter(self, func, xy, pc_z, params, threads, z=None, width=None):
+        """
+        Internal utility - run a C filter function of array_geometry along xy, optionally split over several threads.
+        The C call releases the GIL, so the chunks of input points are processed in parallel.
+        Args:
+            func: the array_geometry.lib filter function.
+            xy: Input points to filter along.
+            pc_z: The z values of the pointcloud to use.
+            params: Tuple of filter parameters (between output array and spatial index in the C signature).
+            threads: Number of threads to use. None means FILTER_THREADS.
+            z: z values of the input points (only for the spike filter).
+            width: Number of output values pr. input point, if the filter outputs more than one value.
+        Returns:
+            1D array of filtered values (2D of shape (n, width) if width is given).
+        """
+        n = xy.shape[0]
+        out_shape = (n,) if width is None else (n, width)
+        z_out = np.zeros(out_shape, dtype=np.float64)
+        # read once for all chunks - xy of a compacted pointcloud is decoded on each access
+        base = (self.xy, pc_z)
+        index = (self.spatial_index, self.index_header)
+
+        def run(xy_, z_, out):
+            head = (xy_,) if z_ is None else (xy_, z_)
+            func(*(head + base + (out,) + params + index + (xy_.shape[0],)))
+
+        if threads is None:
+            threads = FILTER_THREADS
+        if threads <= 1 or n < 2 * FILTER_MIN_CHUNK:
+            run(xy, z, z_out)
+            return z_out
+        # more chunks than threads, as the density (and thus cost) might vary a lot
+        n_chunks = min(threads * 4, n // FILTER_MIN_CHUNK)
+        bounds = np.linspace(0, n, n_chunks + 1).astype(np.int64)
+
+        def run_chunk(i):
+            i1, i2 = bounds[i], bounds[i + 1]
+            out = np.zeros((i2 - i1,) + out_shape[1:], dtype=np.float64)
+            run(point_factory(xy[i1:i2]), z_factory(z[i1:i2]) if z is not None else None, out)
+            z_out[i1:i2] = out
+
+        pool = ThreadPool(threads)
+        try:
+            pool.map(run_chunk, range(n_chunks))
+        finally:
+            pool.close()
+            pool.join()
+        return z_out
+
+    def min_filter(self, filter_rad, xy=None, nd_val=-9999, threads=None):
         """
         Calculate minumum filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_min_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_min_filter, xy, self.z, (filter_rad, nd_val), threads)
 
-    def mean_filter(self, filter_rad, xy=None, nd_val=-9999):
+    def mean_filter(self, filter_rad, xy=None, nd_val=-9999, threads=None):
         """
         Calculate mean filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_mean_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_mean_filter, xy, self.z, (filter_rad, nd_val), threads)
 
-    def max_filter(self, filter_rad, xy=None, nd_val=-9999):
+    def max_filter(self, filter_rad, xy=None, nd_val=-9999, threads=None):
         """
         Calculate maximum filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_min_filter(
-            xy, self.xy, -self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header, xy.shape[0])
+        z_out = self._run_filter(array_geometry.lib.pc_min_filter, xy, -self.z, (filter_rad, nd_val), threads)
         return -z_out
 
-    def median_filter(self, filter_rad, xy=None, nd_val=-9999):
+    def median_filter(self, filter_rad, xy=None, nd_val=-9999, threads=None):
         """
         Calculate median filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_median_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_median_filter, xy, self.z, (filter_rad, nd_val), threads)
 
-    def var_filter(self, filter_rad, xy=None, nd_val=-9999):
+    def var_filter(self, filter_rad, xy=None, nd_val=-9999, threads=None):
         """
         Calculate variance filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_var_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_var_filter, xy, self.z, (filter_rad, nd_val), threads)
 
-    def distance_filter(self, filter_rad, xy=None, nd_val=9999):
+    def distance_filter(self, filter_rad, xy=None, nd_val=9999, threads=None):
         """
         Calculate point distance filter along self.xy or a supplied set of input points (which should really be supplied for this to make sense). Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Supply this or get a lot of zeros!
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_distance_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_distance_filter, xy, self.z, (filter_rad, nd_val), threads)
 
-    def density_filter(self, filter_rad, xy=None):
+    def density_filter(self, filter_rad, xy=None, threads=None):
         """
         Calculate point density filter along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_density_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_density_filter, xy, self.z, (filter_rad,), threads)
 
-    def idw_filter(self, filter_rad, xy=None, nd_val=-9999):
+    def idw_filter(self, filter_rad, xy=None, nd_val=-9999, threads=None):
         """
         Calculate inverse distance weighted z values along self.xy or a supplied set of input points. Useful for gridding.
         Args:
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of filtered values.
         """
         self.validate_filter_args(filter_rad)
         if xy is None:
             xy = self.xy
-        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_idw_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
-        return z_out
+        return self._run_filter(array_geometry.lib.pc_idw_filter, xy, self.z, (filter_rad, nd_val), threads)
 
-    def spike_filter(self, filter_rad, tanv2, zlim=0.2):
+    def multi_filter(self, filter_rad, stats=("min", "max", "mean", "var", "count", "dist"), xy=None, nd_val=-9999,
+                     threads=None):
+        """
+        Calculate several filters of z in one go - each neighbourhood is only visited once.
+        The statistics are the same as those of the corresponding single filters, with count being the number of points
+        within filter_rad, and dist the distance to the nearest point (like distance_filter).
+        Args:
+            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            stats: Sequence of statistics to calculate: min, max, mean, var, count and/or dist.
+            xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            nd_val: No data value for empty neighbourhoods.
+            threads: Optional number of threads to use (default FILTER_THREADS).
+        Returns:
+            Numpy structured array with a float64 field for each requested statistic.
+        Raises:
+            ValueError if an unknown statistic is requested.
+        """
+        self.validate_filter_args(filter_rad)
+        if xy is None:
+            xy = self.xy
+        if isinstance(stats, str):
+            stats = (stats,)
+        for stat in stats:
+            if stat not in array_geometry.MULTI_FILTER_STATS:
+                raise ValueError("Unknown statistic: %s" % stat)
+        codes = int_array_factory([array_geometry.MULTI_FILTER_STATS[stat] for stat in stats])
+        out = self._run_filter(array_geometry.lib.pc_multi_filter, xy, self.z,
+                               (filter_rad, nd_val, codes, len(stats)), threads, width=len(stats))
+        return out.view(np.dtype([(stat, np.float64) for stat in stats])).reshape(-1)
+
+    def spike_filter(self, filter_rad, tanv2, zlim=0.2, threads=None):
         """
         Calculate spike indicators (0 or 1) for each point . In order to be a spike there must be at least one other point within filter rad in each quadrant which satisfies:
         -- slope_angle large and dz large.
@@ -1201,27 +2408,15 @@ class Pointcloud(object):
             filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
             tanv2: Tangent squared of slope angle (dy/dx)**2 parameter for spike check (lower limit).
             zlim: dz paramter for spike check (lower limit)
+            threads: Optional number of threads to use (default FILTER_THREADS).
         Returns:
             1D array of spike indications (0 or 1).
         """
         self.validate_filter_args(filter_rad)
         if (tanv2 < 0 or zlim < 0):
             raise ValueError("Spike parameters must be positive!")
-        z_out = np.empty_like(self.z)
-        array_geometry.lib.pc_spike_filter(
-            self.xy,
-            self.z,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            tanv2,
-            zlim,
-            self.spatial_index,
-            self.index_header,
-            self.xy.shape[0])
-        return z_out
-
+        return self._run_filter(array_geometry.lib.pc_spike_filter, self.xy, self.z, (filter_rad, tanv2, zlim),
+                                threads, z=self.z)
 
 def unit_test(path):
     print("Reading all")
@@ -1240,6 +2435,93 @@ def unit_test(path):
     pc2 = fromLAS(path, xy_box=crop)
     assert(pc1.get_size() == pc2.get_size())
     assert((pc1.get_classes() == pc2.get_classes()).all())
+    print("Reading filtered in small chunks")
+    pc3 = fromLAS(path, xy_box=crop, chunk_size=1001)
+    assert((pc3.xy == pc2.xy).all())
+    assert((pc3.z == pc2.z).all())
+    assert((pc3.c == pc2.c).all())
+    print("Reading filtered via memory map")
+    pc4 = fromLAS(path, xy_box=crop, mmap=True)
+    assert(pc4.get_size() == pc2.get_size())
+    pc4 = pc4.cut_to_class(pc2.c[0])
+    assert((pc4.z == pc2.cut_to_class(pc2.c[0]).z).all())
+    print("Partitioning")
+    classes = pc2.partition_by("c")
+    assert((classes.keys == pc2.get_classes()).all())
+    assert(classes.counts.sum() == pc2.get_size())
+    for c in classes.keys:
+        assert((classes.cut(c).z == pc2.cut_to_class(c).z).all())
+    strips = pc2.get_pids()
+    assert((strips == np.unique(pc2.pid)).all())
+    for pid in strips:
+        assert((pc2.cut_to_strip(pid).z == pc2.cut(pc2.pid == pid).z).all())
+    # the partition must keep a temporary pointcloud alive
+    c = pc2.c[0]
+    assert((fromLAS(path, xy_box=crop).partition_by("c").cut(c).z == pc2.cut_to_class(c).z).all())
+    assert((fromLAS(path, xy_box=crop).get_strip_partition().cut(strips[0]).z ==
+            pc2.cut_to_strip(strips[0]).z).all())
+    print("Caching spatial index")
+    import tempfile
+    import shutil
+    cache_dir = tempfile.mkdtemp()
+    set_index_cache(cache_dir)
+    try:
+        pc7 = fromLAS(path, xy_box=crop).sort_spatially(1)
+        pc8 = fromLAS(path, xy_box=crop).sort_spatially(1)
+        assert((pc7.xy == pc8.xy).all())
+        assert((pc7.spatial_index == pc8.spatial_index).all())
+        assert((pc8.min_filter(1) == pc7.min_filter(1)).all())
+        # moving the points invalidates the cached order
+        pc9 = fromLAS(path, xy_box=crop)
+        pc9.xy = pc9.xy[::-1].copy()
+        assert(pc9.origin is None and pc9._index_cache_name(1, None, None) is None)
+    finally:
+        set_index_cache(None)
+        shutil.rmtree(cache_dir)
+    print("Serving a preloaded file")
+    pc9 = set_preloaded(path)
+    try:
+        pc10 = fromLAS(path, xy_box=crop, cls=[pc2.c[0]])
+        pc10.xy += 1
+        assert(fromLAS(path).get_size() == pc9.get_size())
+    finally:
+        set_preloaded(None)
+    pc11 = fromLAS(path, xy_box=crop, cls=[pc2.c[0]])
+    assert((pc10.z == pc11.z).all())
+    assert((pc10.xy == pc11.xy + 1).all())
+    assert(pc10.rn is None)
+    print("Caching tiles")
+    cache_dir = tempfile.mkdtemp()
+    set_tile_cache(cache_dir)
+    try:
+        pc12 = fromLAS(path, xy_box=crop, cls=[pc2.c[0]])
+        pc13 = fromLAS(path, xy_box=crop, cls=[pc2.c[0]], include_return_number=True)
+        assert(len(os.listdir(cache_dir)) == 1)
+        assert((pc12.xy == pc11.xy).all() and (pc13.z == pc11.z).all())
+        assert(pc12.rn is None and pc13.rn is not None)
+        assert(evict_tile_cache(cache_dir, 0) == 0)
+    finally:
+        set_tile_cache(None)
+        shutil.rmtree(cache_dir)
+    print("Compacting")
+    pc6 = fromLAS(path, xy_box=crop)
+    pc6.compact()
+    pc6.extend(pc2)
+    assert(pc6.get_size() == 2 * pc2.get_size())
+    assert(np.fabs(pc6.cut(np.arange(pc2.get_size())).z - pc2.z).max() < 1e-6)
+    # attributes of a compacted pointcloud are decoded on access, but not kept
+    assert((pc6.c[:pc2.get_size()] == pc2.c).all())
+    assert(not any(a in pc6.__dict__ for a in ("xy", "z", "c")))
+    assert(not pc6.z.flags.writeable)
+    # ... but the strip partition is still cached
+    assert(pc6.get_strip_partition().order is pc6.get_strip_partition().order)
+    pc6.affine_transformation_2d(T=(1, 1))
+    assert(np.fabs(pc6.xy[:pc2.get_size()] - pc2.xy - 1).max() < 1e-6)
+    print("Reading lazily")
+    pc5 = fromLAS(path, xy_box=crop, lazy=True).cut_to_class(pc2.c[0])
+    pc5.sort_spatially(1)
+    assert("pid" not in pc5.__dict__)
+    assert((np.sort(pc5.pid) == np.sort(pc4.pid)).all())
     pc1.sort_spatially(1)
     assert((pc1.get_classes() == pc2.get_classes()).all())
     pc2.sort_spatially(1)
@@ -1247,4 +2529,46 @@ def unit_test(path):
     z2 = pc2.min_filter(1)
     assert((z1 == z2).all())
     assert((z1 <= pc1.z).all())
+    print("Filtering with threads")
+    xy = mesh_as_points((200, 200), [crop[0], (crop[2] - crop[0]) / 200.0, 0, crop[3], 0, -(crop[3] - crop[1]) / 200.0])
+    assert((pc1.min_filter(1, xy=xy, threads=4) == pc1.min_filter(1, xy=xy)).all())
+    assert((pc1.idw_filter(1, xy=xy, threads=3) == pc1.idw_filter(1, xy=xy)).all())
+    assert((pc1.spike_filter(1, 1, threads=2) == pc1.spike_filter(1, 1)).all())
+    print("Multi filter")
+    stats = pc1.multi_filter(1, xy=xy, threads=2)
+    assert((stats["min"] == pc1.min_filter(1, xy=xy)).all())
+    M = stats["count"] > 0
+    assert((stats["max"][M] == pc1.max_filter(1, xy=xy)[M]).all())
+    assert((stats["mean"] == pc1.mean_filter(1, xy=xy)).all())
+    assert((stats["var"] == pc1.var_filter(1, xy=xy)).all())
+    assert((stats["dist"] == pc1.distance_filter(1, xy=xy, nd_val=-9999)).all())
+    assert(np.allclose(stats["count"] / (np.pi), pc1.density_filter(1, xy=xy)))
+    print("Gridding statistics")
+    geo_ref = [crop[0], 2.0, 0, crop[3], 0, -2.0]
+    ncols, nrows = int((crop[2] - crop[0]) / 2.0), int((crop[3] - crop[1]) / 2.0)
+    for method in ("mean", "max", "var", "median"):
+        g1 = grid.make_grid(pc1.xy, pc1.z, ncols, nrows, geo_ref, method=method)
+        g2 = grid.make_grid(pc1.xy, pc1.z, ncols, nrows, geo_ref, method=lambda z: getattr(np, method)(z))
+        assert(np.allclose(g1.grid, g2.grid))
+    g = pc1.get_grid(ncols, nrows, crop[0], crop[0] + ncols * 2.0, crop[3] - nrows * 2.0, crop[3], method="density")
+    assert((g.grid == grid.make_grid(pc1.xy, pc1.z, ncols, nrows, geo_ref, method="count", nd_val=0).grid).all())
+    print("Gridding in blocks")
+    # sparse points around a 400 m 'lake' - much wider than the block buffer
+    rng = np.random.RandomState(3)
+    xy = rng.rand(4000, 2) * 1000
+    xy = xy[~(np.fabs(xy - 500) < 200).all(axis=1)]
+    pc14 = Pointcloud(xy, rng.rand(xy.shape[0]))
+    pc14.triangulate()
+    g1, t1 = pc14.get_grid(200, 200, 0, 1000, 0, 1000, method="return_triangles", engine="scanline")
+    g2, t2 = pc14.get_grid(200, 200, 0, 1000, 0, 1000, method="return_triangles", blocks=4, threads=2)
+    assert((t1.grid == t2.grid).all())
+    assert((g1.grid == g2.grid).all())
+    # a bay at the edge of the data - blocks there cover less than the global triangulation at first
+    I = (np.fabs(xy[:, 0] - 500) < 300) & (xy[:, 1] > 850)
+    pc14 = Pointcloud(xy[~I], pc14.z[~I])
+    pc14.triangulate()
+    g1, t1 = pc14.get_grid(240, 240, -100, 1100, -100, 1100, method="return_triangles", engine="scanline")
+    g2, t2 = pc14.get_grid(240, 240, -100, 1100, -100, 1100, method="return_triangles", blocks=5, threads=2)
+    assert((t1.grid == t2.grid).all())
+    assert((g1.grid == g2.grid).all())
     return 0
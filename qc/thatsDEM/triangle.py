@@ -65,6 +65,14 @@ lib.inspect_index.restype = None
 lib.inspect_index.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
 lib.build_index.restype = ctypes.c_void_p
 lib.build_index.argtypes = [LP_CDOUBLE, LP_CINT, ctypes.c_double, ctypes.c_int, ctypes.c_int]
+# The index is stored csr style - header is: extent (4), cell size, ncols, nrows, npoints, ntri, nhits
+INDEX_HEADER_SIZE = 10
+lib.get_index_header.restype = None
+lib.get_index_header.argtypes = [ctypes.c_void_p, LP_CDOUBLE]
+lib.copy_index_arrays.restype = None
+lib.copy_index_arrays.argtypes = [ctypes.c_void_p, LP_CINT, LP_CINT]
+lib.index_from_arrays.restype = ctypes.c_void_p
+lib.index_from_arrays.argtypes = [LP_CDOUBLE, LP_CINT, LP_CINT]
 # interpolate2(double *pts, double *base_pts, double *base_z, double *out,
 # int *tri, spatial_index *ind, int np)
 lib.interpolate.argtypes = [
@@ -78,6 +86,36 @@ lib.interpolate.argtypes = [
     LP_CCHAR,
     ctypes.c_int]
 lib.interpolate.restype = None
+# int triangle_neighbours(int *tri, int *nb, int ntri, int npoints)
+lib.triangle_neighbours.argtypes = [LP_CINT, LP_CINT, ctypes.c_int, ctypes.c_int]
+lib.triangle_neighbours.restype = ctypes.c_int
+# void find_triangle_walk(double *pts, int *out, double *base_pts,int *tri,
+# int *nb, spatial_index *ind, char *mask, int np)
+lib.find_triangle_walk.argtypes = [
+    LP_CDOUBLE,
+    LP_CINT,
+    LP_CDOUBLE,
+    LP_CINT,
+    LP_CINT,
+    ctypes.c_void_p,
+    LP_CCHAR,
+    ctypes.c_int]
+lib.find_triangle_walk.restype = None
+# void interpolate_walk(double *pts, double *base_pts, double *base_z,
+# double *out, double nd_val, int *tri, int *nb, spatial_index *ind, char
+# *mask, int np)
+lib.interpolate_walk.argtypes = [
+    LP_CDOUBLE,
+    LP_CDOUBLE,
+    LP_CDOUBLE,
+    LP_CDOUBLE,
+    ctypes.c_double,
+    LP_CINT,
+    LP_CINT,
+    ctypes.c_void_p,
+    LP_CCHAR,
+    ctypes.c_int]
+lib.interpolate_walk.restype = None
 # void make_grid(double *base_pts,double *base_z, int *tri, float *grid,
 # float tgrid, double nd_val, int ncols, int nrows, double cx, double cy,
 # double xl, double yu, spatial_index *ind)
@@ -90,6 +128,18 @@ lib.make_grid.argtypes = [LP_CDOUBLE,
                           ctypes.c_int,
                           ctypes.c_int] + [ctypes.c_double] * 4 + [ctypes.c_void_p]
 lib.make_grid.restype = None
+# void make_grid_scan(double *base_pts,double *base_z, int *tri, float *grid,
+# float *tgrid, float nd_val, int ncols, int nrows, double cx, double cy,
+# double xl, double yu, int ntri)
+lib.make_grid_scan.argtypes = [LP_CDOUBLE,
+                               LP_CDOUBLE,
+                               LP_CINT,
+                               LP_CFLOAT,
+                               LP_CFLOAT,
+                               ctypes.c_float,
+                               ctypes.c_int,
+                               ctypes.c_int] + [ctypes.c_double] * 4 + [ctypes.c_int]
+lib.make_grid_scan.restype = None
 # void make_grid_low(double *base_pts,double *base_z, int *tri, float
 # *grid,  float nd_val, int ncols, int nrows, double cx, double cy, double
 # xl, double yu, double cut_off, spatial_index *ind)
@@ -106,6 +156,9 @@ lib.optimize_index.restype = None
 
 delaunator_lib.triangulate.argtypes = [ctypes.c_int, LP_CDOUBLE, LP_CINT, ctypes.POINTER(LP_CINT)]
 delaunator_lib.triangulate.restype = None
+delaunator_lib.triangulate_halfedges.argtypes = [ctypes.c_ulonglong, LP_CDOUBLE, LP_CINT, ctypes.POINTER(LP_CINT),
+                                                 ctypes.POINTER(LP_CINT)]
+delaunator_lib.triangulate_halfedges.restype = None
 delaunator_lib.free_face_data.argtypes = [ctypes.POINTER(LP_CINT)]
 delaunator_lib.free_face_data.restype = None
 
@@ -120,6 +173,9 @@ class TriangulationBase(object):
     segments = None
     holes = None
     ntrig = None
+    neighbours = None
+    halfedges = None
+    index_arrays = None  # external arrays backing the index - see set_index_arrays
     transform = None  # can be used to speed up things even more....
 
     def __del__(self):
@@ -143,8 +199,30 @@ class TriangulationBase(object):
         if points.ndim != ndim or (ndim == 2 and points.shape[1] != 2):
             raise ValueError("Bad shape of input - points:(n,2) z: (n,), indices: (n,)")
 
-    def interpolate(self, z_base, xy_in, nd_val=-999, mask=None):
-        """Barycentric interpolation of input points xy_in based on values z_base in vertices. Points outside triangulation gets nd_val"""
+    def get_neighbours(self):
+        """
+        Get the triangle adjacency - calculated on first use.
+        Returns:
+            Numpy (ntrig,3) int32 array, where entry (t,k) is the triangle sharing the edge from vertex k to vertex k+1 (mod 3) of triangle t, or -1 at the boundary.
+        """
+        if self.neighbours is None:
+            if self.halfedges is not None:
+                # the half-edge e belongs to triangle e // 3
+                neighbours = np.where(self.halfedges >= 0, self.halfedges // 3, -1).astype(np.int32)
+                self.neighbours = neighbours.reshape((self.ntrig, 3))
+            else:
+                neighbours = np.empty((self.ntrig, 3), dtype=np.int32)
+                if lib.triangle_neighbours(self.vertices, neighbours.ctypes.data_as(LP_CINT),
+                                           self.ntrig, self.points.shape[0]) != 0:
+                    raise MemoryError("Failed to calculate triangle neighbours.")
+                self.neighbours = neighbours
+        return self.neighbours
+
+    def interpolate(self, z_base, xy_in, nd_val=-999, mask=None, walk=False):
+        """
+        Barycentric interpolation of input points xy_in based on values z_base in vertices. Points outside triangulation gets nd_val.
+        If walk is True, triangles are located by walking from the previously found triangle (falling back to the index) - can be faster for densely sampled, ordered input.
+        """
         self.validate_points(xy_in)
         self.validate_points(z_base, 1)
         if z_base.shape[0] != self.points.shape[0]:
@@ -158,13 +236,21 @@ class TriangulationBase(object):
         else:
             pmask = None
         out = np.empty((xy_in.shape[0],), dtype=np.float64)
-        lib.interpolate(xy_in.ctypes.data_as(LP_CDOUBLE), self.points.ctypes.data_as(LP_CDOUBLE), z_base.ctypes.data_as(LP_CDOUBLE),
-                        out.ctypes.data_as(LP_CDOUBLE), nd_val, self.vertices, self.index, pmask, xy_in.shape[0])
+        if walk:
+            lib.interpolate_walk(xy_in.ctypes.data_as(LP_CDOUBLE), self.points.ctypes.data_as(LP_CDOUBLE), z_base.ctypes.data_as(LP_CDOUBLE),
+                                 out.ctypes.data_as(LP_CDOUBLE), nd_val, self.vertices,
+                                 self.get_neighbours().ctypes.data_as(LP_CINT), self.index, pmask, xy_in.shape[0])
+        else:
+            lib.interpolate(xy_in.ctypes.data_as(LP_CDOUBLE), self.points.ctypes.data_as(LP_CDOUBLE), z_base.ctypes.data_as(LP_CDOUBLE),
+                            out.ctypes.data_as(LP_CDOUBLE), nd_val, self.vertices, self.index, pmask, xy_in.shape[0])
         return out
 
-    def make_grid(self, z_base, ncols, nrows, xl, cx, yu, cy, nd_val=-999, return_triangles=False):
+    def make_grid(self, z_base, ncols, nrows, xl, cx, yu, cy, nd_val=-999, return_triangles=False, engine="index"):
         """
         Interpolate a grid using (barycentric) interpolation.
+        Two engines are available: 'index' looks up the triangle of each cell center in the triangle index,
+        'scanline' loops over the triangles and scan converts each of them into the grid - which is usually faster
+        for fine grids, as there is no search pr. cell.
         Args:
             z_base: The values to interpolate (numpy 1d array, float64).
             ncols: number of columns.
@@ -175,8 +261,11 @@ class TriangulationBase(object):
             cy: Vertical cell size (positive).
             nd_val: output no data value.
             return_triangles: bool, if True also return a grid containing triangle bounding box sizes.
+            engine: 'index' or 'scanline'.
         Returns:
             Numpy 2d-arrray (float64) (and numpy 2d float32 array if return_triangles=True)
+        Raises:
+            ValueError: If z_base has the wrong size or engine is unknown.
         """
         # void make_grid(double *base_pts,double *base_z, int *tri, double *grid,
         # double nd_val, int ncols, int nrows, double cx, double cy, double xl,
@@ -184,26 +273,44 @@ class TriangulationBase(object):
         if z_base.shape[0] != self.points.shape[0]:
             raise ValueError(
                 "There must be exactly the same number of input zs as the number of triangulated points.")
+        if engine not in ("index", "scanline"):
+            raise ValueError("Unknown gridding engine: %s" % engine)
         grid = np.empty((nrows, ncols), dtype=np.float32)
         if return_triangles:
             t_grid = np.zeros((nrows, ncols), dtype=np.float32)
             p_t_grid = t_grid.ctypes.data_as(LP_CFLOAT)
         else:
             p_t_grid = None
-        lib.make_grid(
-            self.points.ctypes.data_as(LP_CDOUBLE),
-            z_base.ctypes.data_as(LP_CDOUBLE),
-            self.vertices,
-            grid.ctypes.data_as(LP_CFLOAT),
-            p_t_grid,
-            nd_val,
-            ncols,
-            nrows,
-            cx,
-            cy,
-            xl,
-            yu,
-            self.index)
+        if engine == "scanline":
+            lib.make_grid_scan(
+                self.points.ctypes.data_as(LP_CDOUBLE),
+                z_base.ctypes.data_as(LP_CDOUBLE),
+                self.vertices,
+                grid.ctypes.data_as(LP_CFLOAT),
+                p_t_grid,
+                nd_val,
+                ncols,
+                nrows,
+                cx,
+                cy,
+                xl,
+                yu,
+                self.ntrig)
+        else:
+            lib.make_grid(
+                self.points.ctypes.data_as(LP_CDOUBLE),
+                z_base.ctypes.data_as(LP_CDOUBLE),
+                self.vertices,
+                grid.ctypes.data_as(LP_CFLOAT),
+                p_t_grid,
+                nd_val,
+                ncols,
+                nrows,
+                cx,
+                cy,
+                xl,
+                yu,
+                self.index)
         if return_triangles:
             return grid, t_grid
         else:
@@ -259,7 +366,7 @@ class TriangulationBase(object):
         return out
 
     def rebuild_index(self, cs):
-        """Rebuild index with another cell size"""
+        """Rebuild index with another cell size (cs<=0 to guess a proper cell size)"""
         lib.free_index(self.index)
         self.index = lib.build_index(
             self.points.ctypes.data_as(LP_CDOUBLE),
@@ -267,24 +374,75 @@ class TriangulationBase(object):
             cs,
             self.points.shape[0],
             self.ntrig)
+        self.index_arrays = None
+        if self.index is None:
+            raise Exception("Failed to build index...")
 
     def optimize_index(self):
-        """Only shrinks index slightly in memory. Should also sort index after areas of intersections between cells and triangles..."""
+        """Does nothing - the index is stored compactly already. Kept for compatibility."""
         lib.optimize_index(self.index)
 
+    def get_index_arrays(self):
+        """
+        Get a copy of the triangle index, e.g. for saving it along with the triangulation.
+        Returns:
+            header: float64 array of size INDEX_HEADER_SIZE (extent, cell size, ncols, nrows, npoints, ntri, nhits).
+            offsets: int32 array of size ncells + 1.
+            tri_ids: int32 array - the triangles hitting index cell i are tri_ids[offsets[i]:offsets[i+1]].
+        """
+        header = np.empty((INDEX_HEADER_SIZE,), dtype=np.float64)
+        lib.get_index_header(self.index, header.ctypes.data_as(LP_CDOUBLE))
+        offsets = np.empty((int(header[5]) * int(header[6]) + 1,), dtype=np.int32)
+        tri_ids = np.empty((int(header[9]),), dtype=np.int32)
+        lib.copy_index_arrays(self.index, offsets.ctypes.data_as(LP_CINT), tri_ids.ctypes.data_as(LP_CINT))
+        return header, offsets, tri_ids
+
+    def set_index_arrays(self, header, offsets, tri_ids):
+        """
+        Replace the triangle index by one previously obtained from get_index_arrays.
+        The arrays are not copied, so they can be memory mapped, e.g. via numpy.load(path, mmap_mode="r").
+        Args:
+            header: float64 array of size INDEX_HEADER_SIZE.
+            offsets: int32 array of size ncells + 1.
+            tri_ids: int32 array of size offsets[-1].
+        Raises:
+            ValueError: If the arrays do not match each other or this triangulation.
+        """
+        if header.dtype != np.float64 or header.shape != (INDEX_HEADER_SIZE,):
+            raise ValueError("Bad index header")
+        if int(header[7]) != self.points.shape[0] or int(header[8]) != self.ntrig:
+            raise ValueError("Index was built for another triangulation")
+        for arr in (header, offsets, tri_ids):
+            if not arr.flags["C_CONTIGUOUS"]:
+                raise ValueError("Index arrays must be C contiguous")
+        if offsets.dtype != np.int32 or offsets.shape != (int(header[5]) * int(header[6]) + 1,):
+            raise ValueError("Bad type or size of index offsets")
+        if tri_ids.dtype != np.int32 or tri_ids.shape != (int(header[9]),) or offsets[-1] != tri_ids.shape[0]:
+            raise ValueError("Bad type or size of index triangle ids")
+        index = lib.index_from_arrays(header.ctypes.data_as(LP_CDOUBLE),
+                                      offsets.ctypes.data_as(LP_CINT),
+                                      tri_ids.ctypes.data_as(LP_CINT))
+        if index is None:
+            raise Exception("Failed to create index...")
+        lib.free_index(self.index)
+        self.index = index
+        # keep the arrays alive as long as the index refers to them
+        self.index_arrays = (header, offsets, tri_ids)
+
     def inspect_index(self):
         """Return info as text"""
         info = ctypes.create_string_buffer(1024)
         lib.inspect_index(self.index, info, 1024)
         return info.value
 
-    def find_triangles(self, xy, mask=None):
+    def find_triangles(self, xy, mask=None, walk=False):
         """
         Finds triangle indices of input points. Returns -1 if no triangles is found.
         Can be used to implement a point in polygon algorithm (for convex polygons without holes).
         Args:
             xy: The points in which to look for containing triangles.
             mask: optional, A 1d validity mask marking validity of triangles.
+            walk: optional, locate triangles by walking from the previous hit (can be faster for densely sampled, ordered input).
         Returns:
             Numpy 1d int32 array containing triangles indices. -1 is used to indicate no (valid) triangle.
         """
@@ -297,30 +455,58 @@ class TriangulationBase(object):
             pmask = mask.ctypes.data_as(LP_CCHAR)
         else:
             pmask = None
-        lib.find_triangle(
-            xy.ctypes.data_as(LP_CDOUBLE),
-            out.ctypes.data_as(LP_CINT),
-            self.points.ctypes.data_as(LP_CDOUBLE),
-            self.vertices,
-            self.index,
-            pmask,
-            xy.shape[0])
+        if walk:
+            lib.find_triangle_walk(
+                xy.ctypes.data_as(LP_CDOUBLE),
+                out.ctypes.data_as(LP_CINT),
+                self.points.ctypes.data_as(LP_CDOUBLE),
+                self.vertices,
+                self.get_neighbours().ctypes.data_as(LP_CINT),
+                self.index,
+                pmask,
+                xy.shape[0])
+        else:
+            lib.find_triangle(
+                xy.ctypes.data_as(LP_CDOUBLE),
+                out.ctypes.data_as(LP_CINT),
+                self.points.ctypes.data_as(LP_CDOUBLE),
+                self.vertices,
+                self.index,
+                pmask,
+                xy.shape[0])
         return out
 
 
 class Triangulation(TriangulationBase):
-    """TriangulationBase implementation. Will construct a triangulation and an index of triangles."""
+    """
+    TriangulationBase implementation. Will construct a triangulation and an index of triangles.
+    The half-edge adjacency from Delaunator is available as self.halfedges (numpy int32 array of size 3*ntrig):
+    halfedges[e] is the opposite half-edge of e, or -1 on the hull, where half-edge e = 3*t + k is the edge from
+    vertex k to vertex k+1 (mod 3) of triangle t.
+    """
 
     def __init__(self, points, cs=-1):
+        """
+        Args:
+            points: Numpy (n,2) float64 array of vertices.
+            cs: Cell size of the triangle index. Use -1 to guess a proper cell size from the point density.
+        """
         self.validate_points(points)
         self.points = points
         num_faces = ctypes.c_int(0)
         self.ptr_faces = ctypes.POINTER(ctypes.c_int)()
-        delaunator_lib.triangulate(points.shape[0],
-                                   points.ctypes.data_as(LP_CDOUBLE),
-                                   ctypes.byref(num_faces),
-                                   ctypes.byref(self.ptr_faces))
+        ptr_halfedges = ctypes.POINTER(ctypes.c_int)()
+        delaunator_lib.triangulate_halfedges(points.shape[0],
+                                             points.ctypes.data_as(LP_CDOUBLE),
+                                             ctypes.byref(num_faces),
+                                             ctypes.byref(self.ptr_faces),
+                                             ctypes.byref(ptr_halfedges))
         self.ntrig = num_faces.value
+        if self.ntrig > 0:
+            self.halfedges = np.ctypeslib.as_array(ptr_halfedges, (3 * self.ntrig,)).copy()
+        else:
+            self.halfedges = np.empty((0,), dtype=np.int32)
+        delaunator_lib.free_face_data(ctypes.byref(ptr_halfedges))
         self.vertices = self.ptr_faces.contents
         #print("Triangles: %d" %self.ntrig)
         t1 = time.process_time()
@@ -375,6 +561,36 @@ def unit_test(n1=1000, n2=1000):
     D = np.fabs(z - zi)
     print("Diff: %.15g, %.15g, %.15g" % (D.max(), D.min(), D.mean()))
     assert(D.max() < 1e-4)
+    ncols = nrows = 200
+    cs = 0.3 * dx / ncols
+    g1, t1 = tri.make_grid(z, ncols, nrows, cx, cs, cy + 0.3 * dy, cs, return_triangles=True)
+    g2, t2 = tri.make_grid(z, ncols, nrows, cx, cs, cy + 0.3 * dy, cs, return_triangles=True, engine="scanline")
+    D = np.fabs(g1 - g2)
+    print("Grid diff index vs. scanline: %.15g" % D.max())
+    assert(D.max() < 1e-3)
+    # walking should find the same triangles (up to points on edges)
+    xy = xy[np.lexsort((xy[:, 0], xy[:, 1]))]
+    zi1 = tri.interpolate(z, xy)
+    zi2 = tri.interpolate(z, xy, walk=True)
+    assert(np.fabs(zi1 - zi2).max() < 1e-6)
+    T2 = tri.find_triangles(xy, walk=True)
+    assert((T2 >= 0).all())
+    N = tri.get_neighbours()
+    assert(N.max() < tri.ntrig)
+    assert((N >= 0).sum() % 2 == 0)
+    # adjacency from the half-edges should match the one calculated from the triangles
+    N2 = np.empty_like(N)
+    lib.triangle_neighbours(tri.vertices, N2.ctypes.data_as(LP_CINT), tri.ntrig, tri.points.shape[0])
+    assert((N == N2).all())
+    # the index can be rebuilt with another cell size, and saved / restored as numpy arrays
+    T = tri.find_triangles(xy)
+    header, offsets, tri_ids = tri.get_index_arrays()
+    assert(offsets[-1] == tri_ids.shape[0])
+    assert(((tri_ids >= 0) & (tri_ids < tri.ntrig)).all())
+    tri.rebuild_index(header[4] * 2.5)
+    assert((tri.find_triangles(xy) == T).all())
+    tri.set_index_arrays(header.copy(), offsets.copy(), tri_ids.copy())
+    assert((tri.find_triangles(xy) == T).all())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+# Copyright (c) 2016, Danish Agency for Data Supply and Efficiency <sdfe@sdfe.dk>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+'''
+tile_summary.py
+
+Summarise a las tile in a single pass over the points. Writes a multi band grid with
+point counts per class, density, min / max / mean z, most frequent point source id,
+share of first returns and gps time range for each cell.
+Optionally reports class counts and acquisition dates - like count_classes and time_stats.
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from builtins import str
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from . import dhmqc_constants as constants
+from . import count_classes
+from . import time_stats
+from .thatsDEM import pointcloud, grid, las_io
+from .utils.osutils import ArgumentParser
+from .db import report
+
+CELL_SIZE = 1.0
+ND_VAL = -9999
+# The classes reported by count_classes
+SUMMARY_CLASSES = [constants.created_unused, constants.surface, constants.terrain, constants.low_veg,
+                   constants.med_veg, constants.high_veg, constants.building, constants.outliers,
+                   constants.mod_key, constants.water, constants.ignored, constants.power_line,
+                   constants.bridge, constants.high_noise, constants.terrain_in_buildings,
+                   constants.low_veg_in_buildings, constants.man_excl]
+PROGNAME = os.path.basename(__file__).replace(".pyc", ".py")
+
+parser = ArgumentParser(
+    description="Write a multi band grid summarising a las tile and optionally report class counts and dates.",
+    prog=PROGNAME)
+parser.add_argument("las_file", help="Input las tile.")
+parser.add_argument("output_dir", help="output directory of summary grids.")
+parser.add_argument(
+    "-cs",
+    type=float,
+    help="Cellsize (defaults to {0:.2f})".format(CELL_SIZE),
+    default=CELL_SIZE)
+parser.add_argument(
+    '-cls',
+    help='''classes to count. Default is the classes reported by count_classes,
+          otherwise valid input is a comma-separated list of class numbers,
+          e.g. 0,1,2,3,7,8,10''',
+    default=None,
+    type=str,
+)
+parser.add_argument(
+    "-report",
+    nargs="+",
+    choices=["class_count", "dates"],
+    default=[],
+    help="Also report class counts (like count_classes) and / or acquisition dates (like time_stats).")
+
+db_group = parser.add_mutually_exclusive_group()
+db_group.add_argument(
+    "-use_local",
+    action="store_true",
+    help="Force use of local database for reporting.")
+db_group.add_argument("-schema", help="Specify schema for PostGis db.")
+
+
+def usage():
+    '''
+    Print usage
+    '''
+    parser.print_help()
+
+
+def get_gps_time(pc):
+    '''
+    Get the gps time of the points of a pointcloud read from a las file without copying the file.
+
+    Args:
+        pc: pointcloud.Pointcloud backed by a las source (fromLAS with mmap or lazy set).
+    Returns:
+        numpy array of gps times or None if not available.
+    '''
+    source = pc.source
+    if isinstance(source, las_io.LasMemmap):
+        if "gps_time" not in source.points.dtype.names:
+            return None
+        gps_time = source.field("gps_time")
+    elif hasattr(source, "las"):
+        try:
+            gps_time = source.las.gps_time
+        except Exception:  # laspy raises for point formats without gps time
+            return None
+    else:
+        return None
+    if pc.source_index is not None:
+        gps_time = gps_time[pc.source_index]
+    return gps_time
+
+
+def summarise(pc, ncols, nrows, geo_ref, classes=SUMMARY_CLASSES, gps_time=None, nd_val=ND_VAL):
+    '''
+    Calculate summary grids of a pointcloud. The points are sorted by cell once and all bands are
+    calculated vectorised from that.
+
+    Args:
+        pc: pointcloud.Pointcloud with return numbers.
+        ncols, nrows: Shape of the output grids.
+        geo_ref: GDAL style georeference of the output grids.
+        classes: Classes to count points of.
+        gps_time: Optional gps time of the points.
+        nd_val: No data value for cells without points (counts and density are 0 there).
+    Returns:
+        OrderedDict of band name: 2d float64 numpy array.
+    '''
+    ncells = ncols * nrows
+    B, M = grid.cell_indices(pc.xy, ncols, nrows, geo_ref)
+    I = np.argsort(B, kind="stable")
+    B = B[I]
+    # indices of the points in the grid sorted by cell
+    sel = np.flatnonzero(M)[I]
+    count = np.bincount(B, minlength=ncells)
+    H = count > 0
+    bands = OrderedDict()
+
+    def empty():
+        out = np.empty((ncells,), dtype=np.float64)
+        out.fill(nd_val)
+        return out
+
+    c = pc.c[sel]
+    for cls in classes:
+        bands["count_%d" % cls] = np.bincount(B[c == cls], minlength=ncells).astype(np.float64)
+    bands["density"] = count / float(abs(geo_ref[1] * geo_ref[5]))
+    for name in ("z_min", "z_max", "z_mean", "pid", "first_return_share", "gps_time_min", "gps_time_max"):
+        bands[name] = empty()
+    if B.shape[0] > 0:
+        # start of each segment of points in the same cell
+        starts = np.flatnonzero(np.concatenate(([True], B[1:] != B[:-1])))
+        cells = B[starts]
+        z = pc.z[sel]
+        bands["z_min"][cells] = np.minimum.reduceat(z, starts)
+        bands["z_max"][cells] = np.maximum.reduceat(z, starts)
+        bands["z_mean"][H] = np.bincount(B, weights=z, minlength=ncells)[H] / count[H]
+        bands["first_return_share"][H] = np.bincount(B, weights=(pc.rn[sel] == 1),
+                                                     minlength=ncells)[H] / count[H]
+        # most frequent pid: find runs of equal (cell, pid) and take the longest run in each cell
+        pid = pc.pid[sel]
+        J = np.lexsort((pid, B))
+        B_pid, pid = B[J], pid[J]
+        run_starts = np.flatnonzero(np.concatenate(([True], (B_pid[1:] != B_pid[:-1]) | (pid[1:] != pid[:-1]))))
+        run_counts = np.diff(np.append(run_starts, B_pid.shape[0]))
+        run_cells = B_pid[run_starts]
+        K = np.lexsort((-run_counts, run_cells))
+        first = np.concatenate(([True], run_cells[K][1:] != run_cells[K][:-1]))
+        bands["pid"][run_cells[K][first]] = pid[run_starts[K][first]]
+        if gps_time is not None:
+            t = gps_time[sel]
+            bands["gps_time_min"][cells] = np.minimum.reduceat(t, starts)
+            bands["gps_time_max"][cells] = np.maximum.reduceat(t, starts)
+    for name in bands:
+        bands[name] = bands[name].reshape((nrows, ncols))
+    return bands
+
+
+def main(args):
+    '''
+    Main function
+    '''
+    try:
+        pargs = parser.parse_args(args[1:])
+    except TypeError as error_msg:
+        print(str(error_msg))
+        return 1
+
+    lasname = pargs.las_file
+    outdir = pargs.output_dir
+    kmname = constants.get_tilename(lasname)
+    print("Running %s on block: %s, %s" % (PROGNAME, kmname, time.asctime()))
+
+    try:
+        xll, yll, xlr, yul = constants.tilename_to_extent(kmname)
+    except (ValueError, AttributeError) as error_msg:
+        print("Exception: %s" % error_msg)
+        print("Bad 1km formatting of las file: %s" % lasname)
+        return 1
+
+    classes = SUMMARY_CLASSES
+    try:
+        if pargs.cls is not None:
+            classes = sorted(set([int(i) for i in pargs.cls.split(',')]))
+    except ValueError:
+        print('Ill-formed class list. Valid input is a comma-separated list of integers.')
+        return 1
+
+    # Attributes are read from the file (once) as they are used.
+    pc = pointcloud.fromLAS(lasname, include_return_number=True, mmap=True, lazy=True)
+    gps_time = get_gps_time(pc)
+    if gps_time is None:
+        print("No gps time in %s" % lasname)
+
+    cell_size = pargs.cs
+    ncols = int((xlr - xll) / cell_size)
+    nrows = int((yul - yll) / cell_size)
+    geo_ref = [xll, cell_size, 0, yul, 0, -cell_size]
+    bands = summarise(pc, ncols, nrows, geo_ref, classes, gps_time)
+    grids = [grid.Grid(arr, geo_ref, ND_VAL) for arr in bands.values()]
+    save_path = os.path.join(outdir, kmname + "_summary.tif")
+    grid.save_bands(save_path, grids, list(bands.keys()), dco=["TILED=YES", "COMPRESS=LZW"], srs=constants.srs)
+
+    if pargs.report:
+        if pargs.schema is not None:
+            report.set_schema(pargs.schema)
+        wkt = constants.tilename_to_extent(kmname, return_wkt=True)
+        if "class_count" in pargs.report:
+            counts = np.bincount(pc.c, minlength=256)
+            count_classes.report_counts(report.ReportClassCount(pargs.use_local), kmname,
+                                        lambda cls: counts[cls], pc.get_size(), wkt)
+        if "dates" in pargs.report:
+            if gps_time is None or gps_time.shape[0] == 0:
+                print("No gps times to report.")
+            else:
+                time_stats.report_dates(report.ReportUniqueDates(pargs.use_local), kmname, gps_time, wkt)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
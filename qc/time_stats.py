@@ -32,6 +32,7 @@ import numpy as np
 import laspy
 
 from . import dhmqc_constants as constants
+from .thatsDEM import las_io
 from .utils.osutils import ArgumentParser
 from .db import report
 
@@ -124,6 +125,32 @@ def find_unique_days(gps_times):
     return datetimes
 
 
+def report_dates(reporter, kmname, gps_time, wkt):
+    '''
+    Report first and last acquisition time and the unique acquisition days.
+
+    reporter:       report.ReportUniqueDates object
+    kmname:         tile name
+    gps_time:       numpy array with gps-times
+    wkt:            tile geometry as wkt
+    '''
+    datetimes = find_unique_days(gps_time)
+    datestrings = [d.strftime('%Y%m%d') for d in datetimes]
+
+    unique_dates = ';'.join(datestrings)
+    min_date = np.min(gps_time)
+    max_date = np.max(gps_time)
+
+    reporter.report(
+        kmname,
+        str(to_datetime(min_date)),
+        str(to_datetime(max_date)),
+        unique_dates,
+        len(datestrings),
+        wkt_geom=wkt
+    )
+
+
 def main(args):
     '''
     Main function
@@ -140,23 +167,14 @@ def main(args):
 
     reporter = report.ReportUniqueDates(pargs.use_local)
 
-    las = laspy.file.File(pargs.las_file, mode='r')
-
-    datetimes = find_unique_days(las.gps_time)
-    datestrings = [d.strftime('%Y%m%d') for d in datetimes]
+    if las_io.read_header(pargs.las_file)["compressed"]:
+        las = laspy.file.File(pargs.las_file, mode='r')
+        gps_time = las.gps_time
+    else:
+        # zero-copy view of the gps time field in the file
+        gps_time = las_io.LasMemmap(pargs.las_file).field("gps_time")
 
-    unique_dates = ';'.join(datestrings)
-    min_date = np.min(las.gps_time)
-    max_date = np.max(las.gps_time)
-
-    reporter.report(
-        kmname,
-        str(to_datetime(min_date)),
-        str(to_datetime(max_date)),
-        unique_dates,
-        len(datestrings),
-        wkt_geom=wkt
-    )
+    report_dates(reporter, kmname, gps_time, wkt)
 
     return 0
 
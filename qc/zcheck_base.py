@@ -55,10 +55,12 @@ def zcheck_base(lasname,vectorname,angle_tolerance,xy_tolerance,z_tolerance,cut_
 		extent=None
 	geometries=vector_io.get_geometries(vectorname,layername,layersql,extent)
 	pcs=dict()
+	# cut to class once - strips are then cut via the cached strip partition
+	pc=pc.cut_to_class(cut_class)
 	for id in pc.get_pids():
 		print("%s\n" %("+"*70))
 		print("Strip id: %d" %id)
-		pc_=pc.cut_to_strip(id).cut_to_class(cut_class)
+		pc_=pc.cut_to_strip(id)
 		if pc_.get_size()>50:
 			pcs[id]=pc_
 			pcs[id].triangulate()
@@ -27,7 +27,11 @@ import sys
 import os
 import time
 import traceback
+import bisect
+import shutil
+import tempfile
 import multiprocessing
+from multiprocessing.connection import wait as wait_for_results
 import sqlite3 as sqlite
 import argparse
 from datetime import timedelta
@@ -37,30 +41,81 @@ from osgeo import osr
 
 from proc_setup import setup_job
 from proc_setup import show_tests
+from proc_setup import split_testnames
+from proc_setup import estimate_costs
 from proc_setup import QC_WRAP_NAMES
 from proc_setup import QC_WRAP_DEFAULTS
+from proc_setup import STATUS_PROCESSING, STATUS_OK, STATUS_ERROR
 import qc
 from qc.db import report
+from qc.thatsDEM import pointcloud
 from qc import dhmqc_constants as constants
 from qc.utils import osutils
 
 LOGDIR = os.path.join(os.path.dirname(__file__), "logs")
-STATUS_PROCESSING = 1
-STATUS_OK = 2
-STATUS_ERROR = 3
+# Table recording the status of each test when running several tests per tile
+TEST_STATUS_TABLE = "test_status"
+# Memory backed location for the shared tile cache, if available
+SHM_DIR = "/dev/shm"
+# Seconds to wait for results before checking the processes
+POLL_INTERVAL = 5
+# Status updates are written to the process db in batches of this size - or after this many seconds
+DB_BATCH_SIZE = 50
+DB_WRITE_INTERVAL = 5
+# A second attempt of a tile can be started at the end of a run, if it has been running for
+# this many times the median runtime of a tile (and at least SPECULATE_MIN_TIME seconds).
+SPECULATE_FACTOR = 3.0
+SPECULATE_MIN_TIME = 60
 
 ogr.UseExceptions()
 
-def run_check(p_number, testname, db_name, add_args, runid, use_local, schema, use_ref_data, lock):
+def run_test(test_func, send_args, stderr):
+    '''
+    Run a single test and return (status, return code, message).
+    '''
+    try:
+        return_code = test_func(send_args)
+    except Exception as err_msg:
+        return_code = -1
+        msg = str(err_msg)
+        status = STATUS_ERROR
+        stderr.write("[qc_wrap]: Exception caught:\n" + msg + "\n")
+        stderr.write("[qc_wrap]: Traceback:\n" + traceback.format_exc() + "\n")
+    else:
+        #set new status
+        msg = "ok"
+        status = STATUS_OK
+        try:
+            return_code = int(return_code)
+        except (NameError, ValueError, TypeError):
+            return_code = 0
+    return status, return_code, msg
+
+
+def run_check(p_number, testname, task_queue, result_pipe, add_args, runid, use_local, schema, index_cache=None,
+              tile_cache=None):
     '''
     Main checker rutine which should be defined for all processes.
+    Takes (id, las path, ref path) tuples from task_queue until it gets None and sends
+    (process number, id, status, return code, message, end time, runtime, test results) tuples on result_pipe,
+    the sending end of a pipe of its own - so that the process can be terminated without affecting others.
+    testname can name several (comma separated) tests. These are run one after the other
+    on each tile, which is only read once. The results of the single tests are then returned as
+    (testname, status, return code, message, start time, end time) tuples - otherwise test results is empty.
+    tile_cache is None or a (directory, size in MB) tuple of a tile cache shared by the processes.
     '''
 
-    logger = multiprocessing.log_to_stderr()
-    test_func = qc.get_test(testname)
+    testnames = split_testnames(testname)
+    several_tests = len(testnames) > 1
+    testname = "_".join(testnames)
+    test_funcs = [(name, qc.get_test(name), qc.tests[name][0]) for name in testnames]
     #Set up some globals in various modules... per process.
     if runid is not None:
         report.set_run_id(runid)
+    if index_cache is not None:
+        pointcloud.set_index_cache(index_cache)
+    if tile_cache is not None:
+        pointcloud.set_tile_cache(*tile_cache)
 
     if use_local:
         # rather than sending args to scripts, which might not have implemented
@@ -68,13 +123,7 @@ def run_check(p_number, testname, db_name, add_args, runid, use_local, schema, u
         report.set_use_local(True)
     elif schema is not None:
         report.set_schema(schema)
-    #LOAD THE DATABASE
-    con = sqlite.connect(db_name)
-    if con is None:
-        logger.error("[qc_wrap]: Process: {0:d}, unable to fetch process db".format(p_number))
-        return
 
-    cur = con.cursor()
     timestamp = (time.asctime().split()[-2]).replace(':', '_')
     logname = testname + '_' + timestamp + '_' + str(p_number) + '.log'
     logname = os.path.join(LOGDIR, logname)
@@ -91,77 +140,117 @@ def run_check(p_number, testname, db_name, add_args, runid, use_local, schema, u
 
     print(filler)
     done = 0
-    cur.execute('select count() from ' + testname + ' where status=0')
-    n_left = cur.fetchone()[0]
-    while n_left > 0:
-        print(filler)
-        print("[qc_wrap]: Number of tiles left: {0:d}".format(n_left))
-        print(filler)
-        #Critical section#
-        lock.acquire()
-        cur.execute("select id,las_path,ref_path from " + testname + " where status=0")
-        data = cur.fetchone()
-        if data is None:
-            print("[qc_wrap]: odd - seems to be no more tiles left...")
-            lock.release()
-            break
-        fid, lasname, vname = data
-        cur.execute("update " + testname + " set status=?,prc_id=?,exe_start=? where id=?",
-                    (STATUS_PROCESSING, p_number, time.asctime(), fid))
-        try:
-            con.commit()
-        except Exception as err_msg:
-            stderr.write("[qc_wrap]: Unable to update tile to finish status...\n" + err_msg + "\n")
+    while True:
+        task = task_queue.get()
+        if task is None:
             break
-        finally:
-            lock.release()
-
-        #end critical section#
+        fid, lasname, vname = task
+        t_tile = time.time()
+        print(filler)
         print("[qc_wrap]: Doing lasfile {0:s}...".format(lasname))
-        send_args = [testname, lasname]
-        if use_ref_data:
-            send_args.append(vname)
-        send_args += add_args
-        try:
-            return_code = test_func(send_args)
-        except Exception as err_msg:
-            return_code = -1
-            msg = str(err_msg)
-            status = STATUS_ERROR
-            stderr.write("[qc_wrap]: Exception caught:\n" + msg + "\n")
-            stderr.write("[qc_wrap]: Traceback:\n" + traceback.format_exc() + "\n")
-        else:
-            #set new status
-            msg = "ok"
-            status = STATUS_OK
+        print(filler)
+        if several_tests:
+            # read the tile once - the tests will get (filtered) copies of it
             try:
-                return_code = int(return_code)
-            except (NameError, ValueError, TypeError):
-                return_code = 0
-        cur.execute("update " + testname + " set status=?,exe_end=?,rcode=?,msg=? where id=?",
-                    (status, time.asctime(), return_code, msg, fid))
+                pointcloud.set_preloaded(lasname)
+            except Exception as err_msg:
+                stderr.write("[qc_wrap]: Unable to preload tile:\n" + str(err_msg) + "\n")
+        results = []
+        test_results = []
+        for name, test_func, test_uses_ref_data in test_funcs:
+            send_args = [name, lasname]
+            if test_uses_ref_data:
+                send_args.append(vname)
+            send_args += add_args
+            t_start = time.asctime()
+            result = run_test(test_func, send_args, stderr)
+            results.append(result)
+            if several_tests:
+                test_results.append((name,) + result + (t_start, time.asctime()))
+        pointcloud.set_preloaded(None)
+        if several_tests:
+            # the tile status summarises the status of the tests
+            status = max(result[0] for result in results)
+            return_code = next((result[1] for result in results if result[1] != 0), 0)
+            msg = "; ".join(name + ": " + result[2] for (name, _, _), result in zip(test_funcs, results)
+                            if result[0] == STATUS_ERROR) or "ok"
+        else:
+            status, return_code, msg = results[0]
+        result_pipe.send((p_number, fid, status, return_code, msg, time.asctime(), time.time() - t_tile, test_results))
         done += 1
-        try:
-            con.commit()
-        except Exception as err_msg:
-            stderr.write("[qc_wrap]: Unable to update tile to finish status...\n" + err_msg + "\n")
-        #go on to next one...
-        cur.execute("select count() from " + testname + " where status=0")
-        n_left = cur.fetchone()[0]
 
     print("[qc_wrap]: Checked %d tiles, finished at %s" %(done, time.asctime()))
-    cur.close()
-    con.close()
     #avoid writing to a closed fp...
     stdout.close()
     stderr.close()
     logfile.close()
 
 
+def take_tile(pending, next_id=None):
+    '''
+    Remove and return the id of the next tile to process from the sorted list of pending ids.
+    If next_id is given, the first id from next_id is taken (wrapping around at the end),
+    otherwise the first id.
+    '''
+    i = 0
+    if next_id is not None:
+        i = bisect.bisect_left(pending, next_id)
+        if i == len(pending):
+            i = 0
+    return pending.pop(i)
+
+
+def find_straggler(current, t_current, attempts, runtimes, now):
+    '''
+    Find the tile which has been processed for the longest time, if that is more than SPECULATE_FACTOR
+    times the median runtime of the finished tiles (and at least SPECULATE_MIN_TIME seconds) and the tile
+    has only been handed out once.
+    current: id of the tile processed by each process (or None).
+    t_current: time each process got its tile.
+    attempts: dict with the number of times each tile has been handed out.
+    runtimes: list of runtimes of the finished tiles.
+    Returns the id of the tile or None.
+    '''
+    if not runtimes:
+        return None
+    limit = max(SPECULATE_FACTOR * sorted(runtimes)[len(runtimes) // 2], SPECULATE_MIN_TIME)
+    straggler = None
+    for fid, t_start in zip(current, t_current):
+        if fid is None or attempts[fid] > 1:
+            continue
+        elapsed = now - t_start
+        if elapsed > limit and (straggler is None or elapsed > straggler[0]):
+            straggler = (elapsed, fid)
+    return straggler[1] if straggler is not None else None
+
+
+def write_status(con, testname, started, finished):
+    '''
+    Write status updates to the process db in one transaction.
+    started: list of (process number, start time, attempt number, id) for tiles handed out to a process.
+    finished: list of results from run_check.
+    '''
+    if not (started or finished):
+        return
+    cur = con.cursor()
+    cur.executemany("update " + testname + " set status=?,prc_id=?,exe_start=?,attempts=? where id=?",
+                    [(STATUS_PROCESSING,) + item for item in started])
+    cur.executemany("update " + testname + " set status=?,exe_end=?,rcode=?,msg=?,runtime=? where id=?",
+                    [(status, t_end, return_code, msg, runtime, fid)
+                     for _, fid, status, return_code, msg, t_end, runtime, _ in finished])
+    test_rows = [(fid,) + test_result for _, fid, _, _, _, _, _, test_results in finished
+                 for test_result in test_results]
+    if test_rows:
+        # only when running several tests
+        cur.executemany("insert into " + TEST_STATUS_TABLE + " values (?,?,?,?,?,?,?)", test_rows)
+    con.commit()
+    cur.close()
+
+
 #argument handling - set destination name to correpsond to one of the names in NAMES
 parser = argparse.ArgumentParser(
-    description='''Wrapper rutine for qc modules. Will use a sqlite database to manage
-                   multi-processing.''')
+    description='''Wrapper rutine for qc modules. Will hand out tiles to a number of processes
+                   and record the status of each tile in a sqlite database.''')
 parser.add_argument(
     "param_file",
     help="Input python parameter file.",
@@ -169,7 +258,9 @@ parser.add_argument(
 parser.add_argument(
     "-testname",
     dest="TESTNAME",
-    help="Specify testname, will override a definition in parameter file.")
+    help='''Specify testname, will override a definition in parameter file.
+            Several comma separated tests (e.g. count_classes,spike_check) are run one
+            after the other on each tile, which is then only read once.''')
 parser.add_argument(
     "-testhelp",
     help="Just print help for selected test.")
@@ -213,6 +304,52 @@ parser.add_argument(
     dest="STATUS_INTERVAL",
     help='''Specify an interval for which to run status updates
             (if method is defined in parameter file - default 1 hour).''')
+parser.add_argument(
+    "-index_cache",
+    dest="INDEX_CACHE",
+    help='''Cache spatial sort orders of tiles in this directory (or use 'sidecar'
+            to store them next to the tiles). Will override INDEX_CACHE in parameter file.''')
+parser.add_argument(
+    "-tile_cache",
+    dest="TILE_CACHE",
+    type=int,
+    help='''Share decoded tiles between the processes in a cache of this size (MB), e.g. to avoid
+            that dem_gen reads the neighbours of each tile again. Will override TILE_CACHE in parameter file.''')
+parser.add_argument(
+    "-spatial_order",
+    dest="SPATIAL_ORDER",
+    choices=[0, 1],
+    type=int,
+    help='''Process tiles in the order of a space filling curve, each process starting on its own stretch
+            of the curve, so that consecutive tiles of a process are mostly neighbours (value must be 0 or 1).''')
+parser.add_argument(
+    "-cost_order",
+    dest="COST_ORDER",
+    choices=[0, 1],
+    type=int,
+    help='''Hand out the most expensive tiles first - estimated from the number of points or runtimes
+            from a previous run (see -cost_db) - to finish as early as possible (value must be 0 or 1).
+            Takes precedence over -spatial_order.''')
+parser.add_argument(
+    "-cost_db",
+    dest="COST_DB",
+    help='''Process db of a previous run of the same test. Runtimes from there are used as tile costs
+            with -cost_order. Will override COST_DB in parameter file.''')
+parser.add_argument(
+    "-retries",
+    dest="RETRIES",
+    type=int,
+    help='''Number of times to retry a tile if the process working on it stops (default 1).
+            A new process is started in its place. Will override RETRIES in parameter file.''')
+parser.add_argument(
+    "-speculate",
+    dest="SPECULATE",
+    choices=[0, 1],
+    type=int,
+    help='''At the end of the run, start a second attempt of tiles which have been running for long,
+            and use the result of the attempt which finishes first (value must be 0 or 1).
+            Only use this with tests which can be stopped and run again on a tile,
+            since reporting might then be done twice.''')
 group = parser.add_mutually_exclusive_group()
 group.add_argument(
     "-refcon",
@@ -234,7 +371,18 @@ CREATE_SQLITE_DB = """CREATE TABLE __tablename__(
                         exe_end TEXT,
                         status INTEGER,
                         rcode INTEGER,
-                        msg TEXT)"""
+                        msg TEXT,
+                        runtime REAL,
+                        attempts INTEGER)"""
+
+CREATE_TEST_STATUS_TABLE = """CREATE TABLE {0}(
+                                tile_id INTEGER,
+                                testname TEXT,
+                                status INTEGER,
+                                rcode INTEGER,
+                                msg TEXT,
+                                exe_start TEXT,
+                                exe_end TEXT)""".format(TEST_STATUS_TABLE)
 
 INIT_DB = """SELECT InitSpatialMetadata(1)"""
 
@@ -245,9 +393,10 @@ ADD_GEOMETRY = """SELECT AddGeometryColumn('{tablename}',
                                            'XY')"""
 
 
-def create_process_db_sqlite(testname, matched_files):
+def create_process_db_sqlite(testname, matched_files, several_tests=False):
     '''
     Setup process db for organizing parallel processing.
+    If several_tests is True, also create a table for the status of each test on each tile.
     '''
 
 
@@ -269,6 +418,8 @@ def create_process_db_sqlite(testname, matched_files):
     layer.CreateField(ogr.FieldDefn('status', ogr.OFTInteger))
     layer.CreateField(ogr.FieldDefn('rcode', ogr.OFTInteger))
     layer.CreateField(ogr.FieldDefn('msg', ogr.OFTString))
+    layer.CreateField(ogr.FieldDefn('runtime', ogr.OFTReal))
+    layer.CreateField(ogr.FieldDefn('attempts', ogr.OFTInteger))
 
     pid = 0
     for lasname, vname in matched_files:
@@ -288,6 +439,13 @@ def create_process_db_sqlite(testname, matched_files):
         feature = None
         pid += 1
 
+    datasource = None
+    if several_tests:
+        con = sqlite.connect(db_name)
+        con.execute(CREATE_TEST_STATUS_TABLE)
+        con.commit()
+        con.close()
+
     return db_name
 
 
@@ -312,7 +470,8 @@ def main(args):
     return_code, matched_files, args = setup_job(QC_WRAP_NAMES,
                                                  QC_WRAP_DEFAULTS,
                                                  pargs.__dict__,
-                                                 pargs.param_file)
+                                                 pargs.param_file,
+                                                 several_tests=True)
     if return_code != 0:
         #something went wrong - msg. should have been displayed
         return return_code
@@ -326,12 +485,25 @@ def main(args):
     ## Start processing loop   #
     ############################
 
-    testname = args["TESTNAME"]
-    use_ref_data = qc.tests[args["TESTNAME"]][0]
+    testnames = split_testnames(args["TESTNAME"])
+    # several tests share a table in the process db
+    testname = "_".join(testnames)
+    use_ref_data = any(qc.tests[name][0] for name in testnames)
     if len(matched_files) > 0:
+        if args["COST_ORDER"]:
+            # longest job first - ids of the tiles in the process db will follow the cost
+            costs = estimate_costs(matched_files, testname, args["COST_DB"])
+            order = sorted(range(len(matched_files)), key=lambda i: -costs[i])
+            matched_files = [matched_files[i] for i in order]
+            if args["SPATIAL_ORDER"]:
+                print("Ordering tiles by cost - ignoring SPATIAL_ORDER.")
+                args["SPATIAL_ORDER"] = False
+        elif args["SPATIAL_ORDER"]:
+            # ids of the tiles in the process db will follow the curve
+            order = constants.spatial_order([constants.get_tilename(lasname) for lasname, _ in matched_files])
+            matched_files = [matched_files[i] for i in order]
         #Create db for process control...
-        lock = multiprocessing.Lock()
-        db_name = create_process_db_sqlite(testname, matched_files)
+        db_name = create_process_db_sqlite(testname, matched_files, len(testnames) > 1)
         if db_name is None:
             print("Something wrong - process control db not created.")
             return 1
@@ -346,22 +518,109 @@ def main(args):
         if args["RUN_ID"] is not None:
             print("Run-id is set to: %d" % args["RUN_ID"])
         print("Using process db: " + db_name)
-
-        tasks = []
-        for i in range(n_tasks):
-            test_args = (i, testname, db_name, args["TARGS"], args["RUN_ID"],
-                         args["USE_LOCAL"], args["SCHEMA"], use_ref_data, lock)
-            worker = multiprocessing.Process(
+        tile_cache = None
+        if args["TILE_CACHE"]:
+            # the cache lives as long as the job - in shared memory if possible
+            cache_dir = tempfile.mkdtemp(prefix="dhmqc_tiles_", dir=SHM_DIR if os.path.isdir(SHM_DIR) else None)
+            tile_cache = (cache_dir, args["TILE_CACHE"])
+            print("Using a tile cache of %d MB in %s" % (args["TILE_CACHE"], cache_dir))
+
+        # The tiles are handed out one at a time to idle processes, which send back the results.
+        # Only this process writes to the process db.
+        tiles = dict((fid, (lasname, vname)) for fid, (lasname, vname) in enumerate(matched_files))
+        pending = sorted(tiles)
+        tasks = [None] * n_tasks
+        task_queues = [None] * n_tasks
+        # receiving ends of the result pipes of the processes (None when closed)
+        result_pipes = [None] * n_tasks
+        # id of the tile being processed by each process and when it was handed out
+        current = [None] * n_tasks
+        t_current = [None] * n_tasks
+        # number of times each tile has been handed out
+        attempts = dict.fromkeys(tiles, 0)
+        done = set()
+        runtimes = []
+        # processes waiting for a tile to make a second attempt of
+        idle = set()
+        # with spatial order each process starts on an even share of the curve and continues from its last tile
+        next_ids = [(i * len(matched_files)) // n_tasks if args["SPATIAL_ORDER"] else None for i in range(n_tasks)]
+        con = sqlite.connect(db_name)
+        started = []
+        finished = []
+
+        def start_worker(p_number):
+            task_queues[p_number] = multiprocessing.Queue()
+            result_pipes[p_number], sender = multiprocessing.Pipe(duplex=False)
+            test_args = (p_number, args["TESTNAME"], task_queues[p_number], sender, args["TARGS"],
+                         args["RUN_ID"], args["USE_LOCAL"], args["SCHEMA"], args["INDEX_CACHE"], tile_cache)
+            tasks[p_number] = multiprocessing.Process(
                 target=run_check,
                 args=test_args)
-            tasks.append(worker)
-            worker.start()
+            tasks[p_number].start()
+            # only the process holds the sending end - so we see end of file if it stops
+            sender.close()
+
+        def stop_worker(p_number):
+            # the process has its own result pipe, so terminating it cannot disturb the others
+            tasks[p_number].terminate()
+            tasks[p_number].join()
+            close_pipe(p_number)
+            if tile_cache is not None:
+                pointcloud.release_tile_locks(tile_cache[0], tasks[p_number].pid)
+
+        def close_pipe(p_number):
+            if result_pipes[p_number] is not None:
+                result_pipes[p_number].close()
+                result_pipes[p_number] = None
+
+        def receive_results():
+            # wait for results from any of the processes
+            pipes = [pipe for pipe in result_pipes if pipe is not None]
+            results = []
+            for pipe in wait_for_results(pipes, POLL_INTERVAL) if pipes else []:
+                p_number = result_pipes.index(pipe)
+                try:
+                    results.append(pipe.recv())
+                except (EOFError, OSError):
+                    # the process has stopped - handled below
+                    close_pipe(p_number)
+            if not pipes:
+                time.sleep(POLL_INTERVAL)
+            return results
+
+        def dispatch(p_number):
+            # hand out the next tile to a process - a second attempt of a slow tile at the end of the
+            # run if allowed - or tell it to stop
+            fid = None
+            if pending:
+                fid = take_tile(pending, next_ids[p_number])
+                if next_ids[p_number] is not None:
+                    next_ids[p_number] = fid + 1
+            elif args["SPECULATE"]:
+                fid = find_straggler(current, t_current, attempts, runtimes, time.time())
+                if fid is None:
+                    # keep the process until the end of the run
+                    idle.add(p_number)
+                    return
+                print("[qc_wrap]: Starting a second attempt of tile %d" % fid)
+            idle.discard(p_number)
+            current[p_number] = fid
+            if fid is None:
+                task_queues[p_number].put(None)
+                return
+            t_current[p_number] = time.time()
+            attempts[fid] += 1
+            started.append((p_number, time.asctime(), attempts[fid], fid))
+            task_queues[p_number].put((fid,) + tiles[fid])
+
+        for i in range(n_tasks):
+            start_worker(i)
+            dispatch(i)
 
         #Now watch the processing#
-        con = sqlite.connect(db_name)
-        cur = con.cursor()
         n_todo = len(matched_files)
         n_crashes = 0
+        n_respawns = 0
         n_done = 0
         n_err = 0
         n_left = n_todo
@@ -370,27 +629,70 @@ def main(args):
         time1 = time.time()  #we don't wanne measure cpu-time here...
         t_last_report = 0
         t_last_status = time1
+        t_last_write = time1
 
         while n_alive > 0 and n_left > 0:
-            time.sleep(5)
-
-            try:
-                cur.execute("""SELECT COUNT()
-                               FROM {test}
-                               WHERE status>?""".format(test=testname), (STATUS_PROCESSING,))
-            except sqlite.OperationalError as err_msg:
-                print('Database Error: {msg}. Trying again.'.format(msg=err_msg))
-                continue
-
-            n_done = cur.fetchone()[0]
+            for result in receive_results():
+                p_number, fid, status = result[:3]
+                current[p_number] = None
+                if fid not in done:
+                    done.add(fid)
+                    finished.append(result)
+                    runtimes.append(result[6])
+                    n_done += 1
+                    if status == STATUS_ERROR:
+                        n_err += 1
+                    # stop other attempts of the tile - they would just hold up the run. There are no other
+                    # tiles left to do for those processes.
+                    for i, other in enumerate(current):
+                        if other == fid and i != p_number:
+                            print("[qc_wrap]: Stopping other attempt of tile %d in process %d" % (fid, i))
+                            stop_worker(i)
+                            current[i] = None
+                if tasks[p_number].is_alive():
+                    dispatch(p_number)
+            for i, task in enumerate(tasks):
+                if task.is_alive() or current[i] is None:
+                    continue
+                # the process died while working on a tile - try the tile again, unless it is also being
+                # processed elsewhere, and start a new process.
+                fid = current[i]
+                current[i] = None
+                n_crashes += 1
+                print("[qc_wrap]: Process %d stopped while processing tile %d" % (i, fid))
+                close_pipe(i)
+                if tile_cache is not None:
+                    pointcloud.release_tile_locks(tile_cache[0], task.pid)
+                if fid not in done and fid not in current:
+                    if attempts[fid] <= args["RETRIES"]:
+                        bisect.insort(pending, fid)
+                    else:
+                        done.add(fid)
+                        finished.append((i, fid, STATUS_ERROR, -1, "process stopped", time.asctime(),
+                                         time.time() - t_current[i], []))
+                        n_done += 1
+                        n_err += 1
+                if n_respawns < n_tasks * (args["RETRIES"] + 1):
+                    n_respawns += 1
+                    start_worker(i)
+                    dispatch(i)
+            for i in list(idle):
+                if tasks[i].is_alive():
+                    dispatch(i)
+                else:
+                    idle.discard(i)
+            now = time.time()
+            if len(started) + len(finished) >= DB_BATCH_SIZE or now - t_last_write > DB_WRITE_INTERVAL:
+                write_status(con, testname, started, finished)
+                del started[:]
+                del finished[:]
+                t_last_write = now
             n_alive = 0
             for task in tasks:
                 n_alive += task.is_alive()
 
-            #n_left: those tiles which have status 0 or STATUS_PROCESSING
             n_left = n_todo - n_done
             f_done = (float(n_done) / n_todo) * 100
-            now = time.time()
             delta_t = now - time1
             dt_last_report = now - t_last_report
             dt_last_status = now - t_last_status
@@ -405,33 +707,27 @@ def main(args):
                              "estimated time left: {3:s}, active: {4:d}"
                 print(status_msg.format(testname, f_done, n_left, t_left, n_alive))
 
-                cur.execute("""SELECT COUNT()
-                               FROM {test}
-                               WHERE status=?""".format(test=testname), (STATUS_ERROR,))
-
-                n_err = cur.fetchone()[0]
                 if n_err > 0:
                     print("[qc_wrap]: {0:d} exceptions caught. Check sqlite-db.".format(n_err))
                 t_last_report = now
                 if args["status_update"] and dt_last_status > args["STATUS_INTERVAL"]:
                     args["status_update"].update(args["TESTNAME"], n_done, n_err, n_alive)
                     t_last_status = now
-            #Try to keep n_tasks alive... If n_left>n_alive,
-            # which means that there could be some with status 0 still left...
-            if n_alive < n_tasks and n_left > n_alive:
-                print("[qc_wrap]: A process seems to have stopped...")
-                n_crashes += 1
+        write_status(con, testname, started, finished)
+        for i, task in enumerate(tasks):
+            if task.is_alive():
+                task_queues[i].put(None)
+            task.join()
         time2 = time.time()
         print("Running time %s" % (timedelta(seconds=time2 - time1)))
-        cur.execute("SELECT COUNT() FROM " + testname + " WHERE status>?", (STATUS_PROCESSING,))
-        n_done = cur.fetchone()[0]
-        cur.execute("SELECT COUNT() FROM " + testname + " WHERE status=?", (STATUS_ERROR,))
-        n_err = cur.fetchone()[0]
         print("[qc_wrap]: Did {0:d} tile(s).".format(n_done))
+        if n_crashes > 0:
+            print("[qc_wrap]: {0:d} process(es) stopped while processing a tile.".format(n_crashes))
         if n_err > 0:
             print("[qc_wrap]: {0:d} exceptions caught - check logfile(s)!".format(n_err))
-        cur.close()
         con.close()
+        if tile_cache is not None:
+            shutil.rmtree(tile_cache[0], ignore_errors=True)
 
     print("qc_wrap finished at %s" % (time.asctime()))
     if args["post_execute"] is not None:
@@ -26,7 +26,8 @@
 // https://github.com/delfrrr/delaunator-cpp
 // (commit: 6e9799316001ccb3f1e067029a7bf9eb3b95c6e6)
 // Modified to include copyright information and to work around min/max
-// macros on Windows.
+// macros on Windows, and to triangulate a caller owned coordinate buffer
+// without copying it.
 // 
 // Delaunator-cpp is a port of https://github.com/mapbox/delaunator
 //     ISC License
@@ -132,9 +133,23 @@ inline std::pair<double, double> circumcenter(
     return std::make_pair(x, y);
 }
 
+// Read only view of a flat (x0, y0, x1, y1, ...) coordinate buffer.
+struct coords_view {
+    double const* data;
+    std::size_t n;
+
+    double operator[](std::size_t i) const {
+        return data[i];
+    }
+
+    std::size_t size() const {
+        return n;
+    }
+};
+
 struct compare {
 
-    std::vector<double> const& coords;
+    coords_view const& coords;
     double cx;
     double cy;
 
@@ -207,7 +222,7 @@ struct DelaunatorPoint {
 class Delaunator {
 
 public:
-    std::vector<double> const& coords;
+    coords_view const coords;
     std::vector<std::size_t> triangles;
     std::vector<std::size_t> halfedges;
     std::vector<std::size_t> hull_prev;
@@ -216,6 +231,7 @@ public:
     std::size_t hull_start;
 
     Delaunator(std::vector<double> const& in_coords);
+    Delaunator(double const* in_coords, std::size_t n_coords);
 
     double get_hull_area();
 
@@ -239,7 +255,11 @@ private:
 };
 
 Delaunator::Delaunator(std::vector<double> const& in_coords)
-    : coords(in_coords),
+    : Delaunator(in_coords.data(), in_coords.size()) {
+}
+
+Delaunator::Delaunator(double const* in_coords, std::size_t n_coords)
+    : coords{ in_coords, n_coords },
       triangles(),
       halfedges(),
       hull_prev(),
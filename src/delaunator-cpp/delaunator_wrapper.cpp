@@ -24,32 +24,38 @@
 #endif
 
 extern "C" {
-    SHARED_EXPORT void triangulate(unsigned long long num_vertices, double *vertices, int *ptr_num_faces, int **ptr_faces)
+    /* Triangulate and return faces and (optionally) half-edges as malloc'ed int arrays of size 3*num_faces.
+       halfedges[e] is the opposite half-edge of e (edge e goes from vertex e to vertex next(e) of triangle e/3), or -1 on the hull. */
+    SHARED_EXPORT void triangulate_halfedges(unsigned long long num_vertices, double *vertices, int *ptr_num_faces, int **ptr_faces, int **ptr_halfedges)
     {
-        std::vector<double> coords;
-        
-        //TODO can the vector be constructed directly from the pointer?
-        for (unsigned long long i = 0; i < num_vertices; i++)
-        {
-            coords.push_back(vertices[2*i + 0]);
-            coords.push_back(vertices[2*i + 1]);
-        }
-        
-        // Actually perform triangulation
-        delaunator::Delaunator triangulation(coords);
+        // Actually perform triangulation - directly on the caller's buffer
+        delaunator::Delaunator triangulation(vertices, 2 * num_vertices);
         
         int num_faces = triangulation.triangles.size() / 3;
         int *faces = (int *)malloc(num_faces * 3 * sizeof(int));
         
-        for (int i = 0; i < num_faces; i++)
+        for (int i = 0; i < 3 * num_faces; i++)
         {
-            faces[3*i + 0] = triangulation.triangles[3*i + 0];
-            faces[3*i + 1] = triangulation.triangles[3*i + 1];
-            faces[3*i + 2] = triangulation.triangles[3*i + 2];
+            faces[i] = triangulation.triangles[i];
         }
-        
         *ptr_faces = faces;
         *ptr_num_faces = num_faces;
+        
+        if (ptr_halfedges)
+        {
+            int *halfedges = (int *)malloc(num_faces * 3 * sizeof(int));
+            for (int i = 0; i < 3 * num_faces; i++)
+            {
+                std::size_t e = triangulation.halfedges[i];
+                halfedges[i] = (e == delaunator::INVALID_INDEX) ? -1 : (int) e;
+            }
+            *ptr_halfedges = halfedges;
+        }
+    }
+    
+    SHARED_EXPORT void triangulate(unsigned long long num_vertices, double *vertices, int *ptr_num_faces, int **ptr_faces)
+    {
+        triangulate_halfedges(num_vertices, vertices, ptr_num_faces, ptr_faces, NULL);
     }
     
     SHARED_EXPORT void free_face_data(int **ptr_faces)
@@ -298,42 +298,48 @@ int fill_spatial_index(int *sorted_flat_indices, int *index, int npoints, int ma
 
 
 
-/* this will simply give us slices to boxes around the box of each pt. - the finer details are left to the filter func-*/
-static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, double *vals_out, int *spatial_index, double *header,  int npoints, FILTER_FUNC filter_func,  double filter_rad, double nd_val, void *opt_params){
-	int i,j, ind1,ind2, nfound, slices[6],r,c,r1,c1,c2,ncols,nrows;
-	double x1,y2,cs,zz, frad2;
+/* find the slices of the spatial index covering the 3x3 cells around a point - returns the number of points in the slices or -1 if the point is outside the index*/
+static int get_slices(double *xy, int *spatial_index, double *header, int *slices){
+	int j, ind1, ind2, nfound=0, r, c, r1, c1, c2, ncols, nrows;
+	double x1,y2,cs;
 	ncols=(int) header[0];
 	nrows=(int) header[1];
 	x1=header[2];
 	y2=header[3];
 	cs=header[4];
+	c=(int) ((xy[0]-x1)/cs);
+	r=(int) ((y2-xy[1])/cs);
+	/*should ensure that c-1 can never be larger than ncols-1, etc*/
+	if (c<-1 || c>ncols || r<-1 || r>nrows)
+		return -1;
+	/*perhaps do something if we fall suficciently outside region*/
+	for(j=-1;j<2;j++){
+		r1=r+j;
+		if (r1<0 || r1>=nrows){ /*empty slice*/
+			slices[2*j+2]=0;
+			slices[2*j+3]=0;
+			continue;
+		}
+		
+		c1=MAX((c-1),0);
+		c2=MIN((c+1),(ncols-1));
+		ind1=r1*ncols+c1;
+		ind2=r1*ncols+c2;
+		slices[2*j+2]=spatial_index[2*ind1]; /*start of left cell*/
+		slices[2*j+3]=spatial_index[2*ind2+1]; /*end of right included cell*/
+		nfound+=slices[2*j+3]-slices[2*j+2];
+	}
+	return nfound;
+}
+
+/* this will simply give us slices to boxes around the box of each pt. - the finer details are left to the filter func-*/
+static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, double *vals_out, int *spatial_index, double *header,  int npoints, FILTER_FUNC filter_func,  double filter_rad, double nd_val, void *opt_params){
+	int i, nfound, slices[6];
+	double zz, frad2;
 	frad2=SQUARE(filter_rad);
-	/*unsigned long mf=0;*/
 	for(i=0; i<npoints; i++){
 		vals_out[i]=nd_val;
-		c=(int) ((xy[2*i]-x1)/cs);
-		r=(int) ((y2-xy[2*i+1])/cs);
-		/*should ensure that c-1 can never be larger than ncols-1, etc*/
-		if (c<-1 || c>ncols || r<-1 || r>nrows)
-			continue;
-		/*perhaps do something if we fall suficciently outside region*/
-		nfound=0;
-		for(j=-1;j<2;j++){
-			r1=r+j;
-			if (r1<0 || r1>=nrows){ /*empty slice*/
-				slices[2*j+2]=0;
-				slices[2*j+3]=0;
-				continue;
-			}
-			
-			c1=MAX((c-1),0);
-			c2=MIN((c+1),(ncols-1));
-			ind1=r1*ncols+c1;
-			ind2=r1*ncols+c2;
-			slices[2*j+2]=spatial_index[2*ind1]; /*start of left cell*/
-			slices[2*j+3]=spatial_index[2*ind2+1]; /*end of right included cell*/
-			nfound+=slices[2*j+3]-slices[2*j+2];
-		}
+		nfound=get_slices(xy+2*i,spatial_index,header,slices);
 		if (nfound>0){
 			if (z)
 				zz=z[i];
@@ -341,17 +347,67 @@ static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, dou
 				zz=-1;
 			vals_out[i]=filter_func(xy+2*i,zz,slices,pc_xy,pc_z,frad2,nd_val,opt_params); /*the filter func should know how many params there are - or we can terminate list by something...*/
 		}
-		/*DEBUG*/
-		/*if (nfound==0 || vals_out[i]==nd_val){
-			printf("Oh no: %.2f %.2f %d %d, ind: %d, pn: %d, all: %d\n",xy[2*i],xy[2*i+1],r,c,r*ncols+c,i,npoints);
-			for(j=0;j<3;j++)
-				printf("i1: %d i2: %d\n",slices[2*j],slices[2*j+1]);
-		}*/
-		
-		
 	} /*end rows*/
 }
 
+/* Calculate several statistics in one visit of each neighbourhood. vals_out has nstats values pr. input point (row major), the statistics are given by the codes in stats (see MULTI_* in header)*/
+void pc_multi_filter(double *xy, double *pc_xy, double *pc_z, double *vals_out, double filter_rad, double nd_val, int *stats, int nstats, int *spatial_index, double *header, int npoints){
+	int i,k,l,i1,i2,j,n,nfound,slices[6];
+	double frad2,d,zmin,zmax,m,m2,dmin,val,*out;
+	frad2=SQUARE(filter_rad);
+	for(i=0; i<npoints; i++){
+		n=0;
+		zmin=HUGE_VAL;
+		zmax=-HUGE_VAL;
+		m=0;
+		m2=0;
+		dmin=HUGE_VAL;
+		nfound=get_slices(xy+2*i,spatial_index,header,slices);
+		for(k=0; k<3 && nfound>0; k++){
+			i1=slices[2*k];
+			i2=slices[2*k+1];
+			for(j=i1;j<i2;j++){
+				d=SQUARE((pc_xy[2*j]-xy[2*i]))+SQUARE((pc_xy[2*j+1]-xy[2*i+1]));
+				if (d<dmin)
+					dmin=d;
+				if (d<=frad2){
+					zmin=MIN(zmin,pc_z[j]);
+					zmax=MAX(zmax,pc_z[j]);
+					m+=pc_z[j];
+					m2+=SQUARE(pc_z[j]);
+					n++;
+				}
+			}
+		}
+		out=vals_out+i*nstats;
+		for(l=0; l<nstats; l++){
+			switch(stats[l]){
+				case MULTI_MIN:
+					val=(n>0)? zmin : nd_val;
+					break;
+				case MULTI_MAX:
+					val=(n>0)? zmax : nd_val;
+					break;
+				case MULTI_MEAN:
+					val=(n>0)? m/n : nd_val;
+					break;
+				case MULTI_VAR:
+					val=(n>1)? (m2/n-SQUARE((m/n))) : nd_val;
+					break;
+				case MULTI_COUNT:
+					val=(double) n;
+					break;
+				case MULTI_DIST:
+					val=(dmin<HUGE_VAL)? sqrt(dmin) : nd_val;
+					break;
+				default:
+					val=nd_val;
+			}
+			out[l]=val;
+		}
+	}
+}
+
 static double min_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j, n=0;
 	double m=HUGE_VAL,d;
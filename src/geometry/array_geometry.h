@@ -29,5 +29,13 @@ void pc_idw_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, doubl
 void pc_var_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints);
 void pc_density_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, int *spatial_index, double *header, int npoints);
 void pc_density_filter(double *xy,double *pc_xy, double *pc_z, double *z_out, double filter_rad, int *spatial_index, double *header, int npoints);
+/* statistics for pc_multi_filter */
+#define MULTI_MIN (0)
+#define MULTI_MAX (1)
+#define MULTI_MEAN (2)
+#define MULTI_VAR (3)
+#define MULTI_COUNT (4)
+#define MULTI_DIST (5)
+void pc_multi_filter(double *xy, double *pc_xy, double *pc_z, double *vals_out, double filter_rad, double nd_val, int *stats, int nstats, int *spatial_index, double *header, int npoints);
 void moving_bins(double *z, int *nout, double rad, int n);
 void binary_fill_gaps(char *M, char *out, int nrows, int ncols);
\ No newline at end of file
@@ -28,13 +28,15 @@
 #define MIN(a,b)  (a<b ? (a):(b))
 #define MEPS -1e-7
 #define ABS(x)  (x>0? x: -x)
+#define SQUARE(x) ((x)*(x))
 #define STEPX(k) (k<2?(k):(3-k))
 #define DEFAULT_MASK 100
-#define EXTRA_SLOTS  4
+#define SCAN_EPS 1e-9
+#define WALK_MAX_STEPS 64
+#define WALK_MAX_JUMP 8 /*only walk if the previous point is within this many index cells*/
 
 
 static int bc2(double *p0, double *p1, double *p2, double *p3, double *b);
-static int *append(int *list, int n);
 static void user2array(double *p, int *carr,double *extent, double cs);
 static void user2array2(double *p, double *carr,double *extent, double cs);
 static void reweight(double *b, double *z, int *c);
@@ -145,43 +147,147 @@ static int bc2(double *p0, double *p1, double *p2, double *p3, double *b){
 }
 
 
-/* Append positive number to a 'set' of positive numbers... */
-static int *append(int *list, int n){
-	int found = 0, room;
-	if (list==NULL){
-		list=malloc(sizeof(int)*(3+EXTRA_SLOTS));
-		list[0]=3+EXTRA_SLOTS; /*number allocated*/
-		list[1]=1; /*cells used*/
-		list[2]=n;
-		return list;
-	}
-	/* not needed - triangles are treated sequentially */
-	/*for(i=2;i<(list[1]+2) && !found; i++){
-		if (list[i]==n)
-			found=1;
-			
-	}*/
-	if (!found){
-		list[1]++;
-		room=list[1]+2;
-		if (room>list[0]){ /*if not room*/
-			list[0]=room+EXTRA_SLOTS;
-			list=realloc(list,sizeof(int)*(room+EXTRA_SLOTS)); /*allocate one more slot than needed*/
-		}	
-		list[list[1]+1]=n;
+/* Visit the index cells hit by triangle i. If tri_ids is NULL, count the hit in cells[grid_index],
+*  else store i at tri_ids[cells[grid_index]] and increment that position. Returns 0 on success.*/
+static int index_triangle(double *pts, int *tri, int i, double *extent, double cs, int ncols, int ncells, int *cells, int *tri_ids){
+	int j,k,I[2],J[2],r,c,mask_rows,mask_cols,*vertex;
+	double *p,p1[2],p2[2],inters[2],parr[6];
+	char *mask, default_mask[DEFAULT_MASK*DEFAULT_MASK],is_allocated=0; /*for storing cell housekeeping array*/
+	I[0] = I[1] = 0;
+	J[0] = J[1] = 0;
+	#ifdef _DEBUG
+	printf("Looking at triangle: %d\n",i);
+	#endif
+	vertex=tri+3*i;
+	for(j=0;j<3;j++){
+		p=pts+(*(vertex+j))*2;
+		/*user2array2(p,parr+2*j,extent,cs);*/
+		parr[2*j+1]=((extent[3]-p[1])/cs);
+		parr[2*j]=((p[0]-extent[0])/cs);
+		#ifdef _DEBUG
+		printf("Array coords of vertex %d: x: %.2f, y: %.2f\n",j,parr[2*j],parr[2*j+1]);
+		#endif
+		r=(int) parr[2*j+1];
+		c=(int) parr[2*j];
+		#ifdef _DEBUG
+		if ((r*c)>=ncells || r<0 || c<0){
+			printf("ERROR: %d %d, x: %.2f, y: %.2f\n,",r,c,p[0],p[1]);
+		}
+		#endif
+		if (j==0){
+			I[0]=I[1]=r;
+			J[0]=J[1]=c;
+		}
+		else{
+			I[0]=MIN(I[0],r);
+			J[0]=MIN(J[0],c);
+			I[1]=MAX(I[1],r);
+			J[1]=MAX(J[1],c);
+		}
 	}
-		
-	return list;
-	
+	mask_rows=(I[1]-I[0]+1);
+	mask_cols=(J[1]-J[0]+1);
+	#ifdef _DEBUG
+	printf("Mask rows: %d, mask cols: %d\n",mask_rows,mask_cols);
+	printf("I: %d %d, J: %d %d\n",I[0],I[1],J[0],J[1]);
+	#endif
+	mask=NULL;
+	if (mask_rows>1 && mask_cols>1){
+		/*TODO: transform to array coords to speed things up!!*/
+		int chit[2],ch,nintersect;
+		if (mask_rows<DEFAULT_MASK && mask_cols<DEFAULT_MASK){
+			mask=default_mask;
+			for(r=0;r<mask_rows;r++){
+				for(c=0;c<mask_cols;c++){
+					mask[r*mask_cols+c]=0;
+				}
+			}
+			is_allocated=0;
+		}
+		else{
+			mask=calloc(mask_rows*mask_cols,sizeof(char));
+			is_allocated=1;
+			if (!mask)
+				return 1;
+		}
+		for(r=1;r<mask_rows; r++){
+			/*loop over inner hlines*/
+			p1[0]=J[0];
+			p2[0]=J[1]+1;
+			p1[1]=p2[1]=I[0]+r;
+			nintersect=0;
+			chit[1]=-1;
+			chit[0]=mask_cols+1;
+			for(k=0;k<3;k++){
+				if (line_intersection(p1,p2,parr+k*2,parr+((k+1)%3)*2,inters)){
+					/*hmmm might as well calc span here*/
+					ch=(int) (inters[0]-J[0]);
+					chit[0]=MIN(ch,chit[0]);
+					chit[1]=MAX(ch,chit[1]);
+					nintersect+=1;
+				}
+			}
+			if (nintersect>0){
+				for(k=chit[0];k<=chit[1];k++){
+					if (nintersect>1)
+						mask[(r-1)*mask_cols+k]=1;
+					mask[r*mask_cols+k]=1;
+				}
+			}
+		}
+		for(c=1;c<mask_cols; c++){
+			/*loop over inner vlines*/
+			p1[1]=I[0];
+			p2[1]=I[1]+1;
+			p1[0]=p2[0]=J[0]+c;
+			nintersect=0;
+			chit[1]=-1;
+			chit[0]=mask_rows+1;
+			for(k=0;k<3;k++){
+				if (line_intersection(p1,p2,parr+2*k,parr+((k+1)%3)*2,inters)){
+					/*hmmm might as well calc span here*/
+					ch=(int) (inters[1]-I[0]);
+					chit[0]=MIN(ch,chit[0]);
+					chit[1]=MAX(ch,chit[1]);
+					nintersect+=1;
+				}
+			}
+			if (nintersect>0){
+				for(k=chit[0];k<=chit[1];k++){
+					if (nintersect>1)
+						mask[k*mask_cols+(c-1)]=1; /*left*/
+					mask[k*mask_cols+c]=1; /*right*/
+				}
+			}
+		}
+	} /*end dotest*/
+	for(r=I[0]; r<=I[1]; r++){
+		for(c=J[0];c<=J[1];c++){
+			int grid_index=r*ncols+c;
+			if (grid_index<ncells){
+				if (mask==NULL || mask[(r-I[0])*mask_cols+(c-J[0])]){
+					if (tri_ids)
+						tri_ids[cells[grid_index]++]=i;
+					else
+						cells[grid_index]++;
+				}
+			}
+			else
+				printf("ERROR: Bad index %d, I: %d %d, J: %d %d, r: %d, c: %d, ncols: %d\n",grid_index,I[0],I[1],J[0],J[1],r,c,ncols);
+		}
+	} /*end insert triangle */
+	if (mask!=NULL && is_allocated)
+		free(mask);
+	return 0;
 }
 
 /*Builds the spatial index*/
+/* The index is stored csr style: the triangles hitting cell i are tri_ids[offsets[i]:offsets[i+1]].
+*  Built in two passes over the triangles - first counting the hits per cell, then filling in the triangle ids.*/
 /* Beware of overflow for more than 2 billion triangles - triangle uses ints*/
 spatial_index *build_index(double *pts, int *tri, double cs, int n, int m){
-	int i,j,k,ncols,nrows,I[2],J[2],nhits=0,r,c,mask_rows,mask_cols,*vertex, ncells;
-	double extent[4],*p,p1[2],p2[2],inters[2],parr[6];
-	int **index_arr;
-	char *mask, default_mask[DEFAULT_MASK*DEFAULT_MASK],is_allocated=0; /*for storing cell housekeeping array*/
+	int i,ncols,nrows,nhits,ncells,*offsets=NULL,*tri_ids=NULL,*pos=NULL;
+	double extent[4];
 	spatial_index *ind;
 	extent[0]=pts[0];
 	extent[1]=pts[1];
@@ -193,12 +299,10 @@ spatial_index *build_index(double *pts, int *tri, double cs, int n, int m){
 		extent[2]=MAX(extent[2],pts[2*i]);
 		extent[3]=MAX(extent[3],pts[2*i+1]);
 	}
-	I[0] = I[1] = 0;
-	J[0] = J[1] = 0;
 	#ifdef _DEBUG
 	printf("Building index...\nPoint extent: %.2f %.2f %.2f %.2f\n",extent[0],extent[1],extent[2],extent[3]);
 	#endif
-	if (cs<0){ /*signal to guess a proper cell size*/
+	if (cs<=0){ /*signal to guess a proper cell size*/
 		double den;
 		den=n/((extent[2]-extent[0])*(extent[3]-extent[1]));
 		cs=sqrt(3/den);
@@ -217,177 +321,88 @@ spatial_index *build_index(double *pts, int *tri, double cs, int n, int m){
 	#ifdef _DEBUG
 	printf("Virtual rows and columns: %d %d , size: %d\n",nrows,ncols,ncells);
 	#endif
-	index_arr=calloc(ncells,sizeof(int*));
-	/*loop over triangles*/
+	offsets=calloc(ncells+1,sizeof(int));
+	pos=malloc(sizeof(int)*ncells);
+	if (!offsets || !pos)
+		goto INDEX_ERR;
+	/*first pass: count hits per cell*/
 	for(i=0; i<m; i++){
-		#ifdef _DEBUG
-		printf("Looking at triangle: %d\n",i);
-		#endif
-		vertex=tri+3*i;
-		for(j=0;j<3;j++){
-			p=pts+(*(vertex+j))*2;
-			/*user2array2(p,parr+2*j,extent,cs);*/
-			parr[2*j+1]=((extent[3]-p[1])/cs);
-			parr[2*j]=((p[0]-extent[0])/cs);
-			#ifdef _DEBUG
-			printf("Array coords of vertex %d: x: %.2f, y: %.2f\n",j,parr[2*j],parr[2*j+1]);
-			#endif
-			r=(int) parr[2*j+1];
-			c=(int) parr[2*j];
-			#ifdef _DEBUG
-			if ((r*c)>=ncells || r<0 || c<0){
-				printf("ERROR: %d %d, x: %.2f, y: %.2f\n,",r,c,p[0],p[1]);
-				/*return NULL;*/
-			}
-			#endif
-			if (j==0){
-				I[0]=I[1]=r;
-				J[0]=J[1]=c;
-			}
-			else{
-				I[0]=MIN(I[0],r);
-				J[0]=MIN(J[0],c);
-				I[1]=MAX(I[1],r);
-				J[1]=MAX(J[1],c);
-			}
-		}
-		mask_rows=(I[1]-I[0]+1);
-		mask_cols=(J[1]-J[0]+1);
-		#ifdef _DEBUG
-		printf("Mask rows: %d, mask cols: %d\n",mask_rows,mask_cols);
-		printf("I: %d %d, J: %d %d\n",I[0],I[1],J[0],J[1]);
-		if (mask_rows>100 || mask_cols>100)
-			return NULL;
-		#endif
-		mask=NULL;
-		if (mask_rows>1 && mask_cols>1){
-			/*TODO: transform to array coords to speed things up!!*/
-			int chit[2],ch,nintersect;
-			if (mask_rows<DEFAULT_MASK && mask_cols<DEFAULT_MASK){
-				mask=default_mask;
-				for(r=0;r<mask_rows;r++){
-					for(c=0;c<mask_cols;c++){
-						mask[r*mask_cols+c]=0;
-					}
-				}
-				is_allocated=0;
-			}
-			else{
-				mask=calloc(mask_rows*mask_cols,sizeof(char));
-				is_allocated=1;
-				if (!mask)
-					goto INDEX_ERR;
-			}
-			for(r=1;r<mask_rows; r++){
-				/*loop over inner hlines*/
-				
-				p1[0]=J[0];
-				p2[0]=J[1]+1;
-				p1[1]=p2[1]=I[0]+r;
-				nintersect=0;
-				chit[1]=-1;
-				chit[0]=mask_cols+1;
-				#ifdef _DEBUG
-				printf("Mask row: %d\n",r);
-				printf("Line: %.2f,%.2f to %.2f,%.2f\n",p1[0],p1[1],p2[0],p2[1]);
-				#endif
-				
-				for(k=0;k<3;k++){
-					if (line_intersection(p1,p2,parr+k*2,parr+((k+1)%3)*2,inters)){
-						/*hmmm might as well calc span here*/
-						ch=(int) (inters[0]-J[0]);
-						chit[0]=MIN(ch,chit[0]);
-						chit[1]=MAX(ch,chit[1]);
-						nintersect+=1;
-					}
-				}
-				#ifdef _DEBUG
-				printf("Intersections: %d\n",nintersect);
-				#endif
-				if (nintersect>0){
-					for(k=chit[0];k<=chit[1];k++){
-						if (nintersect>1)
-							mask[(r-1)*mask_cols+k]=1;
-						mask[r*mask_cols+k]=1;
-					}
-				}
-				
-			}
-			
-			for(c=1;c<mask_cols; c++){
-				/*loop over inner vlines*/
-				p1[1]=I[0];
-				p2[1]=I[1]+1;
-				p1[0]=p2[0]=J[0]+c;
-				nintersect=0;
-				chit[1]=-1;
-				chit[0]=mask_rows+1;
-				#ifdef _DEBUG
-				printf("Mask col: %d\n",c);
-				printf("Line: %.2f,%.2f to %.2f,%.2f\n",p1[0],p1[1],p2[0],p2[1]);
-				#endif
-				for(k=0;k<3;k++){
-					if (line_intersection(p1,p2,parr+2*k,parr+((k+1)%3)*2,inters)){
-						/*hmmm might as well calc span here*/
-						ch=(int) (inters[1]-I[0]);
-						chit[0]=MIN(ch,chit[0]);
-						chit[1]=MAX(ch,chit[1]);
-						nintersect+=1;
-					}
-				}
-				
-				if (nintersect>0){
-					for(k=chit[0];k<=chit[1];k++){
-						if (nintersect>1)
-							mask[k*mask_cols+(c-1)]=1; /*left*/
-						mask[k*mask_cols+c]=1; /*right*/
-					}
-				}
-				
-			}
-		} /*end dotest*/
-		for(r=I[0]; r<=I[1]; r++){
-			for(c=J[0];c<=J[1];c++){
-				int grid_index=r*ncols+c;
-				/*if (i%1000==0)
-					printf("r: %d, c: %d, grid_index: %d\n",r,c,grid_index);*/
-				if (grid_index<ncells){
-					if (mask==NULL || mask[(r-I[0])*mask_cols+(c-J[0])]){
-						index_arr[grid_index]=append(index_arr[grid_index],i);
-						nhits++;
-						/*if (i%1000==0)
-							printf("Size of list is now: %d\n",size);*/
-							
-					}
-					
-				}
-				else
-					printf("ERROR: Bad index %d, I: %d %d, J: %d %d, r: %d, c: %d, nrows: %d, ncols: %d\n",grid_index,I[0],I[1],J[0],J[1],r,c,nrows,ncols);
-				
-				
-			}
-			
-		} /*end insert triangle */
-		if (mask!=NULL && is_allocated)
-			free(mask);
-		
-	} /*end loop over triangles*/
+		if (index_triangle(pts,tri,i,extent,cs,ncols,ncells,offsets+1,NULL))
+			goto INDEX_ERR;
+	}
+	for(i=0; i<ncells; i++)
+		offsets[i+1]+=offsets[i];
+	nhits=offsets[ncells];
+	tri_ids=malloc(sizeof(int)*(nhits+1));
+	if (!tri_ids)
+		goto INDEX_ERR;
+	/*second pass: fill in triangle ids - in increasing order within each cell*/
+	memcpy(pos,offsets,sizeof(int)*ncells);
+	for(i=0; i<m; i++){
+		if (index_triangle(pts,tri,i,extent,cs,ncols,ncells,pos,tri_ids))
+			goto INDEX_ERR;
+	}
+	free(pos);
 	ind=malloc(sizeof(struct index));
+	if (!ind){
+		pos=NULL;
+		goto INDEX_ERR;
+	}
 	ind->ncols=ncols;
+	ind->nrows=nrows;
 	ind->cs=cs;
 	memcpy(ind->extent,extent,sizeof(double)*4);
-	ind->index_arr=index_arr;
+	ind->offsets=offsets;
+	ind->tri_ids=tri_ids;
+	ind->owns_arrays=1;
 	ind->npoints=n;
 	ind->ntri=m;
 	ind->ncells=ncells;
+	ind->nhits=nhits;
 	return ind;
 	INDEX_ERR:
 		puts("Failed to allocate space!\n");
-		if (index_arr)
-			/*TODO: free all sub-arrays*/
-			free(index_arr);
+		free(offsets);
+		free(tri_ids);
+		free(pos);
 		return NULL;
-	
+
+}
+
+/* Get the index geometry: extent (4), cell size, ncols, nrows, npoints, ntri, nhits - see INDEX_HEADER_SIZE*/
+void get_index_header(spatial_index *ind, double *header){
+	memcpy(header,ind->extent,sizeof(double)*4);
+	header[4]=ind->cs;
+	header[5]=ind->ncols;
+	header[6]=ind->nrows;
+	header[7]=ind->npoints;
+	header[8]=ind->ntri;
+	header[9]=ind->nhits;
+}
+
+/* Copy the csr arrays of an index - offsets must have room for ncells+1 and tri_ids for nhits entries*/
+void copy_index_arrays(spatial_index *ind, int *offsets, int *tri_ids){
+	memcpy(offsets,ind->offsets,sizeof(int)*(ind->ncells+1));
+	memcpy(tri_ids,ind->tri_ids,sizeof(int)*ind->nhits);
+}
+
+/* Wrap existing (e.g. saved and memory mapped) csr arrays in an index. The arrays are not copied and must outlive the index.*/
+spatial_index *index_from_arrays(double *header, int *offsets, int *tri_ids){
+	spatial_index *ind=malloc(sizeof(struct index));
+	if (!ind)
+		return NULL;
+	memcpy(ind->extent,header,sizeof(double)*4);
+	ind->cs=header[4];
+	ind->ncols=(int) header[5];
+	ind->nrows=(int) header[6];
+	ind->npoints=(int) header[7];
+	ind->ntri=(int) header[8];
+	ind->nhits=(int) header[9];
+	ind->ncells=ind->ncols*ind->nrows;
+	ind->offsets=offsets;
+	ind->tri_ids=tri_ids;
+	ind->owns_arrays=0;
+	return ind;
 }
 
 /*Inspect a spatial index */
@@ -395,7 +410,6 @@ void inspect_index(spatial_index *ind, char *buf, int buf_len){
 	int i, nhit=0,nmax=0;
 	unsigned long nbytes=0;
 	double nav=0;
-	int **arr=ind->index_arr;
 	char *pos=buf;
 	pos+=sprintf(pos,"************Index inspection***********\n");
 	if (pos-buf<buf_len-20)
@@ -408,13 +422,12 @@ void inspect_index(spatial_index *ind, char *buf, int buf_len){
 		pos+=sprintf(pos,"Virtual 'Grid' extent: %.2f %.2f %.2f %.2f\n",ind->extent[0],ind->extent[1],ind->extent[2],ind->extent[3]);
 	if (pos-buf<buf_len-30)
 		pos+=sprintf(pos,"Triangulated points: %d, triangles: %d\n",ind->npoints,ind->ntri);
-	nbytes=(ind->ncells*sizeof(int*));
+	nbytes=(ind->ncells+1+ind->nhits)*sizeof(int);
 	for (i=0; i<ind->ncells; i++){
-		if (arr[i]!=NULL){
-			int nhere=arr[i][1];
+		int nhere=ind->offsets[i+1]-ind->offsets[i];
+		if (nhere>0){
 			nmax=MAX(nhere,nmax);
 			nav+=((double) nhere)/ind->ncells;
-			nbytes+=(arr[i][0])*sizeof(int);
 			nhit++;
 		}
 	}
@@ -428,37 +441,29 @@ void inspect_index(spatial_index *ind, char *buf, int buf_len){
 		pos+=sprintf(pos,"Average: %.2f\n",nav);
 	if (pos-buf<buf_len-20)
 		pos+=sprintf(pos,"Memory usage: %.1f kb\n",((double) nbytes)/1e3);
-	
+
 }
 
 /* free a spatial index */
 void free_index(spatial_index *ind){
-	int i;
 	if (!ind)
 		return;
-	for (i=0; i<ind->ncells; i++){
-		if (ind->index_arr[i]!=NULL)
-			free(ind->index_arr[i]);
+	if (ind->owns_arrays){
+		free(ind->offsets);
+		free(ind->tri_ids);
 	}
-	free(ind->index_arr);
 	free(ind);
 }
 
+/* Kept for compatibility - the csr index is already compact.*/
 void optimize_index(spatial_index *ind){
-	int i;
-	int **arr=ind->index_arr;
-	for (i=0; i<ind->ncells; i++){
-		if (arr[i]!=NULL && arr[i][0]>(arr[i][1]+2)){
-			arr[i]=realloc(arr[i],sizeof(int)*(arr[i][1]+2));
-			arr[i][0]=arr[i][1]+2;
-		}
-	}
+	return;
 }
 
 
 void find_triangle(double *pts, int *out, double *base_pts,int *tri, spatial_index *ind,char *mask, int np){
 	int I[2],i,j,k,grid_index,ncols,ncells;
-	int **arr=ind->index_arr;
+	int *offsets=ind->offsets,*ids=ind->tri_ids;
 	double b[3];
 	ncols=ind->ncols;
 	ncells=ind->ncells;
@@ -472,10 +477,9 @@ void find_triangle(double *pts, int *out, double *base_pts,int *tri, spatial_ind
 		printf("Grid index: %d\n",grid_index);
 		#endif
 		out[i]=-2; /*signals outside triangulation */
-		if (0<=grid_index && grid_index<ncells && arr[grid_index]!=NULL){
-			int *list=arr[grid_index];
-			for(k=2;k<2+list[1];k++){
-				j=list[k];
+		if (0<=grid_index && grid_index<ncells){
+			for(k=offsets[grid_index];k<offsets[grid_index+1];k++){
+				j=ids[k];
 				if (bc2(pts+2*i,base_pts+(2*tri[3*j]),base_pts+(2*tri[3*j+1]),base_pts+(2*tri[3*j+2]),b)){
 					if (mask==NULL || mask[j])
 						out[i]=j; 
@@ -494,7 +498,7 @@ void find_triangle(double *pts, int *out, double *base_pts,int *tri, spatial_ind
 
 void interpolate(double *pts, double *base_pts, double *base_z, double *out, double nd_val, int *tri, spatial_index *ind,char *mask, int np){
 	int I[2],i,j,k,grid_index,ncols,ncells;
-	int **arr=ind->index_arr;
+	int *offsets=ind->offsets,*ids=ind->tri_ids;
 	double b[3],z_int;
 	ncols=ind->ncols;
 	ncells=ind->ncells;
@@ -508,10 +512,9 @@ void interpolate(double *pts, double *base_pts, double *base_z, double *out, dou
 		printf("Grid index: %d\n",grid_index);
 		#endif
 		out[i]=nd_val;
-		if (0<=grid_index && grid_index<ncells && arr[grid_index]!=NULL){
-			int *list=arr[grid_index];
-			for(k=2;k<2+list[1];k++){
-				j=list[k];
+		if (0<=grid_index && grid_index<ncells){
+			for(k=offsets[grid_index];k<offsets[grid_index+1];k++){
+				j=ids[k];
 				if (bc2(pts+2*i,base_pts+(2*tri[3*j]),base_pts+(2*tri[3*j+1]),base_pts+(2*tri[3*j+2]),b)){
 					if (mask==NULL || mask[j]){
 						z_int=b[0]*base_z[tri[3*j]]+b[1]*base_z[tri[3*j+1]]+b[2]*base_z[tri[3*j+2]];
@@ -534,8 +537,152 @@ void interpolate(double *pts, double *base_pts, double *base_z, double *out, dou
 
 
 	
+/* Calculate triangle adjacency: nb[3*t+k] is the triangle sharing the edge (tri[3*t+k],tri[3*t+(k+1)%3]) with t, or -1 at the hull. Returns 0 on success.*/
+int triangle_neighbours(int *tri, int *nb, int ntri, int npoints){
+	int *offsets, *incident, *pos, t, k, a, b, m, s, l;
+	offsets=calloc(npoints+1,sizeof(int));
+	pos=calloc(npoints,sizeof(int));
+	incident=malloc(sizeof(int)*(3*((long) ntri)+1));
+	if (!offsets || !pos || !incident){
+		free(offsets);
+		free(pos);
+		free(incident);
+		return 1;
+	}
+	/* triangles incident to each vertex (csr style)*/
+	for(t=0; t<3*ntri; t++)
+		offsets[tri[t]+1]++;
+	for(k=0; k<npoints; k++)
+		offsets[k+1]+=offsets[k];
+	for(t=0; t<ntri; t++){
+		for(k=0; k<3; k++){
+			a=tri[3*t+k];
+			incident[offsets[a]+pos[a]]=t;
+			pos[a]++;
+		}
+	}
+	for(t=0; t<ntri; t++){
+		for(k=0; k<3; k++){
+			a=tri[3*t+k];
+			b=tri[3*t+(k+1)%3];
+			nb[3*t+k]=-1;
+			for(m=offsets[a]; m<offsets[a+1] && nb[3*t+k]<0; m++){
+				s=incident[m];
+				if (s==t)
+					continue;
+				for(l=0; l<3; l++){
+					if (tri[3*s+l]==b){
+						nb[3*t+k]=s;
+						break;
+					}
+				}
+			}
+		}
+	}
+	free(offsets);
+	free(pos);
+	free(incident);
+	return 0;
+}
+
+/* Locate the triangle containing p via the triangle index. Returns -1 if not found.*/
+static int index_locate(double *p, double *base_pts, int *tri, spatial_index *ind, double *b){
+	int I[2],k,j,grid_index;
+	int *offsets=ind->offsets,*ids=ind->tri_ids;
+	user2array(p,I,ind->extent,ind->cs);
+	grid_index=I[0]*ind->ncols+I[1];
+	if (0<=grid_index && grid_index<ind->ncells){
+		for(k=offsets[grid_index];k<offsets[grid_index+1];k++){
+			j=ids[k];
+			if (bc2(p,base_pts+(2*tri[3*j]),base_pts+(2*tri[3*j+1]),base_pts+(2*tri[3*j+2]),b))
+				return j;
+		}
+	}
+	return -1;
+}
+
+/* Locate the triangle containing p by walking from the triangle start - crossing an edge which separates the current triangle from p.
+*  Returns -1 if the walk leaves the triangulation or takes too many steps.*/
+static int walk_locate(double *p, double *base_pts, int *tri, int *nb, int start, double *b){
+	int t=start, k, steps, next;
+	double *pa, *pb, *pc, e[2], d[2], s;
+	for(steps=0; steps<WALK_MAX_STEPS && t>=0; steps++){
+		pa=base_pts+2*tri[3*t];
+		pb=base_pts+2*tri[3*t+1];
+		pc=base_pts+2*tri[3*t+2];
+		e[0]=pb[0]-pa[0];
+		e[1]=pb[1]-pa[1];
+		d[0]=pc[0]-pa[0];
+		d[1]=pc[1]-pa[1];
+		s=DET(e,d); /*orientation of the triangle*/
+		next=-2;
+		for(k=0; k<3; k++){
+			pa=base_pts+2*tri[3*t+k];
+			pb=base_pts+2*tri[3*t+(k+1)%3];
+			e[0]=pb[0]-pa[0];
+			e[1]=pb[1]-pa[1];
+			d[0]=p[0]-pa[0];
+			d[1]=p[1]-pa[1];
+			if (DET(e,d)*s<0){ /*p is on the other side of this edge*/
+				next=nb[3*t+k];
+				break;
+			}
+		}
+		if (next==-2){
+			if (bc2(p,base_pts+(2*tri[3*t]),base_pts+(2*tri[3*t+1]),base_pts+(2*tri[3*t+2]),b))
+				return t;
+			return -1;
+		}
+		t=next;
+	}
+	return -1;
+}
+
+/* As find_triangle, but walks from the previous hit using the triangle adjacency nb - falls back to the index if walking fails. Can be faster for densely sampled, ordered input.*/
+void find_triangle_walk(double *pts, int *out, double *base_pts,int *tri, int *nb, spatial_index *ind, char *mask, int np){
+	int i,j,last=-1;
+	double b[3],*last_pt=NULL,max_jump2=SQUARE(WALK_MAX_JUMP*ind->cs);
+	for(i=0; i<np; i++){
+		j=-1;
+		if (last>=0 && SQUARE(pts[2*i]-last_pt[0])+SQUARE(pts[2*i+1]-last_pt[1])<max_jump2)
+			j=walk_locate(pts+2*i,base_pts,tri,nb,last,b);
+		if (j<0)
+			j=index_locate(pts+2*i,base_pts,tri,ind,b);
+		if (j<0){
+			out[i]=-2; /*signals outside triangulation */
+			continue;
+		}
+		last=j;
+		last_pt=pts+2*i;
+		if (mask==NULL || mask[j])
+			out[i]=j;
+		else
+			out[i]=-1; /*signals invalid triangle*/
+	}
+}
+
+/* As interpolate, but locates triangles by walking - see find_triangle_walk*/
+void interpolate_walk(double *pts, double *base_pts, double *base_z, double *out, double nd_val, int *tri, int *nb, spatial_index *ind, char *mask, int np){
+	int i,j,last=-1;
+	double b[3],*last_pt=NULL,max_jump2=SQUARE(WALK_MAX_JUMP*ind->cs);
+	for(i=0; i<np; i++){
+		out[i]=nd_val;
+		j=-1;
+		if (last>=0 && SQUARE(pts[2*i]-last_pt[0])+SQUARE(pts[2*i+1]-last_pt[1])<max_jump2)
+			j=walk_locate(pts+2*i,base_pts,tri,nb,last,b);
+		if (j<0)
+			j=index_locate(pts+2*i,base_pts,tri,ind,b);
+		if (j<0)
+			continue;
+		last=j;
+		last_pt=pts+2*i;
+		if (mask==NULL || mask[j])
+			out[i]=b[0]*base_z[tri[3*j]]+b[1]*base_z[tri[3*j+1]]+b[2]*base_z[tri[3*j+2]];
+	}
+}
+
 void make_grid(double *base_pts,double *base_z, int *tri, float *grid, float *tgrid, float nd_val, int ncols, int nrows, double cx, double cy, double xl, double yu, spatial_index *ind){
-	int **arr=ind->index_arr,icols,icells,i,j,k,m,I[2];
+	int *offsets=ind->offsets,*ids=ind->tri_ids,icols,icells,i,j,k,m,I[2];
 	long grid_index;
 	double xy[2],b[3],z_int,*p1,*p2,*p3,x1,x2,y1,y2;
 	icols=ind->ncols;
@@ -553,10 +700,9 @@ void make_grid(double *base_pts,double *base_z, int *tri, float *grid, float *tg
 			/*printf("cell: (%d,%d), ind_coords: (%d,%d), real: %.3f %.3f\n",i,j,I[0],I[1],xy[0],xy[1]);
 			if (j>10)
 				return;*/
-			if (0<=grid_index && grid_index<icells && arr[grid_index]!=NULL){
-				int *list=arr[grid_index];
-				for(k=2;k<2+list[1];k++){
-					m=list[k];
+			if (0<=grid_index && grid_index<icells){
+				for(k=offsets[grid_index];k<offsets[grid_index+1];k++){
+					m=ids[k];
 					p1=base_pts+2*tri[3*m];
 					p2=base_pts+2*tri[3*m+1];
 					p3=base_pts+2*tri[3*m+2];
@@ -579,8 +725,82 @@ void make_grid(double *base_pts,double *base_z, int *tri, float *grid, float *tg
 	}
 }
 
+/* Grid by scan converting each triangle - no point location needed, so work is proportional to cells + triangles.
+*  Cell centers on shared edges will be assigned by the last triangle visited - the interpolated values agree (up to rounding) */
+void make_grid_scan(double *base_pts,double *base_z, int *tri, float *grid, float *tgrid, float nd_val, int ncols, int nrows, double cx, double cy, double xl, double yu, int ntri){
+	int i,j,k,m,r1,r2,c1,c2,ia,ib;
+	long n;
+	double *p[3],z[3],x1,x2,y1,y2,dx1,dy1,dx2,dy2,det,a,b,xy[2],xa,xb,x,zz,tsize;
+	n=((long) ncols)*nrows;
+	for(k=0; k<n; k++){
+		grid[k]=nd_val;
+		if (tgrid)
+			tgrid[k]=nd_val;
+	}
+	for(m=0; m<ntri; m++){
+		for(k=0; k<3; k++){
+			p[k]=base_pts+2*tri[3*m+k];
+			z[k]=base_z[tri[3*m+k]];
+		}
+		dx1=p[1][0]-p[0][0];
+		dy1=p[1][1]-p[0][1];
+		dx2=p[2][0]-p[0][0];
+		dy2=p[2][1]-p[0][1];
+		det=dx1*dy2-dy1*dx2;
+		if (ABS(det)<1e-15)
+			continue; /*degenerate triangle*/
+		/*plane: z=z0+a*(x-x0)+b*(y-y0)*/
+		a=((z[1]-z[0])*dy2-(z[2]-z[0])*dy1)/det;
+		b=(dx1*(z[2]-z[0])-dx2*(z[1]-z[0]))/det;
+		x1=MIN(MIN(p[0][0],p[1][0]),p[2][0]);
+		x2=MAX(MAX(p[0][0],p[1][0]),p[2][0]);
+		y1=MIN(MIN(p[0][1],p[1][1]),p[2][1]);
+		y2=MAX(MAX(p[0][1],p[1][1]),p[2][1]);
+		tsize=MAX(x2-x1,y2-y1);
+		/*rows with cell centers inside the vertical extent*/
+		r1=(int) ceil((yu-y2)/cy-0.5-SCAN_EPS);
+		r2=(int) floor((yu-y1)/cy-0.5+SCAN_EPS);
+		r1=MAX(r1,0);
+		r2=MIN(r2,nrows-1);
+		for(i=r1; i<=r2; i++){
+			xy[1]=yu-(i+0.5)*cy;
+			xa=HUGE_VAL;
+			xb=-HUGE_VAL;
+			/*intersect the row with the (non horizontal) edges*/
+			for(k=0; k<3; k++){
+				ia=k;
+				ib=(k+1)%3;
+				if (p[ia][1]==p[ib][1])
+					continue;
+				if (xy[1]<MIN(p[ia][1],p[ib][1]) || xy[1]>MAX(p[ia][1],p[ib][1]))
+					continue;
+				x=p[ia][0]+(xy[1]-p[ia][1])*(p[ib][0]-p[ia][0])/(p[ib][1]-p[ia][1]);
+				xa=MIN(xa,x);
+				xb=MAX(xb,x);
+			}
+			if (xa>xb)
+				continue;
+			c1=(int) ceil((xa-xl)/cx-0.5-SCAN_EPS);
+			c2=(int) floor((xb-xl)/cx-0.5+SCAN_EPS);
+			c1=MAX(c1,0);
+			c2=MIN(c2,ncols-1);
+			if (c1>c2)
+				continue;
+			xy[0]=xl+(c1+0.5)*cx;
+			/*incremental evaluation of the plane along the row*/
+			zz=z[0]+a*(xy[0]-p[0][0])+b*(xy[1]-p[0][1]);
+			for(j=c1; j<=c2; j++){
+				grid[i*ncols+j]=(float) zz;
+				if (tgrid)
+					tgrid[i*ncols+j]=(float) tsize;
+				zz+=a*cx;
+			}
+		}
+	}
+}
+
 void make_grid_low(double *base_pts,double *base_z, int *tri, float *grid,  float nd_val, int ncols, int nrows, double cx, double cy, double xl, double yu, double cut_off, spatial_index *ind){
-	int **arr=ind->index_arr,icols,icells,i,j,k,m,n,I[2];
+	int *offsets=ind->offsets,*ids=ind->tri_ids,icols,icells,i,j,k,m,n,I[2];
 	long grid_index;
 	double xy[2],b[3],z_int,*p1,*p2,*p3,z1,z2,z[3],w;
 	icols=ind->ncols;
@@ -596,10 +816,9 @@ void make_grid_low(double *base_pts,double *base_z, int *tri, float *grid,  floa
 			/*printf("cell: (%d,%d), ind_coords: (%d,%d), real: %.3f %.3f\n",i,j,I[0],I[1],xy[0],xy[1]);
 			if (j>10)
 				return;*/
-			if (0<=grid_index && grid_index<icells && arr[grid_index]!=NULL){
-				int *list=arr[grid_index];
-				for(k=2;k<2+list[1];k++){
-					m=list[k];
+			if (0<=grid_index && grid_index<icells){
+				for(k=offsets[grid_index];k<offsets[grid_index+1];k++){
+					m=ids[k];
 					p1=base_pts+2*tri[3*m];
 					p2=base_pts+2*tri[3*m+1];
 					p3=base_pts+2*tri[3*m+2];
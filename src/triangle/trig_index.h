@@ -14,11 +14,16 @@
  * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
  * 
  */
+/* Number of doubles in an index header - see get_index_header*/
+#define INDEX_HEADER_SIZE 10
+/* The triangles hitting cell i are tri_ids[offsets[i]:offsets[i+1]] (csr layout)*/
 struct index{
-	int ncols,npoints,ntri,ncells;
+	int ncols,nrows,npoints,ntri,ncells,nhits;
 	double extent[4];
 	double cs;
-	int **index_arr;
+	int *offsets;
+	int *tri_ids;
+	int owns_arrays; /*0 if the arrays are borrowed - see index_from_arrays*/
 };
 
 typedef struct index spatial_index;
@@ -28,10 +33,18 @@ typedef struct index spatial_index;
 void inspect_index(spatial_index *ind, char *buf, int buf_len);
 int line_intersection(double *p1,double *p2, double *p3, double *p4, double *out);
 spatial_index *build_index(double *pts, int *tri, double cs, int n, int m);
+void get_index_header(spatial_index *ind, double *header);
+void copy_index_arrays(spatial_index *ind, int *offsets, int *tri_ids);
+spatial_index *index_from_arrays(double *header, int *offsets, int *tri_ids);
 /*void find_triangle(double *pts, int *out, spatial_index *ind, double *eq, int np);*/
 void find_triangle(double *pts, int *out, double *base_pts,int *tri, spatial_index *ind, char *mask, int np);
 /*void find_appropriate_triangles(double *pts, int *out, double *base_pts, double *base_z, int *tri, spatial_index *ind, int np, double tol_xy, double tol_z);
 void interpolate(double *pts, double *z, double *out, double nd_val, double *eq, int *tri, spatial_index *ind, int np);*/
 void interpolate(double *pts, double *base_pts, double *base_z, double *out, double nd_val, int *tri, spatial_index *ind, char *mask, int np);
+void make_grid(double *base_pts,double *base_z, int *tri, float *grid, float *tgrid, float nd_val, int ncols, int nrows, double cx, double cy, double xl, double yu, spatial_index *ind);
+void make_grid_scan(double *base_pts,double *base_z, int *tri, float *grid, float *tgrid, float nd_val, int ncols, int nrows, double cx, double cy, double xl, double yu, int ntri);
+int triangle_neighbours(int *tri, int *nb, int ntri, int npoints);
+void find_triangle_walk(double *pts, int *out, double *base_pts,int *tri, int *nb, spatial_index *ind, char *mask, int np);
+void interpolate_walk(double *pts, double *base_pts, double *base_z, double *out, double nd_val, int *tri, int *nb, spatial_index *ind, char *mask, int np);
 void optimize_index(spatial_index *ind);
 void free_index(spatial_index *ind);
\ No newline at end of file
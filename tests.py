@@ -8,6 +8,7 @@ from qc.db import report
 from qc.thatsDEM import triangle
 from qc.thatsDEM import array_geometry
 from qc.thatsDEM import pointcloud
+from qc.thatsDEM import las_io
 
 import qc.density_check
 import qc.z_precision_roads
@@ -25,6 +26,7 @@ import qc.xy_precision_buildings
 import qc.wobbly_water
 import qc.dvr90_wrapper
 import qc.pc_repair_man
+import qc.tile_summary
 
 HERE = os.path.dirname(__file__)
 DEMO_FOLDER = os.path.join(HERE, 'demo')
@@ -68,6 +70,9 @@ class TestThatsDEM(object):
     def test_triangle(self):
         triangle.unit_test()
 
+    def test_las_io(self):
+        las_io.unit_test(LAS_DEMO)
+
 class TestKernels(object):
     '''
     Test QC kernels.
@@ -139,3 +144,7 @@ class TestKernels(object):
         rc = qc.pc_repair_man.main(('pc_repair_man', LAS_DEMO, OUTDIR, '-olaz'))
         assert rc == 0
 
+    def test_tile_summary(self):
+        rc = qc.tile_summary.main(('tile_summary', LAS_DEMO, OUTDIR, '-report', 'class_count', 'dates'))
+        assert rc == 0
+